@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 # 
-import pickle as pk
-import pandas as pd
+import logging
+import os
+import sys
 from math import ceil
 import dash
 from dash.dependencies import Input, Output
@@ -12,37 +13,56 @@ import dash_html_components as html
 # import base64
 from json_tricks import dumps, loads
 
-# ================== IMPORT DATA, METADATA, and MODEL
+# repo root (for the artifact, encoder, selection, and serving modules)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import encoder
+import selection
+import serving
 
-# DATA
-filename = 'Xraw_model1.pkl'
-with open(filename, 'rb') as input_file:
-    Xraw = pk.load(input_file)
+# log what is loaded at startup, and how long each file takes
+logging.basicConfig(level=logging.INFO)
 
-filename = 'yraw_model1.pkl'
-with open(filename, 'rb') as input_file:
-    yraw = pk.load(input_file)
+# ================== IMPORT DATA, METADATA, and MODEL
 
-filename = 'X_model1.pkl'
-with open(filename, 'rb') as input_file:
-    X = pk.load(input_file)
+# Every file is loaded on first use (see serving.py): serving needs only the
+# model, the column metadata, and the default row, never the training data.
+# The INSIGHT_MODEL environment variable picks the model (memory-mapped
+# artifact directory if present, else the pickle), e.g.
+# INSIGHT_MODEL=reg_model2_distilled for the distilled surrogate
+assets = serving.LazyAssets(serving.app_manifest(
+    model=os.environ.get('INSIGHT_MODEL', 'reg_model2')))
 
-filename = 'y_model1.pkl'
-with open(filename, 'rb') as input_file:
-    y = pk.load(input_file)
+# MODEL
+reg = assets['model']
 
-with open('column_info.pkl', 'rb') as input_file:
-    column_info = pk.load(input_file)
+# METADATA
+column_info = assets['column_info']
 column_info['name'] = [x.capitalize() for x in column_info['name']]
 
-# MODEL
-# filename = 'reg_model1.pkl'
-filename = 'reg_model2.pkl'
-with open(filename, 'rb') as input_file:
-    reg = pk.load(input_file)
+# DEFAULT ROW (feature column order & starting values)
+default_row = serving.default_row(assets)
+
+# model input columns: the artifact's own, else the reduced feature schema
+# (see selection.py), else all the columns
+feature_names = getattr(reg, 'feature_names', None)
+if feature_names is None:
+    feature_names = selection.load_schema('feature_schema.json')
+if feature_names is None:
+    feature_names = default_row['columns']
+
+# user data -> model input row, compiled once (see encoder.py)
+feature_encoder = encoder.FeatureEncoder(feature_names, column_info)
+
+# bounded LRU cache of predictions by input row: inputs users come back to
+# skip the model (hit rate at /cache_stats, see serving.PredictionCache)
+prediction_cache = serving.PredictionCache(reg.predict, maxsize=4096)
 
 # ================= SETUP CATEGORICAL OPTIONS LIST
 
+# only offer the terms the model uses: the reduced feature schema drops some
+# dummies (see selection.py), and selecting those would not change anything
+input_info = column_info.loc[column_info.index.isin(feature_names)]
+
 def get_options_list(column_info, cat_column):
     filt = column_info[cat_column]
     label_names = column_info[filt]['name'].tolist()
@@ -53,24 +73,24 @@ def get_options_list(column_info, cat_column):
     return options
 
 # (1) Conditions
-cond_options = get_options_list(column_info, 'is_cond_')
+cond_options = get_options_list(input_info, 'is_cond_')
 
 # (2) Interventions
-intv_options = get_options_list(column_info, 'is_intv_')
+intv_options = get_options_list(input_info, 'is_intv_')
 
 # (3) Intervention types
-intvtype_options = get_options_list(column_info, 'is_intvtype_')
+intvtype_options = get_options_list(input_info, 'is_intvtype_')
 
 # (4) Keywords
-keyword_options = get_options_list(column_info, 'is_keyword_')
+keyword_options = get_options_list(input_info, 'is_keyword_')
 
 # (5) Phase
-phase_options = get_options_list(column_info, 'is_phase')
+phase_options = get_options_list(input_info, 'is_phase')
 
 
 # ================== SETUP DEFAULT DATA (DICT)
 
-userdata = dict(**Xraw.iloc[0], **yraw.iloc[0])
+userdata = dict(default_row['row'])
 
 # set userdata to initial values
 
@@ -90,6 +110,9 @@ userdata['arms'] = 1 # - 1 arm
 userdata['duration'] = 12*5 # 5 year study
 userdata['minage'] = 18 # minimum age 18
 
+# read-only template of the callbacks' user data (see update_userdata)
+default_userdata = dict(userdata)
+
 # ================== GET CURRENT CATEGORICAL CHOICES/VALUE SETS
 def get_value_list(userdata, column_info, cat_column):
     colnames = column_info[column_info[cat_column]].index.tolist()
@@ -100,24 +123,31 @@ def get_value_list(userdata, column_info, cat_column):
     return values
 
 # (1) Conditions
-cond_values = get_value_list(userdata, column_info, 'is_cond_')
+cond_values = get_value_list(userdata, input_info, 'is_cond_')
 
 # (2) Interventions
-intv_values = get_value_list(userdata, column_info, 'is_intv_')
+intv_values = get_value_list(userdata, input_info, 'is_intv_')
 
 # (3) Intervention types
-intvtype_value = get_value_list(userdata, column_info, 'is_intvtype_')[0]
+intvtype_value = (get_value_list(userdata, input_info, 'is_intvtype_')
+                  or [None])[0]
 
 # (4) Keywords
-keyword_values = get_value_list(userdata, column_info, 'is_keyword_')
+keyword_values = get_value_list(userdata, input_info, 'is_keyword_')
 
 # (5) Phase
-phase_values = get_value_list(userdata, column_info, 'is_phase')
+phase_values = get_value_list(userdata, input_info, 'is_phase')
 
 
 #  =================  BUILD DASH APP LAYOUT
 app = dash.Dash()
 
+# WSGI entry point for production serving with several workers, e.g.
+#   cd app && gunicorn -c gunicorn.conf.py app:server
+# (gunicorn.conf.py preloads this module, so the model is loaded once before
+# the workers fork and shared copy-on-write; see loadtest.py)
+server = app.server
+
 app.css.append_css({"external_url": "https://codepen.io/chriddyp/pen/bWLwgP.css"})
 
 app.layout = html.Div(children=[
@@ -319,19 +349,17 @@ style={'margins': 'auto'}
     Output('pred_report', 'children'),
     [Input('data_holder', 'children')]
     )
-def update_predictions(json_userdata, reg=reg, Xraw=Xraw):
+def update_predictions(json_userdata, prediction_cache=prediction_cache,
+                       feature_encoder=feature_encoder):
 
     # De-serialize data
     userdata = dict(loads(json_userdata))
-    del userdata['droprate']
 
-    # Format data to array for model input
-    newXraw = Xraw.iloc[:0]
-    newXraw = newXraw.append(userdata, ignore_index=True)
-    newX = newXraw.as_matrix()
+    # Format data to array for model input (one row, in model column order)
+    newX = feature_encoder.encode(userdata)
 
     # Predict dropout rate & create associated string
-    pred_droprate = reg.predict(newX)[0]
+    pred_droprate = prediction_cache.predict(newX)[0]
     pred_enroll = userdata['completed'] / (1-pred_droprate)
     pred_droprate_str = ('Your predicted dropout rate is {}%, so you should ' + 
         'plan to enroll {:d} participants ').format(
@@ -362,8 +390,12 @@ def update_predictions(json_userdata, reg=reg, Xraw=Xraw):
 def update_userdata(participants_text, malefraction_text, minage_text,
     duration_slider, arms_slider, num_facilities_slider,
     has_us_facility_radio, intvtype_dropdown, cond_dropdown, intv_dropdown,
-    phase_checklist, keyword_dropdown,
-    userdata=userdata, column_info=column_info):
+    phase_checklist, keyword_dropdown, feature_encoder=feature_encoder):
+
+    # Fresh copy of the defaults per call: every field below is set from this
+    # request's inputs, so nothing is shared between users, threads, or workers
+    # (the session's state lives in the browser, in the data_holder div)
+    userdata = dict(default_userdata)
 
     # Modify user data
     userdata['completed'] = int(participants_text)
@@ -374,45 +406,12 @@ def update_userdata(participants_text, malefraction_text, minage_text,
     userdata['facilities'] = num_facilities_slider
     userdata['usfacility'] = has_us_facility_radio
 
-    # Set intervention class options as T/F according to selected
-    intvtype_names = column_info[column_info['is_intvtype_']].index.tolist()
-    for n in intvtype_names:
-        userdata[n] = False
-        if intvtype_dropdown is not None:
-            if n in intvtype_dropdown:
-                userdata[n] = True
-
-    # Set condition MeSh terms options as T/F according to selected
-    cond_names = column_info[column_info['is_cond_']].index.tolist()
-    for n in cond_names:
-        userdata[n] = False
-        if cond_dropdown is not None:
-            if n in cond_dropdown:
-                userdata[n] = True
-
-    # Set intervention MeSh terms options as T/F according to selected
-    intv_names = column_info[column_info['is_intv_']].index.tolist()
-    for n in intv_names:
-        userdata[n] = False
-        if intv_dropdown is not None:
-            if n in intv_dropdown:
-                userdata[n] = True
-
-    # Set phase as T/F according to selected
-    phase_names = column_info[column_info['is_phase']].index.tolist()
-    for n in phase_names:
-        userdata[n] = False
-        if phase_checklist is not None:
-            if n in phase_checklist:
-                userdata[n] = True
-
-    # Set keywords T/F according to selected
-    keyword_names = column_info[column_info['is_keyword_']].index.tolist()
-    for n in keyword_names:
-        userdata[n] = False
-        if keyword_dropdown is not None:
-            if n in keyword_dropdown:
-                userdata[n] = True                
+    # Set the dummies of each group as T/F according to selected
+    feature_encoder.set_group(userdata, 'is_intvtype_', intvtype_dropdown)
+    feature_encoder.set_group(userdata, 'is_cond_', cond_dropdown)
+    feature_encoder.set_group(userdata, 'is_intv_', intv_dropdown)
+    feature_encoder.set_group(userdata, 'is_phase', phase_checklist)
+    feature_encoder.set_group(userdata, 'is_keyword_', keyword_dropdown)
 
     # Return json serialzed userdata
     return dumps(userdata)
@@ -447,6 +446,12 @@ def update_report(input_value):
     return outstr
 
 
+# Prediction cache statistics (hits, misses, hit_rate, size, maxsize)
+@server.route('/cache_stats')
+def cache_stats():
+    return dumps(prediction_cache.stats())
+
+
 # MAIN
 if __name__ == '__main__':
     app.run_server(debug=True)
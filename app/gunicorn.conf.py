@@ -0,0 +1,30 @@
+"""
+gunicorn.conf - production serving of the dashboard
+===================================================
+
+**gunicorn.conf** runs the dashboard (app.py's ``server``) with several
+prefork worker processes. The app module, and with it the model, column
+metadata, and compiled encoder, is imported once in the master before the
+workers fork (preload_app), so every worker shares the same copy-on-write
+pages instead of loading its own model. Per-user state lives in the browser
+(the data_holder div), not in the workers. Usage, from the app directory::
+
+    gunicorn -c gunicorn.conf.py app:server
+
+The INSIGHT_WORKERS, INSIGHT_THREADS, and INSIGHT_BIND environment variables
+override the defaults below (see loadtest.py for throughput vs workers).
+"""
+
+import multiprocessing
+import os
+
+bind = os.environ.get('INSIGHT_BIND', '0.0.0.0:8050')
+
+# model loaded once, before forking
+preload_app = True
+
+# one worker per core: predictions are CPU bound
+workers = int(os.environ.get('INSIGHT_WORKERS', multiprocessing.cpu_count()))
+threads = int(os.environ.get('INSIGHT_THREADS', 1))
+
+timeout = 30
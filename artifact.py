@@ -0,0 +1,232 @@
+"""
+artifact - versioned, memory-mappable model artifacts
+=====================================================
+
+**artifact** saves models as a directory holding a small JSON metadata file
+(schema, version, model kind, feature-column order, ...) plus one .npy file per
+large array. Loading memory-maps the arrays read-only, so every app worker
+process shares the same physical pages instead of unpickling a private copy,
+and startup no longer needs to import sklearn or rebuild python objects.
+
+Layout of an artifact directory::
+
+    <path>/meta.json
+    <path>/<array name>.npy     (one per array of the predictor)
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+from forest import FlatForest
+from quantile import QuantileForest
+
+SCHEMA = 'insight-model-artifact'
+VERSION = 1
+META_FILENAME = 'meta.json'
+
+
+class LinearPredictor:
+    """ Linear model y = X.coef + intercept (e.g. an exported Lasso)
+
+    Args:
+        coef (array): coefficients, shape (n_features,)
+        intercept (array): intercept, shape (1,)
+    """
+
+    arrays = ('coef', 'intercept')
+
+    def __init__(self, coef, intercept):
+        self.coef = coef
+        self.intercept = intercept
+
+    @classmethod
+    def from_sklearn(cls, reg):
+        """ Export a fitted sklearn linear model (coef_, intercept_), or a
+        pipeline of a StandardScaler and a linear model (e.g. train's Lasso),
+        with the scaling folded into the coefficients
+        """
+        if hasattr(reg, 'steps'):
+            (scaler, reg) = (reg.steps[0][1], reg.steps[-1][1])
+            scale = 1. if scaler.scale_ is None else scaler.scale_
+            mean = (0. if scaler.mean_ is None or not scaler.with_mean
+                    else scaler.mean_)
+            coef = np.asarray(reg.coef_, dtype=np.float64).ravel()/scale
+            intercept = np.atleast_1d(reg.intercept_ - np.dot(mean, coef))
+            return cls(coef, intercept.astype(np.float64))
+        return cls(np.asarray(reg.coef_, dtype=np.float64).ravel(),
+                   np.atleast_1d(reg.intercept_).astype(np.float64))
+
+    @property
+    def attrs(self):
+        """ Non-array constructor arguments """
+        return {}
+
+    def predict(self, X):
+        """ Predict the response for X """
+        return X @ self.coef + self.intercept[0]
+
+
+# model kind name -> predictor class
+KINDS = {'flatforest': FlatForest,
+         'linear': LinearPredictor,
+         'quantileforest': QuantileForest}
+
+
+def to_predictor(model):
+    """ Convert a fitted sklearn model to the matching artifact predictor
+    (models that already are predictors are returned as-is). Quantile forests
+    keep their per-leaf training targets (QuantileForest)
+    """
+    if isinstance(model, tuple(KINDS.values())):
+        return model
+    if hasattr(model, 'quantile_forest_'):
+        # train.QuantileRandomForest
+        return model.quantile_forest_
+    if hasattr(model, 'y_train_leaves_'):
+        return QuantileForest.from_qrf(model)
+    if hasattr(model, 'tree_') or hasattr(model, 'estimators_'):
+        return FlatForest.from_sklearn(model)
+    if hasattr(model, 'coef_') or hasattr(model, 'steps'):
+        return LinearPredictor.from_sklearn(model)
+    raise TypeError('No artifact format for {}'.format(type(model).__name__))
+
+
+def save_artifact(model, path, feature_names, metadata=None):
+    """ Save a model as an artifact directory
+
+    Args:
+        model (estimator or predictor): fitted sklearn model (converted with
+            to_predictor()) or a predictor from KINDS
+        path (str): artifact directory (created if needed)
+        feature_names (list): feature column names, in model-input order
+
+    Kwargs:
+        metadata (dict or None): extra JSON-serializable info to store, e.g.
+            {'response_transform': 'cuberoot'}
+
+    Returns:
+        meta (dict): the metadata written to <path>/meta.json
+    """
+    pred = to_predictor(model)
+    kind = [k for (k, cls) in KINDS.items() if isinstance(pred, cls)][0]
+    os.makedirs(path, exist_ok=True)
+
+    arrays = {}
+    for name in pred.arrays:
+        arr = np.ascontiguousarray(getattr(pred, name))
+        np.save(os.path.join(path, name + '.npy'), arr)
+        arrays[name] = {'dtype': arr.dtype.str, 'shape': list(arr.shape)}
+
+    meta = {'schema': SCHEMA,
+            'version': VERSION,
+            'kind': kind,
+            'feature_names': list(feature_names),
+            'attrs': pred.attrs,
+            'arrays': arrays,
+            'metadata': metadata or {},
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+    # write meta.json last (& atomically) so a complete meta.json means a
+    # complete artifact
+    tmpname = os.path.join(path, META_FILENAME + '.tmp')
+    with open(tmpname, 'w') as output_file:
+        json.dump(meta, output_file, indent=1)
+    os.replace(tmpname, os.path.join(path, META_FILENAME))
+
+    return meta
+
+
+def read_meta(path):
+    """ Read and check the metadata of an artifact directory """
+    with open(os.path.join(path, META_FILENAME), 'r') as input_file:
+        meta = json.load(input_file)
+
+    if meta.get('schema') != SCHEMA:
+        raise ValueError('{} is not a model artifact'.format(path))
+    if meta['version'] > VERSION:
+        raise ValueError('Artifact {} has version {}, newer than supported '
+                         'version {}'.format(path, meta['version'], VERSION))
+    if meta['kind'] not in KINDS:
+        raise ValueError('Unknown artifact kind {}'.format(meta['kind']))
+
+    return meta
+
+
+def load_artifact(path, mmap=True):
+    """ Load a model artifact
+
+    Args:
+        path (str): artifact directory
+
+    Kwargs:
+        mmap (bool): If True (default), memory-map the arrays read-only so they
+            are shared between processes. If False, read them into memory
+
+    Returns:
+        pred (predictor): predictor object with a predict() method, plus
+            attributes 'feature_names' (list) and 'meta' (dict)
+    """
+    meta = read_meta(path)
+    mmap_mode = 'r' if mmap else None
+
+    cls = KINDS[meta['kind']]
+    arrays = {}
+    for name in cls.arrays:
+        arrays[name] = np.load(os.path.join(path, name + '.npy'),
+                               mmap_mode=mmap_mode)
+
+    pred = cls(**arrays, **meta['attrs'])
+    pred.feature_names = meta['feature_names']
+    pred.meta = meta
+
+    return pred
+
+
+def load_model(path):
+    """ Load a model from either an artifact directory or a pickle file """
+    if os.path.isdir(path):
+        return load_artifact(path)
+
+    import pickle as pk
+    with open(path, 'rb') as input_file:
+        return pk.load(input_file)
+
+
+def benchmark_load(pkl_path, artifact_path, n_repeats=5):
+    """ Compare cold-start time of loading a pickled model vs. an artifact
+
+    Each load runs in a fresh python process (so imports, e.g. of sklearn for
+    the pickle, are included) and predicts one all-zeros row.
+
+    Args:
+        pkl_path (str): pickled model file
+        artifact_path (str): artifact directory of the same model
+
+    Kwargs:
+        n_repeats (int): number of processes to time per format. Default 5
+
+    Returns:
+        result (dict): best-of-n_repeats seconds for 'pickle' and 'artifact'
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    n_features = len(read_meta(artifact_path)['feature_names'])
+    script = ('import sys, time; t0 = time.perf_counter(); '
+              'sys.path.insert(0, {!r}); import artifact, numpy; '
+              'm = artifact.load_model({{!r}}); '
+              'm.predict(numpy.zeros((1, {:d}))); '
+              'print(time.perf_counter() - t0)').format(here, n_features)
+
+    result = {}
+    for (name, path) in [('pickle', pkl_path), ('artifact', artifact_path)]:
+        times = []
+        for _ in range(n_repeats):
+            out = subprocess.check_output(
+                [sys.executable, '-c', script.format(os.path.abspath(path))])
+            times.append(float(out.decode().strip().splitlines()[-1]))
+        result[name] = min(times)
+        print('{}: {:0.1f} ms'.format(name, result[name]*1e3))
+
+    return result
@@ -0,0 +1,306 @@
+"""
+benchmark - model performance benchmarks with regression thresholds
+===================================================================
+
+**benchmark** times the playground model families (Lasso, decision tree,
+random forest, quantile random forest) on the committed model data
+(data/X_model1.pkl, data/y_model1.pkl) and on synthetic scaled-up copies of
+it. For each model and data scale it records fit time, single-row and batch
+predict latency, peak memory during fit, and pickled model size, and compares
+them against a saved baseline. It also compares dense against sparse (CSR)
+features as the number of term dummies grows. Usage::
+
+    python benchmark.py --update-baseline   # record a new baseline
+    python benchmark.py                     # compare; exit 1 on regression
+    python benchmark.py --sparse            # dense vs sparse, N = 50..5000
+"""
+
+import argparse
+import json
+import os
+import pickle as pk
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from scipy import sparse
+import train
+
+MODELS = ['lasso', 'dtree', 'rf', 'qrf']
+SCALES = [1, 4]
+BASELINE_FILE = 'reports/benchmark_baseline.json'
+
+# top-N term groups of the data module (conditions, interventions, keywords)
+TERM_GROUPS = ['is_cond_', 'is_intv_', 'is_keyword_']
+
+# all metrics are "lower is better"
+METRICS = ['fit_time_s', 'predict_1row_ms', 'predict_batch_ms',
+           'peak_mem_mb', 'model_size_mb']
+
+# timed metrics (fit and predict times) are medians of repeated runs, saved
+# with the median absolute deviation (MAD) of the repeats as '<metric>_mad'.
+# A timed metric only regresses if it also rose by more than N_MADS times its
+# run-to-run spread (the larger MAD of the baseline and the new run), so the
+# noise floor scales with each measurement instead of being a fixed amount
+N_MADS = 5
+
+
+def load_model_data():
+    """ Load the committed model-1 feature matrix and response """
+    with open('data/X_model1.pkl', 'rb') as input_file:
+        X = pk.load(input_file)
+    with open('data/y_model1.pkl', 'rb') as input_file:
+        y = pk.load(input_file)
+    if sparse.issparse(X):
+        X = X.toarray()
+    return (np.asarray(X, dtype=np.float64), np.ravel(y))
+
+
+def scale_data(X, y, factor, random_state=0):
+    """ Synthetic copy of (X, y) with factor times as many rows: rows are
+    resampled with replacement, and non-binary columns get a little gaussian
+    jitter (1% of the column std) so the copies are not exact duplicates
+    """
+    if factor == 1:
+        return (X, y)
+
+    rng = np.random.RandomState(random_state)
+    ind = rng.randint(0, X.shape[0], int(factor*X.shape[0]))
+    Xs = X[ind].copy()
+    ys = y[ind].copy()
+
+    nonbinary = [j for j in range(X.shape[1])
+                 if len(np.unique(X[:, j])) > 2]
+    for j in nonbinary:
+        Xs[:, j] += rng.normal(0, 0.01*X[:, j].std(), len(ind))
+
+    return (Xs, ys)
+
+
+def synthetic_terms(N, random_state=0):
+    """ Sparse version of the model-1 data with N dummies per term group, as
+    data.get_data(N=N) would give: the non-term columns and response are the
+    real ones (data/Xraw_model1.pkl), and each group's term dummies follow the
+    real group's frequency profile, extended past the real terms with a
+    1/rank (Zipf) tail
+
+    Returns:
+        X (csr_matrix): features, shape (n_samples, n_other + 3*N)
+        y (array): droprate
+    """
+    rng = np.random.RandomState(random_state)
+    Xraw = pd.read_pickle('data/Xraw_model1.pkl')
+    column_info = pd.read_pickle('data/column_info.pkl').loc[Xraw.columns]
+    (_, y) = load_model_data()
+    n = Xraw.shape[0]
+
+    is_term = column_info[TERM_GROUPS].any(axis=1).values
+    blocks = [sparse.csr_matrix(Xraw.loc[:, ~is_term].values.astype(float))]
+    for group in TERM_GROUPS:
+        real = np.sort(Xraw.loc[:, column_info[group].values].mean().values)
+        real = real[::-1]
+        rank = np.arange(N)
+        density = np.where(rank < len(real),
+                           real[np.minimum(rank, len(real) - 1)],
+                           real[-1]*len(real)/(rank + 1))
+
+        # each column: a random set of rows of the right size
+        nnz = rng.binomial(n, density)
+        rows = np.concatenate([rng.choice(n, k, replace=False) for k in nnz])
+        cols = np.repeat(rank, nnz)
+        blocks.append(sparse.csr_matrix(
+            (np.ones(len(rows)), (rows, cols)), shape=(n, N)))
+
+    return (sparse.hstack(blocks, format='csr'), y)
+
+
+def _median_time(func, n_repeats):
+    """ median run time of func() in seconds over n_repeats runs (steadier
+    than the best run for comparing against a baseline), and the median
+    absolute deviation of the runs
+    """
+    times = []
+    for _ in range(n_repeats):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    median = float(np.median(times))
+    return (median, float(np.median(np.abs(np.array(times) - median))))
+
+
+def benchmark_model(name, X, y, n_batch=1000, n_repeats=20, n_fits=3,
+                    **params):
+    """ Benchmark one model family on (X, y). X may be a scipy sparse matrix
+    (for the train.SPARSE_MODELS families). Other kwargs are passed to
+    train.make_model() (the randomized families are seeded by
+    train.DEFAULT_PARAMS, so model sizes are reproducible)
+
+    Returns:
+        result (dict): fit_time_s (median of n_fits fits), predict_1row_ms
+            and predict_batch_ms (for n_batch rows; medians over the
+            repeats), each with its MAD ('<metric>_mad'), peak_mem_mb
+            (traced allocations during the first fit), and model_size_mb
+            (pickled)
+    """
+    reg = train.make_model(name, **params)
+
+    tracemalloc.start()
+    reg.fit(X, y)
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    Xbatch = X[np.arange(n_batch) % X.shape[0]]
+    timings = {'fit_time_s': (lambda: reg.fit(X, y), n_fits, 1),
+               'predict_1row_ms': (lambda: reg.predict(X[:1]), n_repeats,
+                                   1e3),
+               'predict_batch_ms': (lambda: reg.predict(Xbatch),
+                                    max(1, n_repeats//4), 1e3)}
+    result = {}
+    for (m, (func, repeats, unit)) in timings.items():
+        (median, mad) = _median_time(func, repeats)
+        result[m] = median*unit
+        result[m + '_mad'] = mad*unit
+
+    result['peak_mem_mb'] = peak/2**20
+    result['model_size_mb'] = len(pk.dumps(reg))/2**20
+    return result
+
+
+def run_benchmarks(models=MODELS, scales=SCALES):
+    """ Run benchmark_model() for every model family and data scale
+
+    Returns:
+        results (dict): {'<model>@<scale>x': {metric: value}}, e.g. 'rf@4x'
+    """
+    (X, y) = load_model_data()
+
+    results = {}
+    for scale in scales:
+        (Xs, ys) = scale_data(X, y, scale)
+        for name in models:
+            key = '{}@{:g}x'.format(name, scale)
+            results[key] = benchmark_model(name, Xs, ys)
+            print('{:12s} '.format(key) +
+                  ', '.join('{} {:0.3g}'.format(m, results[key][m])
+                            for m in METRICS))
+
+    return results
+
+
+def sparse_comparison(Ns=(50, 500, 5000), models=MODELS, params=None):
+    """ Compare fitting & predicting on dense vs sparse (CSR) features as the
+    number of term dummies N grows (see synthetic_terms())
+
+    Kwargs:
+        Ns (list): terms per group. Default is (50, 500, 5000)
+        models (list): model families. Default is MODELS
+        params (dict or None): {name: params} overriding DEFAULT_PARAMS
+
+    Returns:
+        results (DataFrame): one row per N, format ('dense' or 'sparse') and
+            model, with the size of X (MB) and the benchmark_model() metrics
+    """
+    params = params or {}
+
+    rows = []
+    for N in Ns:
+        (Xsparse, y) = synthetic_terms(N)
+        for fmt in ['sparse', 'dense']:
+            X = Xsparse if fmt == 'sparse' else Xsparse.toarray()
+            if fmt == 'sparse':
+                X_mb = (X.data.nbytes + X.indices.nbytes +
+                        X.indptr.nbytes)/2**20
+            else:
+                X_mb = X.nbytes/2**20
+            for name in models:
+                row = {'N': N, 'format': fmt, 'model': name,
+                       'n_features': X.shape[1], 'X_mb': X_mb}
+                row.update(benchmark_model(name, X, y, n_repeats=5, n_fits=1,
+                                           **params.get(name, {})))
+                rows.append(row)
+                print('N={} {} {}: fit {:0.2f} s, peak {:0.0f} MB'
+                      .format(N, fmt, name, row['fit_time_s'],
+                              row['peak_mem_mb']))
+            del X
+
+    return pd.DataFrame(rows).set_index(['N', 'model', 'format'])
+
+
+def compare_to_baseline(results, baseline, tolerance=0.25, n_mads=N_MADS):
+    """ Find metrics that regressed relative to the baseline
+
+    Args:
+        results (dict): output of run_benchmarks()
+        baseline (dict): baseline results, same format
+
+    Kwargs:
+        tolerance (float): allowed relative increase. Default 0.25 (25%)
+        n_mads (float): a timed metric must also rise by more than n_mads
+            times the larger MAD of the two runs' repeats. Default is N_MADS
+
+    Returns:
+        regressions (list): (key, metric, baseline value, new value) tuples
+    """
+    regressions = []
+    for (key, metrics) in results.items():
+        if key not in baseline:
+            continue
+        for m in METRICS:
+            (old, new) = (baseline[key][m], metrics[m])
+            noise = n_mads*max(baseline[key].get(m + '_mad', 0),
+                               metrics.get(m + '_mad', 0))
+            if new > old*(1 + tolerance) and new - old > noise:
+                regressions.append((key, m, old, new))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='save the results as the new baseline')
+    parser.add_argument('--baseline', default=BASELINE_FILE,
+                        help='baseline file (default %(default)s)')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative increase (default %(default)s)')
+    parser.add_argument('--models', nargs='+', default=MODELS,
+                        choices=sorted(train.MODELS))
+    parser.add_argument('--scales', nargs='+', type=float, default=SCALES)
+    parser.add_argument('--sparse', action='store_true',
+                        help='only run the dense vs sparse comparison')
+    args = parser.parse_args(argv)
+
+    if args.sparse:
+        print(sparse_comparison(models=args.models).to_string())
+        return 0
+
+    results = run_benchmarks(models=args.models, scales=args.scales)
+
+    if args.update_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as output_file:
+            json.dump(results, output_file, indent=1, sort_keys=True)
+        print('Saved baseline to {}'.format(args.baseline))
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('No baseline at {}; run with --update-baseline first'
+              .format(args.baseline))
+        return 1
+    with open(args.baseline, 'r') as input_file:
+        baseline = json.load(input_file)
+
+    regressions = compare_to_baseline(results, baseline,
+                                      tolerance=args.tolerance)
+    for (key, m, old, new) in regressions:
+        print('REGRESSION {} {}: {:0.3g} -> {:0.3g} ({:+0.0f}%)'
+              .format(key, m, old, new, (new/old - 1)*100))
+    if not regressions:
+        print('No regressions beyond {:0.0f}%'.format(args.tolerance*100))
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,203 @@
+"""
+compare - train and compare all the model families concurrently
+===============================================================
+
+**compare** replaces running playground_model1 (Lasso) and playground_model2
+(decision tree, RF, QRF) one after the other. It loads and converts the
+training and test data once, writes the arrays to .npy files that every
+worker process memory-maps read-only (the same pages are shared, nothing is
+pickled to the workers), and cross-validates, fits, and times each model
+family in its own process. The result is one table of CV R2, test R2, fit
+time, and predict latency. Usage::
+
+    python compare.py --models lasso dtree rf qrf
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.metrics import r2_score
+
+# model family -> response transform it is fit on (as in the playground
+# scripts: the Lasso of model 1 predicts droprate**(1/3))
+FAMILIES = {'lasso': 'cuberoot',
+            'dtree': None,
+            'rf': None,
+            'qrf': None}
+
+# per-worker-process shared arrays, set by _init_worker()
+_WORKER = {}
+
+
+def load_data():
+    """ Training and test data, as in the playground scripts: the saved
+    reduced feature schema if there is one (see the selection module), else
+    all the columns
+
+    Returns:
+        X, y, Xtest, ytest: CSR training/test features and droprate responses
+        feature_names (list): column names of X
+    """
+    import data
+    import evaluate
+    import selection
+
+    (Xraw, yraw, _) = data.getmodeldata(getnew=False)
+    feature_names = selection.load_schema() or Xraw.columns.tolist()
+    X = data.tosparse(Xraw[feature_names])
+    y = np.asarray(yraw[yraw.columns[0]], dtype=np.float64)
+    (Xtest, ytest) = evaluate.get_testdata(feature_names)
+    return (X, y, Xtest, np.ravel(ytest), feature_names)
+
+
+def share_arrays(dirname, **arrays):
+    """ Write arrays (CSR matrices as their data/indices/indptr/shape) to .npy
+    files in dirname, to be memory-mapped by load_shared()
+
+    Returns:
+        paths (dict): {name: .npy path, or dict of paths for a CSR matrix}
+    """
+    paths = {}
+    for (name, arr) in arrays.items():
+        if sparse.issparse(arr):
+            arr = arr.tocsr()
+            paths[name] = share_arrays(
+                dirname, **{name + '_' + part: getattr(arr, part)
+                            for part in ('data', 'indices', 'indptr')},
+                **{name + '_shape': np.array(arr.shape)})
+        else:
+            path = os.path.join(dirname, name + '.npy')
+            np.save(path, np.ascontiguousarray(arr))
+            paths[name] = path
+    return paths
+
+
+def load_shared(paths):
+    """ Memory-map (read-only) the arrays written by share_arrays() """
+    arrays = {}
+    for (name, path) in paths.items():
+        if isinstance(path, dict):
+            parts = {k[len(name) + 1:]: np.load(p, mmap_mode='r')
+                     for (k, p) in path.items()}
+            arrays[name] = sparse.csr_matrix(
+                (parts['data'], parts['indices'], parts['indptr']),
+                shape=tuple(parts['shape']), copy=False)
+        else:
+            arrays[name] = np.load(path, mmap_mode='r')
+    return arrays
+
+
+def _init_worker(paths):
+    """ Map the shared data once per worker process """
+    _WORKER.update(load_shared(paths))
+
+
+def _run_family(name, params, nfolds, n_repeats):
+    """ Cross-validate, fit, and time one model family on the shared data
+    (runs in a worker process)
+    """
+    import evaluate
+    import train
+
+    (X, y) = (train._densify(name, _WORKER['X']), np.asarray(_WORKER['y']))
+    (Xtest, ytest) = (train._densify(name, _WORKER['Xtest']),
+                      np.asarray(_WORKER['ytest']))
+    if FAMILIES.get(name) == 'cuberoot':
+        (yfit, back) = (y**(1/3), lambda pred: pred**3)
+    else:
+        (yfit, back) = (y, lambda pred: pred)
+
+    t0 = time.perf_counter()
+    report = evaluate.evaluate_model(train.make_model(name, **params), X,
+                                     yfit, nfolds=nfolds, refit=False)
+    (reg, fit_time) = train.fit_model(name, X, yfit, **params)
+    wall_time = time.perf_counter() - t0
+
+    return {'model': name,
+            'response': FAMILIES.get(name) or 'droprate',
+            'cv_r2': r2_score(y, back(report['oof_pred'])),
+            'test_r2': r2_score(ytest, back(reg.predict(Xtest))),
+            'fit_time_s': fit_time,
+            'predict_1row_ms': train._best_time(
+                lambda: reg.predict(Xtest[:1]), n_repeats)*1e3,
+            'predict_batch_ms': train._best_time(
+                lambda: reg.predict(Xtest), n_repeats)*1e3,
+            'worker_s': wall_time}
+
+
+def compare_models(names=tuple(FAMILIES), X=None, y=None, Xtest=None,
+                   ytest=None, params=None, nfolds=5, n_jobs=None,
+                   n_repeats=10):
+    """ Train and compare model families concurrently, one process each
+
+    Args:
+        names (list): model families (keys of train.MODELS). Default is
+            FAMILIES (Lasso, decision tree, RF, QRF)
+
+    Kwargs:
+        X, y, Xtest, ytest: training and test data (droprate responses). If
+            None, loaded once with load_data()
+        params (dict or None): {name: params} overriding train.DEFAULT_PARAMS
+        nfolds (int): number of CV folds. Default is 5
+        n_jobs (int or None): worker processes. Default is one per family
+        n_repeats (int): predict timing repeats (best is kept). Default 10
+
+    Returns:
+        results (DataFrame): one row per family with the response it is fit
+            on, the pooled out-of-fold 'cv_r2' and the 'test_r2' (both on
+            droprate, i.e. cube-root models are cubed back), 'fit_time_s' of
+            the final fit, 'predict_1row_ms' and 'predict_batch_ms' on the
+            test set, and the worker's total seconds ('worker_s')
+        wall_time (float): total wall-clock seconds of the comparison
+    """
+    if X is None:
+        (X, y, Xtest, ytest, _) = load_data()
+    params = params or {}
+
+    tmpdir = tempfile.mkdtemp(prefix='compare_')
+    try:
+        paths = share_arrays(tmpdir, X=X, y=np.ravel(y), Xtest=Xtest,
+                             ytest=np.ravel(ytest))
+        t0 = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=n_jobs or len(names),
+                                 initializer=_init_worker,
+                                 initargs=(paths,)) as pool:
+            futures = [pool.submit(_run_family, name, params.get(name, {}),
+                                   nfolds, n_repeats)
+                       for name in names]
+            rows = [f.result() for f in futures]
+        wall_time = time.perf_counter() - t0
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    return (pd.DataFrame(rows).set_index('model'), wall_time)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--models', nargs='+', default=list(FAMILIES),
+                        help='model families to compare')
+    parser.add_argument('--nfolds', type=int, default=5)
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='worker processes (default: one per family)')
+    parser.add_argument('--out', default=None,
+                        help='also write the table to this CSV file')
+    args = parser.parse_args(argv)
+
+    (results, wall_time) = compare_models(args.models, nfolds=args.nfolds,
+                                          n_jobs=args.jobs)
+    print(results.to_string(float_format='{:0.3f}'.format))
+    print('Total {:0.1f} s wall clock, {:0.1f} s of worker time'
+          .format(wall_time, results['worker_s'].sum()))
+    if args.out is not None:
+        results.to_csv(args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+conformal - split-conformal prediction intervals around point models
+====================================================================
+
+**conformal** wraps an existing fitted point model (e.g. the RF or the Lasso)
+and turns it into an interval model by calibrating once on held-out absolute
+residuals: the interval for a new row is the point prediction +/- the
+conformal quantile of those residuals. With exchangeable data it covers the
+truth with probability at least the requested coverage, needs no second model,
+and costs one ordinary predict() per batch
+"""
+
+import time
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.model_selection import train_test_split
+
+
+class SplitConformal:
+    """ Split-conformal intervals for a fitted regressor
+
+    Args:
+        reg (estimator): fitted point model with a predict() method
+
+    Kwargs:
+        coverage (float): default interval coverage, in percent. Default is
+            95, i.e. the same 2.5-97.5 band as the quantile forest
+    """
+
+    def __init__(self, reg, coverage=95):
+        self.reg = reg
+        self.coverage = coverage
+        self.scores_ = None
+
+    def fit(self, X, y, cal_size=0.2, random_state=0):
+        """ Fit a clone of reg on part of (X, y) and calibrate on the rest
+
+        Kwargs:
+            cal_size (float or int): calibration fraction (or number of rows)
+                held out from fitting. Default is 0.2
+            random_state (int): seed for the split. Default is 0
+        """
+        (Xfit, Xcal, yfit, ycal) = train_test_split(
+            X, np.ravel(y), test_size=cal_size, random_state=random_state)
+        self.reg = clone(self.reg).fit(Xfit, yfit)
+        return self.calibrate(Xcal, ycal)
+
+    def calibrate(self, X, y):
+        """ Calibrate on held-out data the model was not fit on """
+        return self.calibrate_residuals(np.ravel(y) - self.reg.predict(X))
+
+    def calibrate_residuals(self, resid):
+        """ Calibrate on precomputed held-out residuals (y - prediction),
+        e.g. the out-of-fold residuals 'oof_resid' of evaluate_model()
+        """
+        self.scores_ = np.sort(np.abs(np.ravel(resid)))
+        return self
+
+    def halfwidth(self, coverage=None):
+        """ Interval half-width for coverage (percent): the ceil((n + 1) *
+        coverage/100)-th smallest calibration score, or inf if there are too
+        few calibration rows for that coverage
+        """
+        if self.scores_ is None:
+            raise ValueError('SplitConformal is not calibrated, call fit(), '
+                             'calibrate() or calibrate_residuals() first')
+        coverage = self.coverage if coverage is None else coverage
+        n = len(self.scores_)
+        k = int(np.ceil((n + 1)*coverage/100.))
+        return self.scores_[k - 1] if k <= n else np.inf
+
+    def predict(self, X):
+        """ Point prediction of the wrapped model """
+        return self.reg.predict(X)
+
+    def predict_interval(self, X, coverage=None):
+        """ Predict intervals for a batch of rows
+
+        Kwargs:
+            coverage (float or None): coverage in percent (None for the
+                default coverage)
+
+        Returns:
+            pred (array): shape (n_rows, 3) with columns lower, prediction,
+                upper (same layout as the QRF's 2.5/50/97.5 quantiles)
+        """
+        ypred = self.reg.predict(X)
+        h = self.halfwidth(coverage)
+        return np.column_stack([ypred - h, ypred, ypred + h])
+
+
+def _interval_stats(bounds, y, predict_time):
+    """ Coverage, mean width, and timing of (n, 3) lower/mid/upper bounds """
+    return {'coverage': np.mean((y >= bounds[:, 0]) & (y <= bounds[:, 2])),
+            'mean_width': np.mean(bounds[:, 2] - bounds[:, 0]),
+            'predict_ms': predict_time*1e3}
+
+
+def compare_to_qrf(conformal, rfqr, Xtest, ytest, coverage=95):
+    """ Compare conformal intervals against the quantile forest's on a test set
+
+    Args:
+        conformal (SplitConformal): calibrated conformal wrapper
+        rfqr (estimator): fitted quantile forest (train.QuantileRandomForest,
+            or a skgarden RandomForestQuantileRegressor)
+        Xtest, ytest (arrays): test data
+
+    Kwargs:
+        coverage (float): nominal coverage in percent, i.e. the QRF quantiles
+            are (100 - coverage)/2 and (100 + coverage)/2. Default is 95
+
+    Returns:
+        results (DataFrame): one row per method with the test-set coverage,
+            mean interval width, and batch predict time (ms; a skgarden QRF's
+            includes building its QuantilePredictor)
+    """
+    import quantile
+
+    ytest = np.ravel(ytest)
+    tail = (100 - coverage)/2.
+
+    t0 = time.perf_counter()
+    bounds = conformal.predict_interval(Xtest, coverage)
+    conformal_stats = _interval_stats(bounds, ytest, time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    qpred = rfqr
+    if hasattr(rfqr, 'y_train_leaves_'):
+        qpred = quantile.QuantilePredictor.from_qrf(rfqr)
+    bounds = qpred.predict(Xtest, quantiles=(tail, 50, 100 - tail))
+    qrf_stats = _interval_stats(bounds, ytest, time.perf_counter() - t0)
+
+    return pd.DataFrame([conformal_stats, qrf_stats],
+                        index=['conformal', 'qrf'])
@@ -14,6 +14,7 @@ import re
 from sklearn.model_selection import train_test_split
 import seaborn as sns
 import pickle as pk
+from scipy import sparse
 from configparser import ConfigParser
 from nltk.tokenize import RegexpTokenizer
 
@@ -131,7 +132,8 @@ def _gather_response():
     return (df, human_names)
 
 
-def _gather_features(N=10, fill_intelligent=True):
+def _gather_features(N=10, fill_intelligent=True, statuses=('Completed',),
+                     for_scoring=False):
     """ Connect to AACT database, join select data, and return as a dataframe
 
     Args:
@@ -140,13 +142,22 @@ def _gather_features(N=10, fill_intelligent=True):
             strings as features (dummies). Default is 10
         fill_intelligent (bool): If True, fill empty/null/NaNs with best-guess 
             values. If False, leave as NaNs. Default is True
+        statuses (list): overall_status values of the studies to keep. Default
+            is ('Completed',)
+        for_scoring (bool): If True, keep studies that are missing from the
+            optional tables (e.g. no baseline measurements or terms yet, as
+            for studies that are still recruiting), fall back to the
+            planned duration (start to anticipated completion date) when
+            there is no actual duration, and take the number of participants
+            'completed' from the planned enrollment. Default is False
 
     Return:
         df (DataFrame): pandas dataframe with full data
         human_names (dict): dictionary mapping columns to human-readable names
 
     Notes:
-    - filter for Completed & Inverventional studies only
+    - filter for Inverventional studies with the given statuses only (default
+      Completed)
     - Creates dummy variables
     """
 
@@ -369,15 +380,30 @@ def _gather_features(N=10, fill_intelligent=True):
                 'overall_status': 'status',
                 'phase': 'phase',
                 'number_of_arms': 'arms'}
+    if for_scoring:
+        colnames.update({'start_date': 'start',
+                         'completion_date': 'completion',
+                         'enrollment': 'completed'})
     studies = pd.read_sql_table('studies', engine,
                                 columns=colnames.keys()
                                 ).rename(columns=colnames).set_index('nct_id')
     
-    # filter to only keep 'Completed' studies
-    filt = (studies['status'].str.match('Completed') & 
+    # filter to only keep studies with the given statuses (e.g. 'Completed')
+    filt = (studies['status'].isin(statuses) &
             studies['studytype'].str.match('Interventional'))
     studies = studies[filt].drop(columns=['status', 'studytype'])
 
+    # planned duration in months (only used to fill in the actual duration)
+    if for_scoring:
+        studies['planned_duration'] = (
+            (pd.to_datetime(studies['completion']) -
+             pd.to_datetime(studies['start'])).dt.days/30.4375).round()
+        studies.drop(columns=['start', 'completion'], inplace=True)
+
+        # no completion counts yet: the planned enrollment is the number of
+        # participants the study aims for (the app's 'participants' input)
+        studies['completed'] = studies['completed'].astype(float)
+
     # parse study phases
     for n in [1,2,3, 4]:
         filt = studies['phase'].str.contains(str(n))
@@ -400,8 +426,18 @@ def _gather_features(N=10, fill_intelligent=True):
     # interventional studies)
 
     df = studies
-    for d in [meas, conds, intv, calc, intvtype, words]:
-        df = df.join(d, how='inner')
+    if not for_scoring:
+        for d in [meas, conds, intv, calc, intvtype, words]:
+            df = df.join(d, how='inner')
+    else:
+        # studies without results/terms yet: keep them, with best guesses
+        df = df.join(calc, how='left')
+        df['duration'] = df['duration'].fillna(df.pop('planned_duration'))
+        df = df.join(meas, how='left')
+        df['malefraction'] = df['malefraction'].fillna(0.5)
+        for d in [conds, intv, intvtype, words]:
+            df = df.join(d, how='left')
+            df[d.columns] = df[d.columns].fillna(False).astype(bool)
 
     # join all human-readable names
     human_names = {**studies_humannames,
@@ -537,6 +573,31 @@ def feature_plots(df):
     plt.show()
 
 
+def tosparse(df):
+    """ Convert a (mostly boolean/zero) features dataframe to a scipy CSR
+    matrix of floats, one column at a time, so the dense float64 array (8
+    bytes for every entry, zero or not) is never built
+
+    Args:
+        df (DataFrame): features, e.g. X from getmodeldata()
+
+    Returns:
+        X (csr_matrix): float64 features, shape df.shape, same column order as
+            df.columns
+    """
+    (rows, cols, vals) = ([], [], [])
+    for (j, c) in enumerate(df.columns):
+        v = df[c].values
+        nz = np.flatnonzero(v)
+        rows.append(nz)
+        cols.append(np.full(len(nz), j, dtype=np.int64))
+        vals.append(v[nz].astype(np.float64))
+
+    return sparse.csr_matrix((np.concatenate(vals),
+                              (np.concatenate(rows), np.concatenate(cols))),
+                             shape=df.shape)
+
+
 def getmodeldata(getnew=False, **kwargs):
     """ Gather data from the 'data' module
 
@@ -0,0 +1,161 @@
+"""
+distill - small surrogate models trained on a big model's predictions
+=====================================================================
+
+**distill** trains a lightweight "student" model (a shallow decision tree or a
+sparse Lasso) to mimic a "teacher" model (e.g. the random forest) on the real
+training rows plus perturbed copies of them, labelled with the teacher's
+predictions. The student is exported as a memory-mappable artifact (see the
+artifact module) whose single-row predict takes microseconds, for serving the
+dashboard
+"""
+
+import time
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.metrics import r2_score
+from sklearn.tree import DecisionTreeRegressor
+import artifact
+import train
+
+# student family name -> (constructor, default params). The Lasso student is
+# train's (standardized features), exported with the scaling folded in
+STUDENTS = {'tree': (DecisionTreeRegressor, {'max_depth': 8,
+                                              'min_samples_leaf': 5}),
+            'lasso': (train.MODELS['lasso'], train.DEFAULT_PARAMS['lasso'])}
+
+
+def perturb(X, n_copies=4, prob=0.1, random_state=0):
+    """ Perturbed copies of the rows of X: each entry is, with probability
+    prob, replaced by the same column's value from a random other row. Values
+    stay in each column's own domain (booleans stay boolean, counts stay
+    integers)
+
+    Args:
+        X (array or sparse matrix): features (densified, rows are few)
+
+    Kwargs:
+        n_copies (int): number of perturbed copies of X. Default is 4
+        prob (float): per-entry replacement probability. Default is 0.1
+        random_state (int): seed. Default is 0
+
+    Returns:
+        Xpert (array): shape (n_copies*n_rows, n_features)
+    """
+    if sparse.issparse(X):
+        X = X.toarray()
+    X = np.asarray(X, dtype=np.float64)
+    rng = np.random.RandomState(random_state)
+    (n_rows, n_features) = X.shape
+
+    Xpert = np.tile(X, (n_copies, 1))
+    replace = rng.random_sample(Xpert.shape) < prob
+    (rows, cols) = np.nonzero(replace)
+    Xpert[rows, cols] = X[rng.randint(0, n_rows, len(rows)), cols]
+
+    return Xpert
+
+
+def distill(teacher, X, student='tree', n_copies=4, prob=0.1,
+            random_state=0, **params):
+    """ Train a student model on the teacher's predictions
+
+    Args:
+        teacher (estimator): fitted model with a predict() method
+        X (array or sparse matrix): real (training) rows
+
+    Kwargs:
+        student (str): student family, a key of STUDENTS ('tree' or 'lasso').
+            Default is 'tree'
+        n_copies, prob, random_state: see perturb()
+        other kwargs: update the student's default params
+
+    Returns:
+        reg (estimator): the fitted student
+    """
+    if student not in STUDENTS:
+        raise ValueError('Unknown student {}, choose from {}'
+                         .format(student, sorted(STUDENTS)))
+    (cls, defaults) = STUDENTS[student]
+
+    Xreal = X.toarray() if sparse.issparse(X) else np.asarray(X, np.float64)
+    Xaug = np.vstack([Xreal, perturb(Xreal, n_copies=n_copies, prob=prob,
+                                     random_state=random_state)])
+    yaug = teacher.predict(Xaug)
+
+    return cls(**{**defaults, **params}).fit(Xaug, yaug)
+
+
+def _latency_us(predict, x, n_repeats):
+    """ best-of-n_repeats time (microseconds) of predict(x) """
+    best = np.inf
+    for _ in range(n_repeats):
+        t0 = time.perf_counter()
+        predict(x)
+        best = min(best, time.perf_counter() - t0)
+    return best*1e6
+
+
+def fidelity_report(teacher, student, Xtest, ytest=None, n_repeats=200):
+    """ How well, and how fast, the student replaces the teacher
+
+    Args:
+        teacher, student (estimators): fitted teacher and student
+        Xtest (array or sparse matrix): held-out rows
+
+    Kwargs:
+        ytest (array or None): held-out response, for the R2 of each model
+            against the truth
+        n_repeats (int): single-row timing repeats (best is kept). Default 200
+
+    Returns:
+        report (DataFrame): one row per model ('teacher', 'student', and the
+            student exported with artifact.to_predictor()) with the R2
+            against the teacher's predictions ('fidelity_r2'), the R2 against
+            ytest ('test_r2'), and the single-row predict latency
+            ('predict_1row_us')
+    """
+    Xtest = Xtest.toarray() if sparse.issparse(Xtest) else np.asarray(Xtest)
+    x = Xtest[:1]
+    yteacher = teacher.predict(Xtest)
+
+    models = {'teacher': teacher,
+              'student': student,
+              'student (artifact)': artifact.to_predictor(student)}
+    rows = []
+    for (name, reg) in models.items():
+        ypred = reg.predict(Xtest)
+        rows.append({'model': name,
+                     'fidelity_r2': r2_score(yteacher, ypred),
+                     'test_r2': (np.nan if ytest is None else
+                                 r2_score(np.ravel(ytest), ypred)),
+                     'predict_1row_us': _latency_us(reg.predict, x,
+                                                    n_repeats)})
+
+    return pd.DataFrame(rows).set_index('model')
+
+
+def save_student(student, path, feature_names, teacher_path=None,
+                 report=None):
+    """ Save the student as an artifact directory for serving (e.g. the app's
+    INSIGHT_MODEL=reg_model2_distilled), recording where it came from
+
+    Kwargs:
+        teacher_path (str or None): saved teacher the student was distilled
+            from
+        report (DataFrame or None): fidelity_report() output; the student's
+            fidelity and test R2 are stored in the artifact metadata
+    """
+    # the final estimator's class for a pipeline (the Lasso student)
+    final = student.steps[-1][1] if hasattr(student, 'steps') else student
+    metadata = {'distilled_from': teacher_path,
+                'student': type(final).__name__}
+    if report is not None:
+        # NaN is not valid JSON: no test R2 (no ytest) is stored as null
+        for key in ['fidelity_r2', 'test_r2']:
+            value = float(report.loc['student', key])
+            metadata[key] = None if np.isnan(value) else value
+
+    return artifact.save_artifact(student, path, feature_names,
+                                  metadata=metadata)
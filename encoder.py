@@ -0,0 +1,171 @@
+"""
+encoder - compiled encoding of dashboard inputs into model input rows
+=====================================================================
+
+**encoder** compiles the feature schema (model column order plus the
+column_info groups of dummy columns: conditions, interventions, intervention
+types, keywords, phases) once at startup. Each dashboard callback then sets a
+group of dummies from the selected values with one set lookup per name, and
+fills a preallocated numpy row in model column order with a single
+itemgetter call, instead of filtering column_info with boolean masks and
+building a one-row DataFrame per request. Micro-benchmark::
+
+    python encoder.py
+"""
+
+import threading
+import time
+from operator import itemgetter
+import numpy as np
+
+# column_info boolean columns that mark each group of dummy columns
+GROUPS = ('is_cond_', 'is_intv_', 'is_intvtype_', 'is_keyword_', 'is_phase')
+
+
+class FeatureEncoder:
+    """ Compiled user data -> model input row encoder
+
+    Args:
+        feature_names (list): model input columns, in order
+        column_info (DataFrame): column metadata, indexed by column name,
+            with one boolean column per group in GROUPS
+
+    Kwargs:
+        groups (list): column_info group columns. Default is GROUPS
+    """
+
+    def __init__(self, feature_names, column_info, groups=GROUPS):
+        self.feature_names = list(feature_names)
+        self.index = {f: i for (i, f) in enumerate(self.feature_names)}
+        self.groups = {g: column_info.index[column_info[g].values].tolist()
+                       for g in groups}
+        self._getter = itemgetter(*self.feature_names)
+        self._local = threading.local()
+
+    @property
+    def n_features(self):
+        return len(self.feature_names)
+
+    def _row(self):
+        """ This thread's preallocated (1, n_features) input row """
+        row = getattr(self._local, 'row', None)
+        if row is None:
+            row = self._local.row = np.zeros((1, self.n_features))
+        return row
+
+    def set_group(self, userdata, group, selected):
+        """ Set the dummies of a group in userdata (in place): True for the
+        selected names, False for the others
+
+        Args:
+            userdata (dict): user data, {column name: value}
+            group (str): group column, e.g. 'is_cond_'
+            selected (list, str, or None): selected name(s)
+        """
+        if selected is None:
+            selected = ()
+        elif isinstance(selected, str):
+            selected = (selected,)
+        selected = set(selected)
+        for name in self.groups[group]:
+            userdata[name] = name in selected
+        return userdata
+
+    def selected(self, userdata, group):
+        """ Names of a group's dummies that are True in userdata """
+        return [n for n in self.groups[group] if userdata[n]]
+
+    def encode(self, userdata, out=None):
+        """ Model input row for userdata
+
+        Kwargs:
+            out (array or None): (1, n_features) array to fill. Default is
+                this thread's preallocated row, which is overwritten by the
+                next encode() call in the same thread
+
+        Returns:
+            X (array): shape (1, n_features), float64
+        """
+        row = self._row() if out is None else out
+        row[0] = self._getter(userdata)
+        return row
+
+
+def _best_time_us(func, n_repeats):
+    """ best-of-n_repeats time of func() in microseconds """
+    best = np.inf
+    for _ in range(n_repeats):
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t0)
+    return best*1e6
+
+
+def benchmark(encoder, userdata, column_info, columns=None, n_repeats=200):
+    """ Micro-benchmark the per-request work of the dashboard callbacks:
+    the old DataFrame/boolean-mask code against the compiled encoder
+
+    Args:
+        encoder (FeatureEncoder): compiled encoder
+        userdata (dict): a full user data dict (e.g. the default row)
+        column_info (DataFrame): column metadata
+
+    Kwargs:
+        columns (list or None): all the raw columns (the old code builds its
+            one-row frame with them). Default is encoder.feature_names
+        n_repeats (int): repeats per timing (best is kept). Default is 200
+
+    Returns:
+        results (DataFrame): best time (us) of 'encode' (user data -> input
+            row) and 'set_groups' (set the five dummy groups from the
+            selections), for 'dataframe' and 'encoder', plus the 'speedup'
+    """
+    import pandas as pd
+
+    columns = encoder.feature_names if columns is None else columns
+    feature_names = encoder.feature_names
+    selections = {g: encoder.selected(userdata, g) for g in encoder.groups}
+
+    def encode_dataframe():
+        newXraw = pd.DataFrame([userdata], columns=columns)
+        return newXraw[feature_names].values.astype(float)
+
+    def set_groups_masks():
+        for (g, selected) in selections.items():
+            names = column_info[column_info[g]].index.tolist()
+            for n in names:
+                userdata[n] = False
+                if selected is not None and n in selected:
+                    userdata[n] = True
+
+    def set_groups_encoder():
+        for (g, selected) in selections.items():
+            encoder.set_group(userdata, g, selected)
+
+    if not np.array_equal(encode_dataframe(), encoder.encode(userdata)):
+        raise ValueError('encoder and DataFrame rows differ')
+
+    results = pd.DataFrame(
+        {'dataframe': [_best_time_us(encode_dataframe, n_repeats),
+                       _best_time_us(set_groups_masks, n_repeats)],
+         'encoder': [_best_time_us(lambda: encoder.encode(userdata),
+                                   n_repeats),
+                     _best_time_us(set_groups_encoder, n_repeats)]},
+        index=['encode', 'set_groups'])
+    results['speedup'] = results['dataframe']/results['encoder']
+    return results
+
+
+def main():
+    import serving
+
+    assets = serving.LazyAssets(serving.app_manifest(), basedir='data')
+    column_info = assets['column_info']
+    row = serving.default_row(assets)
+    encoder = FeatureEncoder(row['columns'], column_info)
+    print(benchmark(encoder, dict(row['row']), column_info,
+                    columns=row['columns']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,352 @@
+"""
+evaluate - a module to evaluate dropout-rate regression models
+==============================================================
+
+**evaluate** runs k-fold cross validation once per model, keeps the
+out-of-fold predictions, and derives CV scores, residual diagnostics, and
+test-set metrics from them in a single structured report (bagged forests can
+use their out-of-bag predictions instead, with one fit). It also builds the
+test-set matrices (cached on disk per feature schema) and scores any number of
+saved models against them in one batch
+"""
+
+import hashlib
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.base import clone
+from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
+from sklearn.model_selection import KFold
+
+TESTDATA_FILE = 'data/testing_data.pkl'
+CACHE_DIR = 'data/cache'
+
+
+def _residual_diagnostics(y, ypred):
+    """ Given true and predicted responses, return dict of residual summary
+    statistics (mean, std, RMSE, MAE, skew, and the correlation between the
+    residuals and the predicted values, which should be ~0 for a good model)
+    """
+    resid = y - ypred
+    std = resid.std()
+    if std > 0:
+        skew = np.mean(((resid - resid.mean())/std)**3)
+        corr = np.corrcoef(ypred, resid)[0, 1] if ypred.std() > 0 else 0.
+    else:
+        skew, corr = 0., 0.
+
+    return {'mean': resid.mean(),
+            'std': std,
+            'rmse': mean_squared_error(y, ypred)**(1/2),
+            'mae': mean_absolute_error(y, ypred),
+            'skew': skew,
+            'corr_with_predicted': corr}
+
+
+def _regression_metrics(y, ypred):
+    """ Return dict of R2, RMSE, and MAE for true/predicted responses """
+    return {'r2': r2_score(y, ypred),
+            'rmse': mean_squared_error(y, ypred)**(1/2),
+            'mae': mean_absolute_error(y, ypred)}
+
+
+def evaluate_model(reg, X, y, nfolds=5, Xtest=None, ytest=None, refit=True,
+                   shuffle=True, random_state=0):
+    """ Evaluate a regression model with a single pass of k-fold cross
+    validation
+
+    Each fold is fit exactly once. The out-of-fold (OOF) predictions from those
+    fits give the CV R2 scores and the residual diagnostics, so the residuals
+    are for data the model did not see during fitting.
+
+    Args:
+        reg (estimator): unfitted sklearn-style regressor (it is cloned, not
+            modified, for the CV folds)
+        X (array): training features, shape (n_samples, n_features)
+        y (array): training response, shape (n_samples,)
+
+    Kwargs:
+        nfolds (int): number of CV folds. Default is 5
+        Xtest (array or None): test features. If given (with ytest), test
+            metrics are included in the report
+        ytest (array or None): test response
+        refit (bool): If True, fit reg on all of X (in place) after the CV
+            folds, and use it for the test metrics. Default is True
+        shuffle (bool): passed to KFold. Default is True
+        random_state (int): passed to KFold. Default is 0
+
+    Returns:
+        report (dict): dictionary with keys:
+            'method' (str): 'kfold'
+            'cv_scores' (array): R2 score for each fold
+            'cv_r2_mean', 'cv_r2_std' (float): mean/std of 'cv_scores'
+            'oof_pred' (array): out-of-fold prediction for each sample
+            'oof_resid' (array): out-of-fold residuals (y - oof_pred)
+            'oof_metrics' (dict): R2/RMSE/MAE of the pooled OOF predictions
+            'residuals' (dict): OOF residual diagnostics
+            'fit_time' (array): seconds to fit each fold
+            'test_metrics' (dict): R2/RMSE/MAE on test set, or None
+            'test_pred' (array): test set predictions, or None
+            'test_predict_time' (float): seconds to predict the test set, or
+                None
+            'reg' (estimator): the refit estimator, or None
+    """
+    y = np.ravel(y)
+    oof_pred = np.zeros(len(y), dtype=float)
+    cv_scores = []
+    fit_time = []
+
+    # Single pass through the folds: fit once, keep OOF predictions
+    kf = KFold(n_splits=nfolds, shuffle=shuffle, random_state=random_state)
+    for (train, test) in kf.split(X):
+        fold_reg = clone(reg)
+        t0 = time.perf_counter()
+        fold_reg.fit(X[train], y[train])
+        fit_time.append(time.perf_counter() - t0)
+        oof_pred[test] = fold_reg.predict(X[test])
+        cv_scores.append(r2_score(y[test], oof_pred[test]))
+    cv_scores = np.array(cv_scores)
+
+    report = {'method': 'kfold',
+              'cv_scores': cv_scores,
+              'cv_r2_mean': cv_scores.mean(),
+              'cv_r2_std': cv_scores.std(),
+              'oof_pred': oof_pred,
+              'oof_resid': y - oof_pred,
+              'oof_metrics': _regression_metrics(y, oof_pred),
+              'residuals': _residual_diagnostics(y, oof_pred),
+              'fit_time': np.array(fit_time),
+              'test_metrics': None,
+              'test_pred': None,
+              'test_predict_time': None,
+              'reg': None}
+
+    # Refit on all the training data & score on the test set
+    if refit:
+        reg.fit(X, y)
+        report['reg'] = reg
+        if Xtest is not None and ytest is not None:
+            t0 = time.perf_counter()
+            test_pred = reg.predict(Xtest)
+            report['test_predict_time'] = time.perf_counter() - t0
+            report['test_pred'] = test_pred
+            report['test_metrics'] = _regression_metrics(np.ravel(ytest),
+                                                         test_pred)
+
+    return report
+
+
+def evaluate_oob(reg, X, y, Xtest=None, ytest=None):
+    """ Evaluate a bagged forest (RF, QRF) with its out-of-bag (OOB)
+    predictions, from a single fit on all of X instead of one fit per fold
+
+    Each row's OOB prediction averages only the trees whose bootstrap sample
+    left that row out, so, like k-fold out-of-fold predictions, it is for
+    data those trees did not see. The report has the same keys as
+    evaluate_model()'s, with 'method' 'oob', 'cv_scores' holding the single
+    OOB R2, and the OOB predictions/residuals in 'oof_pred'/'oof_resid'.
+
+    Args:
+        reg (estimator): unfitted bagged forest; it is fit in place, with
+            oob_score=True and bootstrap=True
+        X (array): training features, shape (n_samples, n_features)
+        y (array): training response, shape (n_samples,)
+
+    Kwargs:
+        Xtest, ytest (arrays or None): test data for the test metrics
+    """
+    y = np.ravel(y)
+    reg.set_params(oob_score=True, bootstrap=True)
+    t0 = time.perf_counter()
+    reg.fit(X, y)
+    fit_time = time.perf_counter() - t0
+
+    oof_pred = np.ravel(reg.oob_prediction_)
+    oob_r2 = r2_score(y, oof_pred)
+    report = {'method': 'oob',
+              'cv_scores': np.array([oob_r2]),
+              'cv_r2_mean': oob_r2,
+              'cv_r2_std': 0.,
+              'oof_pred': oof_pred,
+              'oof_resid': y - oof_pred,
+              'oof_metrics': _regression_metrics(y, oof_pred),
+              'residuals': _residual_diagnostics(y, oof_pred),
+              'fit_time': np.array([fit_time]),
+              'test_metrics': None,
+              'test_pred': None,
+              'test_predict_time': None,
+              'reg': reg}
+
+    if Xtest is not None and ytest is not None:
+        t0 = time.perf_counter()
+        test_pred = reg.predict(Xtest)
+        report['test_predict_time'] = time.perf_counter() - t0
+        report['test_pred'] = test_pred
+        report['test_metrics'] = _regression_metrics(np.ravel(ytest),
+                                                     test_pred)
+
+    return report
+
+
+def compare_oob_kfold(regs, X, y, nfolds=5):
+    """ Compare OOB against k-fold CV estimates (R2 and cost) for forests
+
+    Args:
+        regs (dict): {name: unfitted bagged forest}
+        X, y (arrays): training data
+
+    Kwargs:
+        nfolds (int): number of k-fold CV folds. Default is 5
+
+    Returns:
+        results (DataFrame): one row per forest with 'oob_r2', 'kfold_r2',
+            'kfold_r2_std', total fit seconds of each ('oob_fit_s',
+            'kfold_fit_s'), and the 'speedup' of OOB over k-fold
+    """
+    rows = []
+    for (name, reg) in regs.items():
+        oob = evaluate_oob(clone(reg), X, y)
+        kfold = evaluate_model(clone(reg), X, y, nfolds=nfolds, refit=False)
+        rows.append({'model': name,
+                     'oob_r2': oob['cv_r2_mean'],
+                     'kfold_r2': kfold['cv_r2_mean'],
+                     'kfold_r2_std': kfold['cv_r2_std'],
+                     'oob_fit_s': oob['fit_time'].sum(),
+                     'kfold_fit_s': kfold['fit_time'].sum()})
+    results = pd.DataFrame(rows).set_index('model')
+    results['speedup'] = results['kfold_fit_s']/results['oob_fit_s']
+    return results
+
+
+def print_report(report, name=''):
+    """ Print a short human-readable summary of an evaluate_model() or
+    evaluate_oob() report
+    """
+    print('\n ** Evaluation report {}'.format(name))
+    if report.get('method') == 'oob':
+        print('Out-of-bag R2 score: {:0.2f}'.format(report['cv_r2_mean']))
+    else:
+        print('{:d}-fold CV R2 score: {:0.2f}+/-{:0.2f}'
+              .format(len(report['cv_scores']), report['cv_r2_mean'],
+                      report['cv_r2_std']))
+    print('Out-of-fold RMS error: {:.2f}'.format(report['oof_metrics']['rmse']))
+    resid = report['residuals']
+    print('Out-of-fold residuals: mean {:+0.3f}, std {:0.3f}, skew {:+0.2f}, '
+          'corr w/ predicted {:+0.2f}'.format(resid['mean'], resid['std'],
+                                             resid['skew'],
+                                             resid['corr_with_predicted']))
+    if report['test_metrics'] is not None:
+        print('R2 test score: {:0.3f}'.format(report['test_metrics']['r2']))
+
+
+def _schema_key(feature_names, source):
+    """ Short hash of the feature schema (column names, in order) and of the
+    source file's path, size and modification time, so the cache is rebuilt
+    when either changes
+    """
+    st = os.stat(source)
+    h = hashlib.sha1(json.dumps(list(feature_names)).encode())
+    h.update('{}:{:d}:{:d}'.format(os.path.abspath(source), st.st_size,
+                                   st.st_mtime_ns).encode())
+    return h.hexdigest()[:16]
+
+
+def get_testdata(feature_names, source=TESTDATA_FILE, cachedir=CACHE_DIR,
+                 refresh=False):
+    """ Test-set features and droprate for a feature schema, built once and
+    cached as a compact .npz (CSR arrays + response) under cachedir
+
+    Args:
+        feature_names (list): feature columns, in model-input order
+
+    Kwargs:
+        source (str): test data frame pickle. Default 'data/testing_data.pkl'
+        cachedir (str): cache directory (created if needed). Default is
+            'data/cache'
+        refresh (bool): If True, rebuild the cache entry. Default is False
+
+    Returns:
+        Xtest (csr_matrix): test features, columns in feature_names order
+        ytest (array): test droprate (dropped/enrolled)
+    """
+    cachefile = os.path.join(cachedir, 'testdata_{}.npz'.format(
+        _schema_key(feature_names, source)))
+
+    if os.path.exists(cachefile) and not refresh:
+        with np.load(cachefile) as cached:
+            Xtest = sparse.csr_matrix((cached['data'], cached['indices'],
+                                       cached['indptr']),
+                                      shape=tuple(cached['shape']))
+            return (Xtest, cached['y'])
+
+    import data
+
+    dftest = pd.read_pickle(source)
+    Xtest = data.tosparse(dftest[list(feature_names)])
+    ytest = (dftest['dropped']/dftest['enrolled']).values.astype(np.float64)
+
+    # write to a temporary file and rename, so readers never see a partial one
+    os.makedirs(cachedir, exist_ok=True)
+    tmpfile = cachefile[:-len('.npz')] + '.tmp.npz'
+    np.savez(tmpfile, data=Xtest.data, indices=Xtest.indices,
+             indptr=Xtest.indptr, shape=np.array(Xtest.shape), y=ytest)
+    os.replace(tmpfile, cachefile)
+
+    return (Xtest, ytest)
+
+
+def score_models(paths, feature_names=None, **kwargs):
+    """ Score a batch of saved models on the test set
+
+    The test matrices are built (or read from the cache) once per distinct
+    feature schema. Predictions of models saved with metadata
+    response_transform='cuberoot' are cubed, so every model is scored on the
+    droprate itself.
+
+    Args:
+        paths (list or dict): saved models (artifact directories or pickle
+            files, see artifact.load_model()), or {name: path}
+
+    Kwargs:
+        feature_names (list or None): feature columns for models that do not
+            record their own (pickles)
+        other kwargs: passed to get_testdata()
+
+    Returns:
+        scores (DataFrame): one row per model with the number of features,
+            test-set predict time (ms), and test R2/RMSE/MAE
+    """
+    import artifact
+
+    if not isinstance(paths, dict):
+        paths = {p: p for p in paths}
+
+    testdata = {}
+    rows = []
+    for (name, path) in paths.items():
+        reg = artifact.load_model(path)
+        names = getattr(reg, 'feature_names', feature_names)
+        if names is None:
+            raise ValueError('{} does not record its feature names, pass '
+                             'feature_names'.format(path))
+        if tuple(names) not in testdata:
+            testdata[tuple(names)] = get_testdata(names, **kwargs)
+        (Xtest, ytest) = testdata[tuple(names)]
+
+        t0 = time.perf_counter()
+        ypred = reg.predict(Xtest)
+        predict_time = time.perf_counter() - t0
+        meta = getattr(reg, 'meta', {}).get('metadata', {})
+        if meta.get('response_transform') == 'cuberoot':
+            ypred = ypred**3
+
+        row = {'model': name,
+               'n_features': len(names),
+               'predict_ms': predict_time*1e3}
+        row.update(_regression_metrics(ytest, ypred))
+        rows.append(row)
+
+    return pd.DataFrame(rows).set_index('model')
@@ -0,0 +1,211 @@
+"""
+forest - flattened, array-based tree ensembles for fast inference
+=================================================================
+
+**forest** exports fitted sklearn decision trees / random forests into a few
+contiguous numpy arrays (feature, threshold, children, value) and evaluates all
+the trees at once, one tree level per step, for a whole batch of rows. This
+avoids sklearn's per-call input validation and per-tree joblib dispatch, which
+dominate the cost of predicting a single row: one row is 10-25x faster than
+sklearn's predict(). Large batches are not: at 10,000 rows the playground
+forests (20 trees, depth 10) are about as fast as sklearn, and fully grown
+deep trees about half as fast (see benchmark())
+"""
+
+import time
+import numpy as np
+from scipy import sparse
+
+# rows of a sparse X densified at a time by FlatForest
+SPARSE_CHUNK = 1024
+
+# FlatForest walks every (row, tree) pair COMPACT_DEPTH levels deep; below
+# that, it drops the pairs that are at a leaf every COMPACT_EVERY levels, so
+# a deep, unbalanced tree costs the depth of each path instead of max_depth
+# steps for every row
+COMPACT_DEPTH = 16
+COMPACT_EVERY = 4
+
+
+class FlatForest:
+    """ Tree ensemble stored as flat arrays over the nodes of all trees
+
+    Node ids are global (tree t's nodes start at roots[t]). Leaves have
+    feature 0, threshold +inf, and both children pointing to themselves, so
+    a row can keep walking a tree after reaching its leaf.
+
+    Nothing is derived from the arrays at construction time, so they can be
+    read-only memory maps shared between processes (see the artifact module).
+
+    Args:
+        feature (array): split feature of each node, int32
+        threshold (array): split threshold of each node, float64 (go left if
+            x[feature] <= threshold)
+        children (array): interleaved global ids of each node's (left, right)
+            children, i.e. children[2*node + go_right], int64
+        value (array): prediction of each node, float64
+        roots (array): global id of each tree's root node, int64
+        max_depth (int): depth of the deepest tree
+    """
+
+    arrays = ('feature', 'threshold', 'children', 'value', 'roots')
+
+    def __init__(self, feature, threshold, children, value, roots, max_depth):
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+
+    @classmethod
+    def from_sklearn(cls, reg):
+        """ Flatten a fitted sklearn (or skgarden) regression tree or forest,
+        e.g. DecisionTreeRegressor, RandomForestRegressor, or
+        RandomForestQuantileRegressor
+        """
+        estimators = getattr(reg, 'estimators_', [reg])
+
+        (feature, threshold, left, right, value, roots) = ([], [], [], [], [],
+                                                           [])
+        offset = 0
+        max_depth = 0
+        for est in estimators:
+            tree = est.tree_
+            ids = np.arange(tree.node_count)
+            isleaf = tree.children_left == -1
+
+            roots.append(offset)
+            feature.append(np.where(isleaf, 0, tree.feature))
+            threshold.append(np.where(isleaf, np.inf, tree.threshold))
+            left.append(np.where(isleaf, ids, tree.children_left) + offset)
+            right.append(np.where(isleaf, ids, tree.children_right) + offset)
+            value.append(tree.value[:, 0, 0])
+
+            offset += tree.node_count
+            max_depth = max(max_depth, tree.max_depth)
+
+        children = np.column_stack([np.concatenate(left),
+                                    np.concatenate(right)]).ravel()
+
+        return cls(np.concatenate(feature).astype(np.int32),
+                   np.concatenate(threshold).astype(np.float64),
+                   children.astype(np.int64),
+                   np.concatenate(value).astype(np.float64),
+                   np.array(roots, dtype=np.int64),
+                   max_depth)
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @property
+    def attrs(self):
+        """ Non-array constructor arguments """
+        return {'max_depth': self.max_depth}
+
+    def _leaves(self, X):
+        """ Global leaf id of each row in each tree, (n_rows, n_trees) """
+        if sparse.issparse(X):
+            # densify a block of rows at a time, never the whole matrix
+            X = X.tocsr()
+            return np.concatenate(
+                [self._leaves(X[i:i+SPARSE_CHUNK].toarray())
+                 for i in range(0, X.shape[0], SPARSE_CHUNK)])
+
+        # sklearn trees compare float32 features against float64 thresholds
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[np.newaxis, :]
+        (n_rows, n_features) = X.shape
+
+        # 1-d take() on flat arrays is much faster than 2-d fancy indexing.
+        # Leaves loop back to themselves, so every row can walk every tree
+        # COMPACT_DEPTH levels deep without any masking
+        Xflat = X.ravel()
+        row_start = np.arange(n_rows, dtype=np.int64)[:, np.newaxis]*n_features
+        nodes = np.repeat(self.roots[np.newaxis, :], n_rows, axis=0)
+        for _ in range(min(self.max_depth, COMPACT_DEPTH)):
+            x = Xflat.take(row_start + self.feature.take(nodes))
+            go_right = x > self.threshold.take(nodes)
+            nodes = self.children.take(2*nodes + go_right)
+        if self.max_depth <= COMPACT_DEPTH:
+            return nodes
+
+        # deeper trees: only the (row, tree) walks not yet at a leaf go on,
+        # and those that reach one are dropped every COMPACT_EVERY levels
+        leaves = nodes.ravel()
+        row_start = np.repeat(row_start.ravel(), nodes.shape[1])
+        active = np.nonzero(self.threshold.take(leaves) != np.inf)[0]
+        (nodes, row_start) = (leaves[active], row_start[active])
+        for depth in range(COMPACT_DEPTH + 1, self.max_depth + 1):
+            x = Xflat.take(row_start + self.feature.take(nodes))
+            go_right = x > self.threshold.take(nodes)
+            nodes = self.children.take(2*nodes + go_right)
+            if depth % COMPACT_EVERY == 0:
+                leaves[active] = nodes
+                internal = self.threshold.take(nodes) != np.inf
+                (active, nodes, row_start) = (active[internal],
+                                              nodes[internal],
+                                              row_start[internal])
+        leaves[active] = nodes
+
+        return leaves.reshape(n_rows, -1)
+
+    def apply(self, X):
+        """ Return the leaf id of each row in each tree, (n_rows, n_trees),
+        numbered within each tree (same as sklearn's apply())
+        """
+        return self._leaves(X) - self.roots[np.newaxis, :]
+
+    def predict(self, X):
+        """ Predict the response for X (average of the tree predictions) """
+        return self.value[self._leaves(X)].mean(axis=1)
+
+
+def _time_predict(predict, X, n_repeats):
+    """ Return the best-of-n_repeats time (seconds) of predict(X) """
+    best = np.inf
+    for _ in range(n_repeats):
+        t0 = time.perf_counter()
+        predict(X)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def benchmark(reg, X, n_rows=(1, 10000), n_repeats=20):
+    """ Compare sklearn predict() against FlatForest predict() for batches of
+    rows, and check that the predictions match
+
+    Args:
+        reg (estimator): fitted sklearn tree or forest regressor
+        X (array): features to draw rows from (tiled if fewer than n_rows)
+
+    Kwargs:
+        n_rows (list): batch sizes to time. Default is (1, 10000)
+        n_repeats (int): number of timing repeats (best is kept). Default 20
+
+    Returns:
+        results (list): one dict per batch size with keys 'n_rows',
+            'time_sklearn', 'time_flat' (seconds), 'speedup', and
+            'max_abs_diff' between the two predictions
+    """
+    flat = FlatForest.from_sklearn(reg)
+    X = np.asarray(X)
+
+    results = []
+    for n in n_rows:
+        Xn = np.resize(X, (n, X.shape[1]))
+        diff = np.abs(reg.predict(Xn) - flat.predict(Xn)).max()
+        t_sk = _time_predict(reg.predict, Xn, n_repeats)
+        t_flat = _time_predict(flat.predict, Xn, n_repeats)
+        results.append({'n_rows': n,
+                        'time_sklearn': t_sk,
+                        'time_flat': t_flat,
+                        'speedup': t_sk/t_flat,
+                        'max_abs_diff': diff})
+        print('{:6d} rows: sklearn {:9.1f} us, flat {:9.1f} us ({:5.1f}x), '
+              'max abs diff {:.1e}'.format(n, t_sk*1e6, t_flat*1e6,
+                                           t_sk/t_flat, diff))
+
+    return results
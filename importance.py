@@ -0,0 +1,126 @@
+"""
+importance - permutation feature importance on held-out data
+============================================================
+
+**importance** ranks features of any fitted (or saved) model by how much the
+held-out score drops when that feature's column is randomly permuted. Unlike
+the forests' impurity-based feature_importances_, it is measured on test data
+and works for every model family, including the Lasso
+"""
+
+import joblib
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.metrics import r2_score
+
+# column_info group flag -> prefix for human-readable feature labels
+GROUP_LABELS = [('is_cond_', 'Condition: '),
+                ('is_intv_', 'Intervention: '),
+                ('is_intvtype_', 'Class: '),
+                ('is_keyword_', 'Keyword: ')]
+
+
+def human_labels(names, column_info):
+    """ Given feature (column) names and the column_info metadata dataframe,
+    return list of human-readable labels, prefixed by the feature group (e.g.
+    'Condition: Breast neoplasms')
+    """
+    labels = []
+    for n in names:
+        label = column_info.loc[n, 'name']
+        for (flag, prefix) in GROUP_LABELS:
+            if column_info.loc[n, flag]:
+                label = prefix + label
+                break
+        labels.append(label)
+    return labels
+
+
+def _permuted_scores(predict, X, y, j, n_repeats, seed, scorer):
+    """ Score of predict() on X with column j permuted, for n_repeats
+    different permutations (all predicted in one call)
+    """
+    rng = np.random.RandomState(seed)
+    n = X.shape[0]
+
+    Xperm = np.tile(X, (n_repeats, 1))
+    for r in range(n_repeats):
+        Xperm[r*n:(r+1)*n, j] = X[rng.permutation(n), j]
+    ypred = predict(Xperm).reshape(n_repeats, n)
+
+    return np.array([scorer(y, ypred[r]) for r in range(n_repeats)])
+
+
+def permutation_importance(reg, X, y, feature_names, column_info=None,
+                           n_repeats=5, n_jobs=-1, random_state=0,
+                           scorer=r2_score):
+    """ Permutation feature importance of a fitted model on (held-out) data
+
+    The baseline predictions/score are computed once. Work is split across
+    features in parallel processes, and the repeats for one feature are
+    predicted together in a single batched call.
+
+    Args:
+        reg (estimator): fitted model with a predict() method
+        X (array): held-out features, shape (n_samples, n_features)
+        y (array): held-out response, in the units the model predicts
+        feature_names (list): column names of X
+
+    Kwargs:
+        column_info (DataFrame or None): column metadata (as saved by
+            playground_model1). If given, add human-readable labels
+        n_repeats (int): permutations per feature. Default is 5
+        n_jobs (int): number of parallel jobs (-1 = all CPUs). Default -1
+        random_state (int): seed for the permutations. Default is 0
+        scorer (function): score(y_true, y_pred), higher is better. Default
+            is r2_score
+
+    Returns:
+        ranked (DataFrame): one row per feature, sorted by decreasing
+            importance, with columns 'feature', 'label' (if column_info),
+            'importance' (mean score drop), and 'importance_std'
+        baseline (float): score of the un-permuted predictions
+    """
+    if sparse.issparse(X):
+        # held-out rows only; permuting needs dense columns
+        X = X.toarray()
+    X = np.asarray(X, dtype=np.float64)
+    y = np.ravel(y)
+    baseline = scorer(y, reg.predict(X))
+
+    scores = joblib.Parallel(n_jobs=n_jobs)(
+        joblib.delayed(_permuted_scores)(reg.predict, X, y, j, n_repeats,
+                                         random_state + j, scorer)
+        for j in range(X.shape[1]))
+    drops = baseline - np.array(scores)
+
+    ranked = pd.DataFrame({'feature': list(feature_names),
+                           'importance': drops.mean(axis=1),
+                           'importance_std': drops.std(axis=1)})
+    if column_info is not None:
+        ranked['label'] = human_labels(ranked['feature'], column_info)
+        ranked = ranked[['feature', 'label', 'importance', 'importance_std']]
+    ranked = ranked.sort_values('importance', ascending=False)
+    ranked = ranked.reset_index(drop=True)
+
+    return (ranked, baseline)
+
+
+def saved_model_importance(path, X, y, feature_names, column_info=None,
+                           **kwargs):
+    """ Permutation importance of a saved model (artifact directory or pickle
+    file). y is the droprate; it is transformed to the model's response units
+    when the artifact metadata says so (e.g. the Lasso predicts droprate**1/3)
+
+    Other kwargs are passed to permutation_importance()
+    """
+    import artifact
+
+    reg = artifact.load_model(path)
+    meta = getattr(reg, 'meta', {}).get('metadata', {})
+    if meta.get('response_transform') == 'cuberoot':
+        y = np.ravel(y)**(1/3)
+
+    return permutation_importance(reg, X, y, feature_names,
+                                  column_info=column_info, **kwargs)
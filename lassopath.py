@@ -0,0 +1,246 @@
+"""
+lassopath - fast cross-validated Lasso over a grid of alphas
+============================================================
+
+**lassopath** fits the whole Lasso regularization path (largest alpha first)
+on each CV fold with warm starts, using coordinate descent on a precomputed
+Gram matrix and sequential strong-rule feature screening, and selects alpha by
+CV R2. It solves the same problem as linear_model.Lasso(normalize=True), i.e.
+features are centered and scaled to unit l2 norm, and the objective is
+
+    (1 / (2 * n_samples)) * ||y - Xw||^2_2 + alpha * ||w||_1
+
+so it can replace GridSearchCV(Lasso(normalize=True), {'alpha': [...]}).
+"""
+
+import numpy as np
+from scipy import sparse
+from sklearn import linear_model
+from sklearn.model_selection import KFold
+
+
+def _raw_stats(X, y):
+    """ Uncentered sufficient statistics (X'X, X'y, column sums of X, sum of
+    y, n_samples) of a (dense or sparse) X and y. Statistics of disjoint sets
+    of rows add up, so those of a CV training fold are the full-data ones
+    minus those of the held-out fold
+    """
+    XtX = X.T @ X
+    if sparse.issparse(XtX):
+        XtX = XtX.toarray()
+    return (np.asarray(XtX, dtype=np.float64),
+            np.asarray(X.T @ y, dtype=np.float64).ravel(),
+            np.asarray(X.sum(axis=0), dtype=np.float64).ravel(),
+            float(y.sum()),
+            X.shape[0])
+
+
+def _normalized_gram(stats):
+    """ Gram matrix & X'y for X centered and scaled to unit column l2 norm (and
+    y centered), computed from the raw statistics without forming the
+    centered X
+
+    Returns:
+        G (array): (n_features, n_features) normalized Gram matrix
+        Xy (array): (n_features,) normalized X'y
+        X_mean, X_scale (arrays): column means and l2 norms (after centering)
+        y_mean (float): mean of y
+    """
+    (XtX, Xty, X_sum, y_sum, n) = stats
+    X_mean = X_sum/n
+    y_mean = y_sum/n
+
+    G = XtX - n*np.outer(X_mean, X_mean)
+    Xy = Xty - n*X_mean*y_mean
+
+    X_scale = np.sqrt(np.clip(np.diag(G), 0, None))
+    X_scale[X_scale == 0] = 1.
+    G /= np.outer(X_scale, X_scale)
+    Xy /= X_scale
+
+    return (G, Xy, X_mean, X_scale, y_mean)
+
+
+def _cd_gram(G, Xy, yc, l1_reg, w, active, max_iter=1000, tol=1e-4):
+    """ Coordinate descent for min_w 1/2 w'Gw - Xy'w + l1_reg*|w|_1 over the
+    features in active (others stay fixed), with sklearn's compiled Gram
+    solver. w is updated in place (warm start)
+
+    Args:
+        G, Xy (arrays): normalized Gram matrix and X'y (all features)
+        yc (array): centered response (only its norm is used, for the
+            duality-gap stopping rule)
+        l1_reg (float): n_samples*alpha
+        w (array): coefficients (all features), updated in place
+        active (array): indices of the features to optimize
+    """
+    active = np.asarray(active)
+    if len(active) == 0:
+        return w
+    n = len(yc)
+
+    # with a precomputed Gram matrix and check_input=False, enet_path only
+    # uses X for its shape, so pass a zero-stride placeholder instead of the
+    # (n_samples, n_active) normalized data
+    Xshape = np.broadcast_to(np.zeros(1), (n, len(active)))
+    (_, coefs, _) = linear_model.enet_path(
+        Xshape, yc, l1_ratio=1., alphas=[l1_reg/n],
+        precompute=np.ascontiguousarray(G[np.ix_(active, active)]),
+        Xy=np.ascontiguousarray(Xy[active]),
+        coef_init=np.asfortranarray(w[active]),
+        max_iter=max_iter, tol=tol, check_input=False)
+
+    w[active] = coefs[:, 0]
+    return w
+
+
+def lasso_path(X, y, alphas, n_path=10, max_iter=1000, tol=1e-4,
+               stats=None):
+    """ Fit Lasso(normalize=True) for every alpha, largest first, with warm
+    starts and strong-rule screening
+
+    The path runs over a geometric grid from the smallest alpha giving all-zero
+    coefficients down to min(alphas) (plus alphas themselves), since the
+    strong rule only screens well between nearby alphas. For each alpha only
+    the features that pass the sequential strong rule (|gradient| >=
+    2*alpha - previous alpha, in n_samples units), plus the previous support,
+    are optimized. The KKT conditions are then checked on all the features
+    and any violators are added and refit, so the solution is exact.
+
+    Args:
+        X (array or sparse matrix): features, shape (n_samples, n_features).
+            Only X'X is formed, so a sparse X is never densified (but the
+            Gram matrix itself is dense, n_features**2)
+        y (array): response, shape (n_samples,)
+        alphas (list): regularization strengths
+
+    Kwargs:
+        n_path (int): number of geometric grid points between alpha_max and
+            min(alphas) that are fit (for warm starts & screening) but not
+            returned. Default is 10
+        max_iter (int): max coordinate descent iterations per alpha. Default
+            is 1000
+        tol (float): convergence tolerance, same meaning as in
+            linear_model.Lasso. Default is 1e-4
+        stats (tuple or None): precomputed _raw_stats(X, y). If given, X is
+            not used (and may be None)
+
+    Returns:
+        alphas (array): alphas, sorted largest first
+        coefs (array): (len(alphas), n_features) coefficients, original units
+        intercepts (array): (len(alphas),) intercepts
+        n_screened (array): number of features optimized for each alpha
+    """
+    y = np.ravel(y).astype(np.float64)
+    alphas = np.sort(np.asarray(alphas, dtype=np.float64))[::-1]
+    if stats is None:
+        stats = _raw_stats(X, y)
+    (G, Xy, X_mean, X_scale, y_mean) = _normalized_gram(stats)
+    n = stats[4]
+    yc = y - y_mean
+
+    n_features = len(Xy)
+    w = np.zeros(n_features)
+    grad = Xy.copy()
+    prev_l1 = np.abs(Xy).max()   # n * alpha_max: above it, w = 0
+
+    # dense path from alpha_max down, plus the requested alphas
+    alpha_max = prev_l1/n
+    path = np.geomspace(alpha_max, min(alphas.min(), alpha_max), n_path)
+    path = np.unique(np.concatenate([path, alphas]))[::-1]
+
+    coefs = np.zeros((len(alphas), n_features))
+    n_screened = np.zeros(len(alphas), dtype=int)
+    for alpha in path:
+        l1_reg = n*alpha
+
+        # sequential strong rule + current support
+        keep = (np.abs(grad) >= 2*l1_reg - prev_l1) | (w != 0)
+        while True:
+            _cd_gram(G, Xy, yc, l1_reg, w, np.nonzero(keep)[0],
+                     max_iter=max_iter, tol=tol)
+            support = np.nonzero(w)[0]
+            grad = Xy - G[:, support] @ w[support]
+
+            # KKT check on the screened-out features
+            violators = ~keep & (np.abs(grad) > l1_reg*(1 + 1e-9))
+            if not violators.any():
+                break
+            keep |= violators
+
+        prev_l1 = l1_reg
+        for i in np.nonzero(alphas == alpha)[0]:
+            coefs[i] = w/X_scale
+            n_screened[i] = keep.sum()
+
+    intercepts = y_mean - coefs @ X_mean
+
+    return (alphas, coefs, intercepts, n_screened)
+
+
+def lasso_path_cv(X, y, alphas, nfolds=3, n_path=10, max_iter=1000,
+                  tol=1e-4):
+    """ Select the Lasso(normalize=True) alpha by k-fold CV R2, fitting the
+    whole alpha path once per fold
+
+    Args:
+        X (array or sparse matrix): features, shape (n_samples, n_features)
+        y (array): response, shape (n_samples,)
+        alphas (list): alphas to try
+
+    Kwargs:
+        nfolds (int): number of (unshuffled, like GridSearchCV) CV folds.
+            Default is 3
+        n_path, max_iter, tol: see lasso_path()
+
+    Returns:
+        results (dict): dictionary with keys (in the order of alphas, like
+            GridSearchCV's cv_results_):
+            'params' (list): [{'alpha': a}, ...]
+            'mean_test_score', 'std_test_score' (arrays): CV R2 per alpha
+            'scores' (array): (nfolds, len(alphas)) R2 per fold and alpha
+            'best_params' (dict): {'alpha': best alpha}
+    """
+    y = np.ravel(y).astype(np.float64)
+    alphas = list(alphas)
+
+    # Gram statistics once for all the data; each training fold's are the
+    # full ones minus the (smaller) held-out fold's
+    full_stats = _raw_stats(X, y)
+
+    scores = np.zeros((nfolds, len(alphas)))
+    for (k, (train, test)) in enumerate(KFold(n_splits=nfolds).split(X)):
+        test_stats = _raw_stats(X[test], y[test])
+        train_stats = tuple(f - t for (f, t) in zip(full_stats, test_stats))
+        (path_alphas, coefs, intercepts, _) = lasso_path(
+            None, y[train], alphas, n_path=n_path, max_iter=max_iter,
+            tol=tol, stats=train_stats)
+
+        # R2 on the held-out fold for every alpha at once
+        ypred = np.asarray(X[test] @ coefs.T) + intercepts
+        ss_res = ((y[test][:, np.newaxis] - ypred)**2).sum(axis=0)
+        ss_tot = ((y[test] - y[test].mean())**2).sum()
+        fold_scores = 1 - ss_res/ss_tot
+
+        # path is sorted largest alpha first; map back to input order
+        for (j, a) in enumerate(alphas):
+            scores[k, j] = fold_scores[np.nonzero(path_alphas == a)[0][0]]
+
+    mean_test_score = scores.mean(axis=0)
+    best = int(np.argmax(mean_test_score))
+
+    return {'params': [{'alpha': a} for a in alphas],
+            'mean_test_score': mean_test_score,
+            'std_test_score': scores.std(axis=0),
+            'scores': scores,
+            'best_params': {'alpha': alphas[best]}}
+
+
+def standardized_alpha(alpha, n_samples):
+    """ The alpha on standardized (unit std) features, as train's Lasso
+    pipeline uses, that solves the same problem as this module's
+    Lasso(normalize=True) alpha: unit l2 norm columns are sqrt(n_samples)
+    times smaller, so the coefficients, and with them the penalty, scale by
+    sqrt(n_samples)
+    """
+    return alpha*np.sqrt(n_samples)
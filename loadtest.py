@@ -0,0 +1,286 @@
+"""
+loadtest - throughput and isolation load test of the served dashboard
+=====================================================================
+
+**loadtest** starts the dashboard under gunicorn (app/gunicorn.conf.py, model
+preloaded before forking) with an increasing number of worker processes, and
+drives it with concurrent simulated users. Each user sends its own distinct
+inputs through the two dashboard callbacks, update_userdata and then
+update_predictions, over HTTP. Every response is checked against that user's
+inputs, and the prediction against the model run locally on them. This
+catches any state leaking between users. The report shows interactions per
+second and the speedup per worker count. Usage::
+
+    python loadtest.py --workers 1 2 4 --users 50 --clients 16
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from math import ceil
+import pandas as pd
+import encoder
+import serving
+
+APP_DIR = 'app'
+UPDATE_PATH = '/_dash-update-component'
+
+# update_userdata's inputs, in callback order: (component id, property)
+USERDATA_INPUTS = [('participants_text', 'value'),
+                   ('malefraction_text', 'value'),
+                   ('minage_text', 'value'),
+                   ('duration_slider', 'value'),
+                   ('arms_slider', 'value'),
+                   ('num_facilities_slider', 'value'),
+                   ('has_us_facility_radio', 'value'),
+                   ('intvtype_dropdown', 'value'),
+                   ('cond_dropdown', 'value'),
+                   ('intv_dropdown', 'value'),
+                   ('phase_checklist', 'values'),
+                   ('keyword_dropdown', 'value')]
+
+# dummy group of each dropdown/checklist input
+INPUT_GROUPS = {'intvtype_dropdown': 'is_intvtype_',
+                'cond_dropdown': 'is_cond_',
+                'intv_dropdown': 'is_intv_',
+                'phase_checklist': 'is_phase',
+                'keyword_dropdown': 'is_keyword_'}
+
+
+def _post_json(url, payload, timeout=30):
+    request = urllib.request.Request(
+        url, data=json.dumps(payload).encode('utf-8'),
+        headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+def dash_callback(base_url, output, inputs):
+    """ Call a dashboard callback over HTTP (the dash '/_dash-update-component'
+    request of the dash version app.py is written for)
+
+    Args:
+        base_url (str): e.g. 'http://127.0.0.1:8050'
+        output (tuple): (component id, property) of the callback output
+        inputs (list): [(component id, property, value)], in callback order
+
+    Returns:
+        value: the output property's new value
+    """
+    payload = {'output': {'id': output[0], 'property': output[1]},
+               'inputs': [{'id': i, 'property': p, 'value': v}
+                          for (i, p, v) in inputs]}
+    response = _post_json(base_url + UPDATE_PATH, payload)
+    return response['response']['props'][output[1]]
+
+
+def user_inputs(user, groups):
+    """ Distinct dashboard inputs of simulated user number `user`
+
+    Args:
+        user (int): user number
+        groups (dict): {group: dummy column names} (FeatureEncoder.groups)
+
+    Returns:
+        inputs (dict): {component id: value}, see USERDATA_INPUTS
+    """
+    def pick(group, k=1):
+        names = groups[group]
+        return [names[(7*user + 3*j) % len(names)] for j in range(k)]
+
+    return {'participants_text': str(100 + user),
+            'malefraction_text': str(user % 101),
+            'minage_text': str(18 + user % 50),
+            'duration_slider': 6*(1 + user % 40),
+            'arms_slider': 1 + user % 4,
+            'num_facilities_slider': 1 + user % 50,
+            'has_us_facility_radio': bool(user % 2),
+            'intvtype_dropdown': pick('is_intvtype_')[0],
+            'cond_dropdown': pick('is_cond_', 2),
+            'intv_dropdown': pick('is_intv_'),
+            'phase_checklist': pick('is_phase'),
+            'keyword_dropdown': pick('is_keyword_')}
+
+
+def check_userdata(userdata, inputs, feature_encoder):
+    """ True if the served user data reflects exactly these inputs """
+    if (userdata['completed'] != int(inputs['participants_text']) or
+            userdata['arms'] != inputs['arms_slider'] or
+            userdata['duration'] != inputs['duration_slider'] or
+            userdata['facilities'] != inputs['num_facilities_slider']):
+        return False
+    for (input_id, group) in INPUT_GROUPS.items():
+        selected = inputs[input_id]
+        selected = [selected] if isinstance(selected, str) else selected
+        if (sorted(feature_encoder.selected(userdata, group)) !=
+                sorted(set(selected))):
+            return False
+    return True
+
+
+def check_prediction(children, userdata, reg, feature_encoder):
+    """ True if the served prediction text matches the model's prediction
+    for this user data
+    """
+    text = children[0]['props']['children']
+    (droprate_pct, enroll) = [int(n)
+                              for n in re.findall(r'-?\d+', text)[:2]]
+    pred = reg.predict(feature_encoder.encode(userdata))[0]
+    return (droprate_pct == int(round(pred*100)) and
+            enroll == ceil(userdata['completed']/(1 - pred)))
+
+
+def interact(base_url, user, groups, reg, feature_encoder):
+    """ One user interaction: inputs -> user data -> prediction, checked
+
+    Returns:
+        status (str): 'ok', 'leak' (response of another user's inputs), or
+            'error' (failed request)
+    """
+    from json_tricks import loads
+
+    inputs = user_inputs(user, groups)
+    try:
+        json_userdata = dash_callback(
+            base_url, ('data_holder', 'children'),
+            [(i, p, inputs[i]) for (i, p) in USERDATA_INPUTS])
+        children = dash_callback(
+            base_url, ('pred_report', 'children'),
+            [('data_holder', 'children', json_userdata)])
+    except Exception:
+        return 'error'
+
+    userdata = dict(loads(json_userdata))
+    if not (check_userdata(userdata, inputs, feature_encoder) and
+            check_prediction(children, userdata, reg, feature_encoder)):
+        return 'leak'
+    return 'ok'
+
+
+def start_server(workers, port, model='reg_model2', app_dir=APP_DIR,
+                 startup_timeout=120):
+    """ Start the dashboard under gunicorn and wait until it answers
+
+    Returns:
+        process (Popen): the gunicorn master (terminate() it when done)
+    """
+    env = dict(os.environ, INSIGHT_MODEL=model)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+         '--workers', str(workers), '--bind', '127.0.0.1:{}'.format(port),
+         'app:server'],
+        cwd=app_dir, env=env, stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL)
+
+    url = 'http://127.0.0.1:{}/cache_stats'.format(port)
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < startup_timeout:
+        if process.poll() is not None:
+            raise RuntimeError('gunicorn exited with code {}'
+                               .format(process.returncode))
+        try:
+            urllib.request.urlopen(url, timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('dashboard did not start in {} s'
+                       .format(startup_timeout))
+
+
+def run_load(base_url, groups, reg, feature_encoder, n_users=50, n_rounds=4,
+             n_clients=16):
+    """ n_rounds interactions of each of n_users users, from n_clients
+    concurrent clients (users interleaved, so concurrent requests come from
+    different users)
+
+    Returns:
+        row (dict): 'interactions', 'seconds', 'interactions_per_sec', and
+            the 'ok', 'leak', and 'error' counts
+    """
+    users = [u for _ in range(n_rounds) for u in range(n_users)]
+    with ThreadPoolExecutor(max_workers=n_clients) as pool:
+        # warm up (first requests of each worker)
+        list(pool.map(lambda u: interact(base_url, u, groups, reg,
+                                         feature_encoder),
+                      range(n_clients)))
+        t0 = time.perf_counter()
+        statuses = list(pool.map(lambda u: interact(base_url, u, groups, reg,
+                                                    feature_encoder),
+                                 users))
+        seconds = time.perf_counter() - t0
+
+    return {'interactions': len(users),
+            'seconds': seconds,
+            'interactions_per_sec': len(users)/seconds,
+            'ok': statuses.count('ok'),
+            'leak': statuses.count('leak'),
+            'error': statuses.count('error')}
+
+
+def scaling(workers_list=(1, 2, 4), port=8765, model='reg_model2',
+            app_dir=APP_DIR, n_users=50, n_rounds=4, n_clients=16):
+    """ Throughput and isolation for each number of workers
+
+    Returns:
+        results (DataFrame): one row per worker count (see run_load()),
+            with the 'speedup' over the first
+    """
+    assets = serving.LazyAssets(serving.app_manifest(model=model),
+                                basedir=app_dir)
+    reg = assets['model']
+    column_info = assets['column_info']
+    feature_names = getattr(reg, 'feature_names', None)
+    if feature_names is None:
+        feature_names = serving.default_row(assets)['columns']
+    feature_encoder = encoder.FeatureEncoder(feature_names, column_info)
+
+    rows = []
+    for workers in workers_list:
+        process = start_server(workers, port, model=model, app_dir=app_dir)
+        try:
+            row = run_load('http://127.0.0.1:{}'.format(port),
+                           feature_encoder.groups, reg, feature_encoder,
+                           n_users=n_users, n_rounds=n_rounds,
+                           n_clients=n_clients)
+        finally:
+            process.terminate()
+            process.wait()
+        rows.append({'workers': workers, **row})
+        print('{} workers: {interactions_per_sec:0.1f} interactions/s, '
+              '{leak} leaks, {error} errors'.format(workers, **row))
+
+    results = pd.DataFrame(rows)
+    results['speedup'] = (results['interactions_per_sec'] /
+                          results['interactions_per_sec'].iloc[0])
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 2, 4])
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--rounds', type=int, default=4)
+    parser.add_argument('--clients', type=int, default=16,
+                        help='concurrent clients')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--model', default='reg_model2',
+                        help='INSIGHT_MODEL of the app (see app/app.py)')
+    args = parser.parse_args(argv)
+
+    results = scaling(args.workers, port=args.port, model=args.model,
+                      n_users=args.users, n_rounds=args.rounds,
+                      n_clients=args.clients)
+    print(results.to_string(index=False))
+    if results[['leak', 'error']].values.any():
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
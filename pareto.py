@@ -0,0 +1,166 @@
+"""
+pareto - accuracy vs latency vs size sweep of tree and forest settings
+======================================================================
+
+**pareto** trains a grid of decision tree / random forest configurations
+(n_estimators, max_depth, max_features, min_samples_leaf, ...), exports each
+as the memory-mapped artifact the app would serve, and measures its test R2,
+single-row predict latency, batch throughput, and artifact size. The
+configurations that no other configuration beats on all of these at once
+form the Pareto front, from which production settings can be picked. Usage::
+
+    python pareto.py --models rf dtree --out reports/pareto.csv
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.metrics import r2_score
+from sklearn.model_selection import ParameterGrid
+import artifact
+import train
+
+# default sweep grids, around the playground_model2 settings (n_estimators=20,
+# max_depth=10, max_features=0.45, min_samples_leaf=5)
+SWEEP_GRIDS = {'dtree': {'max_depth': [4, 6, 8, 10, None],
+                         'min_samples_leaf': [1, 5, 20]},
+               'rf': {'n_estimators': [10, 20, 50],
+                      'max_depth': [6, 10, None],
+                      'max_features': [0.2, 0.45, 1.0],
+                      'min_samples_leaf': [5, 20]}}
+
+# objectives of the front: columns to maximize and to minimize
+MAXIMIZE = ('test_r2', 'rows_per_sec')
+MINIMIZE = ('predict_1row_us', 'artifact_mb')
+
+
+def _dir_size(path):
+    """ Total size in bytes of the files in a directory """
+    return sum(os.path.getsize(os.path.join(path, f))
+               for f in os.listdir(path))
+
+
+def measure(name, params, X, y, Xtest, ytest, feature_names=None,
+            n_repeats=50):
+    """ Fit one configuration and measure it as served (artifact predictor)
+
+    Args:
+        name (str): model family (see train.MODELS), e.g. 'rf'
+        params (dict): model parameters (update train.DEFAULT_PARAMS)
+        X, y, Xtest, ytest: training and test data
+
+    Kwargs:
+        feature_names (list or None): column names (for the artifact)
+        n_repeats (int): timing repeats (best is kept). Default is 50
+
+    Returns:
+        row (dict): 'model', 'params', 'fit_time_s', 'test_r2',
+            'predict_1row_us', 'rows_per_sec' (test set batch), and
+            'artifact_mb'
+    """
+    (reg, fit_time) = train.fit_model(name, X, y, **params)
+    Xt = Xtest.toarray() if sparse.issparse(Xtest) else np.asarray(Xtest)
+    feature_names = feature_names or [str(i) for i in range(Xt.shape[1])]
+
+    tmpdir = tempfile.mkdtemp(prefix='pareto_')
+    try:
+        artifact.save_artifact(reg, tmpdir, feature_names)
+        size = _dir_size(tmpdir)
+        pred = artifact.load_artifact(tmpdir)
+        test_r2 = r2_score(np.ravel(ytest), pred.predict(Xt))
+        row_time = train._best_time(lambda: pred.predict(Xt[:1]), n_repeats)
+        batch_time = train._best_time(lambda: pred.predict(Xt),
+                                      max(1, n_repeats//10))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    return {'model': name,
+            'params': params,
+            'fit_time_s': fit_time,
+            'test_r2': test_r2,
+            'predict_1row_us': row_time*1e6,
+            'rows_per_sec': Xt.shape[0]/batch_time,
+            'artifact_mb': size/1e6}
+
+
+def sweep(grids, X, y, Xtest, ytest, feature_names=None, n_repeats=50):
+    """ Measure every configuration of several parameter grids
+
+    Args:
+        grids (dict): {model family: param_grid} (param_grid as for sklearn's
+            GridSearchCV), e.g. SWEEP_GRIDS
+        X, y, Xtest, ytest: training and test data
+
+    Kwargs:
+        feature_names, n_repeats: see measure()
+
+    Returns:
+        results (DataFrame): one row per configuration (see measure()), with
+            a boolean 'pareto' column (see pareto_front())
+    """
+    rows = []
+    for (name, grid) in grids.items():
+        for params in ParameterGrid(grid):
+            rows.append(measure(name, params, X, y, Xtest, ytest,
+                                feature_names=feature_names,
+                                n_repeats=n_repeats))
+            print('{} {}: R2 {test_r2:0.3f}, {predict_1row_us:0.0f} us/row, '
+                  '{artifact_mb:0.2f} MB'.format(name, params, **rows[-1]))
+
+    results = pd.DataFrame(rows)
+    results['pareto'] = pareto_front(results)
+    return results
+
+
+def pareto_front(results, maximize=MAXIMIZE, minimize=MINIMIZE):
+    """ Which rows are on the Pareto front: no other row is at least as good
+    on every objective and strictly better on one
+
+    Args:
+        results (DataFrame): one row per configuration
+
+    Kwargs:
+        maximize, minimize (lists): objective columns. Default is MAXIMIZE
+            (test R2, throughput) and MINIMIZE (latency, artifact size)
+
+    Returns:
+        on_front (array): boolean, one per row
+    """
+    # all objectives as "lower is better"
+    costs = np.column_stack([-results[c].values for c in maximize] +
+                            [results[c].values for c in minimize])
+    no_worse = (costs[:, np.newaxis, :] <= costs[np.newaxis, :, :]).all(axis=2)
+    better = (costs[:, np.newaxis, :] < costs[np.newaxis, :, :]).any(axis=2)
+    # dominated[j]: some row i is no worse than j everywhere & better somewhere
+    dominated = (no_worse & better).any(axis=0)
+    return ~dominated
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--models', nargs='+', default=list(SWEEP_GRIDS),
+                        choices=sorted(SWEEP_GRIDS))
+    parser.add_argument('--out', default='reports/pareto.csv',
+                        help='CSV file for all the measured configurations')
+    args = parser.parse_args(argv)
+
+    import compare
+    (X, y, Xtest, ytest, feature_names) = compare.load_data()
+    results = sweep({m: SWEEP_GRIDS[m] for m in args.models}, X, y, Xtest,
+                    ytest, feature_names=feature_names)
+
+    os.makedirs(os.path.dirname(args.out) or '.', exist_ok=True)
+    results.to_csv(args.out, index=False)
+    front = results[results['pareto']].sort_values('test_r2',
+                                                   ascending=False)
+    print('\nPareto front ({} of {} configurations):'
+          .format(len(front), len(results)))
+    print(front.drop(columns='pareto').to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
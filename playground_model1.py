@@ -1,10 +1,19 @@
 # -*- coding: utf-8 -*-
+# headless: figures are saved by reports.py, plt.show() must not block
+import matplotlib
+matplotlib.use('Agg')
+import artifact
 import data
-from sklearn import linear_model
+import evaluate
+import lassopath
+import reports
+import runstore
+import selection
+import serving
+import train
 from sklearn.metrics import mean_squared_error, r2_score, make_scorer
-from sklearn.model_selection import cross_val_score, learning_curve, GridSearchCV
+from sklearn.model_selection import learning_curve
 import matplotlib.pyplot as plt
-from sklearn.externals import joblib
 import pickle as pk
 import pandas as pd
 import re
@@ -20,8 +29,14 @@ import seaborn as sns
 feature_names = Xraw.columns.tolist()
 response_names = yraw.columns.tolist()
 
-X = Xraw.as_matrix()
-y = yraw[response_names[0]].as_matrix()
+# reduced feature schema from playground_model2's selection stage, if saved
+# (Xraw itself keeps all the columns, the app builds its rows from it)
+if selection.load_schema() is not None:
+    feature_names = selection.load_schema()
+
+# sparse CSR features: the frame is mostly boolean dummies
+X = data.tosparse(Xraw[feature_names])
+y = yraw[response_names[0]].to_numpy()
 ytform = y**(1/3)
 
 
@@ -62,8 +77,8 @@ for p in prefixes:
 # LINEAR MODEL (LASSO + TFORM Y + NORMALIZATION)
 # ===============================================================
 
-# === Initialize model
-reg = linear_model.Lasso(normalize=True)
+# === Initialize model (standardized features, see train._lasso)
+reg = train.make_model('lasso')
 
 # reg.fit(X, ytform)
 # ypred = reg.predict(X)
@@ -79,31 +94,36 @@ reg = linear_model.Lasso(normalize=True)
 # print('Training R2 score: {:.2f}'.format(r2_score(ytform, ypred)))
 
 
-# === CV grid search for hyperparameters 
-clf = GridSearchCV(reg, 
-             param_grid={'alpha': [1e-6, 5e-6, 1e-5, 5e-5, 1e-4, 5e-4, 1e-3]},
-             scoring=make_scorer(r2_score))
-clf.fit(X, ytform)
-print("Best hyperparameters: {}".format(clf.best_params_))
+# === CV search for hyperparameters (whole alpha path per fold, warm starts)
+cv_results = lassopath.lasso_path_cv(
+    X, ytform, alphas=[1e-6, 5e-6, 1e-5, 5e-5, 1e-4, 5e-4, 1e-3])
+print("Best hyperparameters: {}".format(cv_results['best_params']))
 print("* Grid scores:")
-means = clf.cv_results_['mean_test_score']
-stds = clf.cv_results_['std_test_score']
-for mean, std, params in zip(means, stds, clf.cv_results_['params']):
+means = cv_results['mean_test_score']
+stds = cv_results['std_test_score']
+for mean, std, params in zip(means, stds, cv_results['params']):
     print("  %0.3f (+/-%0.03f) for %r"
           % (mean, std * 2, params))
-best_params = clf.best_params_
+# the search's alpha is for Lasso(normalize=True) (see lassopath)
+best_params = {'alpha': lassopath.standardized_alpha(
+    cv_results['best_params']['alpha'], X.shape[0])}
 
 
 # === Fit with best alpha
-reg = linear_model.Lasso(**best_params, normalize=True)
+reg = train.make_model('lasso', **best_params)
+# params as runstore.search() keys them
+run_params = runstore.estimator_params(reg)
 reg.fit(X, ytform)
 ypred = reg.predict(X)
 
+# coefficients in the units of the features (scaler folded in)
+coef = artifact.LinearPredictor.from_sklearn(reg).coef
+
 
 # === Print output
 print('\n ** Linear regression + normalization + transform y + LASSO')
 print('Non-zero coefficients:')
-for (c,f) in sorted(zip(reg.coef_, feature_names)):
+for (c,f) in sorted(zip(coef, feature_names)):
     if abs(c) > 1e-4:
         print('{:+0.2f}\t{}'.format(c, f))
 print("RMS error: {:.2f}".format(mean_squared_error(ytform, ypred)**(1/2)))
@@ -112,8 +132,8 @@ print('Training R2 score: {:.2f}'.format(r2_score(ytform, ypred)))
 
 
 
-indices = np.argsort(np.abs(reg.coef_))[::-1]
-ranked_coefs = reg.coef_[indices]
+indices = np.argsort(np.abs(coef))[::-1]
+ranked_coefs = coef[indices]
 ranked_names = [column_info.loc[feature_names[j], 'name'] for j in indices]
 
 print(' ')
@@ -124,25 +144,35 @@ for (c,f) in zip(ranked_coefs, ranked_names):
 
 
 
-for (c, f) in sorted(zip(reg.coef_, feature_names)):
+for (c, f) in sorted(zip(coef, feature_names)):
     if abs(c) > 1e-4:
         print('{:+0.2f}\t{}'.format(c, f))
 
 
 
-# === MODEL: K-FOLD CROSS VALIDATION (i.e. check generalizable) 
+# === TEST SET DATA
+(Xtest, ytest) = evaluate.get_testdata(feature_names)
+
+
+# === MODEL: K-FOLD CROSS VALIDATION, OOF RESIDUALS, TEST SCORE (one pass)
 nfolds = 10
-CV_scores = cross_val_score(reg, X, ytform,
-                            cv=nfolds, 
-                            scoring=make_scorer(r2_score))
-print('{:d}-fold CV R2 score: {:0.2f}+/-{:0.2f}'
-      .format(nfolds, CV_scores.mean(), CV_scores.std()))
+report = evaluate.evaluate_model(reg, X, ytform, nfolds=nfolds,
+                                 Xtest=Xtest, ytest=ytest**(1/3))
+evaluate.print_report(report, name='(LASSO)')
+
+# record the run (params, data fingerprint, fold scores, timings)
+store = runstore.RunStore('data/runs.sqlite')
+store.record_report('lasso', run_params,
+                    runstore.fingerprint(X, ytform), report,
+                    artifact='data/reg_model1', search_kwargs={})
 
 
 # === Plot learning curves
 
 train_sizes, train_scores, test_scores = \
     learning_curve(reg, X, ytform, cv=None, scoring=make_scorer(r2_score))
+reports.save_inputs('lm_learning_curve', train_sizes=train_sizes,
+                    train_scores=train_scores, test_scores=test_scores)
 
 train_scores_mean = np.mean(train_scores, axis=1)
 train_scores_std = np.std(train_scores, axis=1)
@@ -166,10 +196,11 @@ plt.legend(loc="best")
 plt.show()
 
 
-# === PLOT RESIDUALS 
+# === PLOT (OUT-OF-FOLD) RESIDUALS 
 
 sns.set(font_scale=1.5, style='white')
-ypred = reg.predict(X)
+ypred = report['oof_pred']
+reports.save_inputs('lm_oof', y=ytform, ypred=ypred)
 
 fig = plt.figure(figsize=(10, 5))
 
@@ -191,27 +222,6 @@ plt.show()
 
 
 
-# === CALCULATE TEST SET SCORE
-
-feature_names = Xraw.columns.tolist()
-# response_names = yraw.columns.tolist()
-response_names = ['dropped', 'enrolled']
-
-dftest = pd.read_pickle('data/testing_data.pkl')
-Xtest_raw = dftest[feature_names]
-ytest_raw = dftest[response_names]
-ytest_raw['droprate'] = ytest_raw['dropped']/ytest_raw['enrolled']
-
-Xtest = Xtest_raw.as_matrix()
-ytest = ytest_raw[['droprate']].as_matrix()
-
-
-r2_test = reg.score(Xtest, ytest**(1/3))
-
-print(r2_test)
-
-
-
 # === SAVE DATA & MODEL & METADATA VIA PICKEL === #
 
 # DATA
@@ -223,9 +233,14 @@ filename = 'data/yraw_model1.pkl'
 with open(filename, 'wb') as output_file:
     pk.dump(yraw, output_file)
 
+# default row & column order, all the dashboard needs of the data
+serving.save_default_row(Xraw, yraw, 'data/default_row.json')
+
+# all the columns, dense, whatever feature schema the model was trained on:
+# the benchmark (and its committed baseline) is built on this file
 filename = 'data/X_model1.pkl'
 with open(filename, 'wb') as output_file:
-    pk.dump(X, output_file)
+    pk.dump(Xraw.to_numpy(), output_file)
 
 filename = 'data/y_model1.pkl'
 with open(filename, 'wb') as output_file:
@@ -236,6 +251,10 @@ filename = 'data/reg_model1.pkl'
 with open(filename, 'wb') as output_file:
     pk.dump(reg, output_file)
 
+# MODEL ARTIFACT (memory-mappable; model predicts droprate**(1/3))
+artifact.save_artifact(reg, 'data/reg_model1', feature_names,
+                       metadata={'response_transform': 'cuberoot'})
+
 # METADATA
 filename = 'data/human_names.pkl'
 with open(filename, 'wb') as output_file:
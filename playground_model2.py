@@ -1,9 +1,22 @@
 # -*- coding: utf-8 -*-
+# headless: figures are saved by reports.py, plt.show() must not block
+import matplotlib
+matplotlib.use('Agg')
+import artifact
+import conformal
+import distill
 import data
+import evaluate
+import importance
+import quantile
+import render
+import reports
+import runstore
+import selection
+import train
 # from sklearn import linear_model
-from sklearn.ensemble import RandomForestRegressor
 from sklearn.metrics import mean_squared_error, r2_score, make_scorer
-from sklearn.model_selection import cross_val_score, learning_curve, GridSearchCV
+from sklearn.model_selection import learning_curve
 import matplotlib.pyplot as plt
 import pickle as pk
 import pandas as pd
@@ -11,7 +24,6 @@ import pandas as pd
 import numpy as np
 import seaborn as sns
 from sklearn.tree import DecisionTreeRegressor
-from skgarden import RandomForestQuantileRegressor
 
 # ===============================================================
 # GET DATA AND METADATA
@@ -21,73 +33,97 @@ from skgarden import RandomForestQuantileRegressor
 feature_names = Xraw.columns.tolist()
 response_names = yraw.columns.tolist()
 
-X = Xraw.as_matrix()
-y = yraw[response_names[0]].as_matrix()
+# sparse CSR features: the frame is mostly boolean dummies
+X = data.tosparse(Xraw)
+y = yraw[response_names[0]].to_numpy()
 
 with open('data/column_info.pkl', 'rb') as input_file:
     column_info = pk.load(input_file)
 column_info['name'] = [x.capitalize() for x in column_info['name']]
 
+# test set
+(Xtest, ytest) = evaluate.get_testdata(feature_names)
+
+
+# ===============================================================
+# FEATURE SELECTION (reduced schema for all models below and the app)
+# ===============================================================
+
+# drop columns with a zero Lasso coefficient or near-zero RF importance, and
+# keep one column per cluster of strongly correlated ones (but always keep the
+# app's numeric inputs; its term dropdowns only offer the selected dummies)
+(rf_all, _) = train.fit_model('rf', X, y)
+(selected, selection_info) = selection.select_features(
+    X, y, feature_names, importances=rf_all.feature_importances_,
+    lasso_y=y**(1/3), importance_threshold=0.001, corr_threshold=0.9,
+    keep=selection.APP_INPUTS)
+print('Selected {} of {} features'.format(len(selected), len(feature_names)))
+
+# latency & accuracy before/after
+print(selection.compare_schemas(['lasso', 'dtree', 'rf'], X, y, Xtest, ytest,
+                                feature_names, selected))
+
+selection.save_schema(selected, metadata={'n_features_all':
+                                          len(feature_names)})
+feature_names = selected
+X = data.tosparse(Xraw[feature_names])
+(Xtest, ytest) = evaluate.get_testdata(feature_names)
 
 
 # ===============================================================
 # DECISION TREE
 # ===============================================================
 
-# setup regressor
-reg = DecisionTreeRegressor()
-
-# grid search for params
-clf = GridSearchCV(reg, 
-             param_grid={'max_depth': [None, 2, 3, 4, 5, 6, 7, 8],
-                         'max_features': [None, 5, 10, 50, 100]},
-             scoring=make_scorer(r2_score))
-clf.fit(X, y)
-print("Best hyperparameters: {}".format(clf.best_params_))
-print("* Grid scores:")
-means = clf.cv_results_['mean_test_score']
-stds = clf.cv_results_['std_test_score']
-for mean, std, params in zip(means, stds, clf.cv_results_['params']):
+# grid search for params (configurations already evaluated on this data
+# are read from the run store instead of refit)
+store = runstore.RunStore('data/runs.sqlite')
+data_fp = runstore.fingerprint(X, y)
+max_features = [m for m in [None, 5, 10, 50, 100]
+                if m is None or m <= len(feature_names)]
+cv_results = store.search('dtree', X, y, nfolds=3,
+                          param_grid={'max_depth': [None, 2, 3, 4, 5, 6, 7, 8],
+                                      'max_features': max_features})
+print("Best hyperparameters: {}".format(cv_results['best_params']))
+print("* Grid scores ({} from the run store):".format(cv_results['n_skipped']))
+means = cv_results['mean_test_score']
+stds = cv_results['std_test_score']
+for mean, std, params in zip(means, stds, cv_results['params']):
     print("  %0.3f (+/-%0.03f) for %r"
           % (mean, std * 2, params))
-best_params = clf.best_params_
+best_params = cv_results['best_params']
 print(best_params)
 
 
-# fit decision tree
-reg = DecisionTreeRegressor(**best_params)
-reg.fit(X, y)
+# === FIT DECISION TREE, KFOLD CV (R2), OOF RESIDUALS & TEST SCORE
+reg = train.make_model('dtree', **best_params)
+# params as search() keys them, before evaluation changes any
+run_params = runstore.estimator_params(reg)
+nfolds = 10
+report = evaluate.evaluate_model(reg, X, y, nfolds=nfolds,
+                                 Xtest=Xtest, ytest=ytest)
 r2_train = reg.score(X, y)
 print('Training data R2 score: {:0.2f}'.format(r2_train))
-
-# === KFOLD CROSS VALIDATION (R2)
-nfolds = 10
-CV_scores = cross_val_score(reg, X, y,
-                            cv=nfolds, 
-                            scoring=make_scorer(r2_score))
-print('{:d}-fold CV R2 score: {:0.2f}+/-{:0.2f}'
-      .format(nfolds, CV_scores.mean(), CV_scores.std()))
+evaluate.print_report(report, name='(DT)')
+store.record_report('dtree', run_params, data_fp, report, search_kwargs={})
 
 
-# VIZUALIZE decision tree
-from sklearn import tree
-tree.export_graphviz(reg, out_file='tree.dot')
-dot_data = tree.export_graphviz(reg, out_file='tree.dot', 
-                         feature_names=Xraw.columns,  
-                         filled=True, rounded=True) 
-# dot -Tpng tree.dot -o tree.png    (PNG format)
-# dot -Tps tree.dot -o tree.ps    (PS format)
+# VIZUALIZE decision tree (truncated at depth 3 like the forest trees, a
+# full-depth layout can take dot a long time; no shared tree.dot, see
+# render.py)
+render.render_trees([reg], feature_names, outdir='reports/decision_tree',
+                    prefix='DT_dtree', max_depth=3)
 
 
-# === PLOT RESIDUALS
+# === PLOT (OUT-OF-FOLD) RESIDUALS
 sns.set(font_scale=1.5, style='white')
-ypred = reg.predict(X)
+ypred = report['oof_pred']
+reports.save_inputs('dt_oof', y=y, ypred=ypred)
 
 fig = plt.figure(figsize=(10, 5))
 
 # hist of resids
 plt.subplot(1, 2, 1)
-sns.distplot(y-ypred, bins=50, kde=False, vertical=True)
+sns.histplot(y=y-ypred, bins=50)
 sns.despine(fig=fig, bottom=True, left=True)
 plt.xticks([])
 plt.ylabel('Residuals')
@@ -95,7 +131,8 @@ plt.ylim((-0.6, 0.6))
 
 # residuals vs predicted
 plt.subplot(1, 2, 2)
-sns.regplot(ypred, y-ypred, fit_reg=False, scatter_kws={'alpha': 0.2})
+sns.regplot(x=ypred, y=y-ypred, fit_reg=False,
+            scatter_kws={'alpha': 0.2})
 plt.ylim((-0.6, 0.6))
 sns.despine()
 plt.xlabel('predicted')
@@ -107,6 +144,8 @@ plt.show()
 train_sizes, train_scores, test_scores = \
     learning_curve(reg, X, y,
                    cv=None, scoring=make_scorer(r2_score))
+reports.save_inputs('dt_learning_curve', train_sizes=train_sizes,
+                    train_scores=train_scores, test_scores=test_scores)
 
 train_scores_mean = np.mean(train_scores, axis=1)
 train_scores_std = np.std(train_scores, axis=1)
@@ -133,87 +172,67 @@ plt.legend(loc="best")
 plt.show()
 
 
-# ===============================================================
-# COMPUTE TEST SET SCORE - DT
-# ===============================================================
-
-feature_names = Xraw.columns.tolist()
-
-dftest = pd.read_pickle('data/testing_data.pkl')
-Xtest_raw = dftest[feature_names]
-ytest_raw = dftest[['dropped', 'enrolled']]
-ytest_raw['droprate'] = ytest_raw['dropped']/ytest_raw['enrolled']
-
-Xtest = Xtest_raw.as_matrix()
-ytest = ytest_raw[['droprate']].as_matrix()
-
-
-r2_test = reg.score(Xtest, ytest)
-
-
-print('R2 test score:', r2_test)
-
-
 # ===============================================================
 # RANDOM FOREST REGRESSOR
 # ===============================================================
 
 # === SETUP RANDOM FOREST
-reg = RandomForestRegressor()
 nfolds = 5
+n_features = len(feature_names)
 
 
-# === GRID SEARCH FOR HYPERPARAMETERS
-clf = GridSearchCV(reg, 
-             param_grid={'n_estimators': [20],
-                         'max_depth': [10],
-                         'max_features': [75],
-                         'min_samples_leaf': [5]},
-             scoring=make_scorer(r2_score), cv=nfolds)
-clf.fit(X, y)
+# === GRID SEARCH FOR HYPERPARAMETERS (skips runs already in the store)
+# scored on out-of-bag predictions: one fit per configuration, not nfolds
+cv_results = store.search('rf', X, y, method='oob',
+                          param_grid={'n_estimators': [20],
+                                      'max_depth': [10],
+                                      'max_features': [min(75, n_features)],
+                                      'min_samples_leaf': [5]})
 
-print("* Grid scores:")
-means = clf.cv_results_['mean_test_score']
-stds = clf.cv_results_['std_test_score']
-for mean, std, params in zip(means, stds, clf.cv_results_['params']):
+print("* Grid scores ({} from the run store):".format(cv_results['n_skipped']))
+means = cv_results['mean_test_score']
+stds = cv_results['std_test_score']
+for mean, std, params in zip(means, stds, cv_results['params']):
     print("  %0.3f (+/-%0.03f) for %r"
           % (mean, std * 2, params))
 
-best_params = clf.best_params_
+best_params = cv_results['best_params']
 print("Best hyperparameters: {}".format(best_params))
 
 
 # === FIT RF-REGRESSION WITH BEST PARAMS
-best_params = {'n_estimators': 20,
-               'max_depth': 10,
-               'min_samples_leaf': 5,
-               'max_features': 75}
+# (see pareto.py for how these trade test R2 against latency and size)
+reg = train.make_model('rf', **best_params)
+# params as search() keys them (evaluate_oob() sets oob_score=True)
+run_params = runstore.estimator_params(reg)
 
-reg = RandomForestRegressor(**best_params)
-reg.fit(X, y)
+# === OUT-OF-BAG VALIDATION (R2), OOB RESIDUALS & TEST SCORE
+report = evaluate.evaluate_oob(reg, X, y, Xtest=Xtest, ytest=ytest)
 
 # print report
 r2_train = reg.score(X, y)
 print('Training data R2 score: {:0.2f}'.format(r2_train))
+evaluate.print_report(report, name='(RF)')
+store.record_report('rf', run_params, data_fp, report,
+                    artifact='data/reg_model2', search_kwargs={})
 
-
-# === KFOLD CROSS VALIDATION (R2)
-CV_scores = cross_val_score(reg, X, y,
-                            cv=nfolds, 
-                            scoring=make_scorer(r2_score))
-print('{:d}-fold CV R2 score: {:0.2f}+/-{:0.2f}'
-      .format(nfolds, CV_scores.mean(), CV_scores.std()))
+# === OOB vs K-FOLD R2 (and cost) FOR THE FORESTS
+print(evaluate.compare_oob_kfold(
+    {'rf': train.make_model('rf', **best_params),
+     'qrf': train.make_model('qrf', **best_params)},
+    X, y, nfolds=nfolds))
 
 
-# === PLOT RESIDUALS
+# === PLOT (OUT-OF-BAG) RESIDUALS
 sns.set(font_scale=1.5, style='white')
-ypred = reg.predict(X)
+ypred = report['oof_pred']
+reports.save_inputs('rf_oof', y=y, ypred=ypred)
 
 fig = plt.figure(figsize=(10, 5))
 
 # hist of resids
 plt.subplot(1, 2, 1)
-sns.distplot(y-ypred, bins=50, kde=False, vertical=True)
+sns.histplot(y=y-ypred, bins=50)
 sns.despine(fig=fig, bottom=True, left=True)
 plt.xticks([])
 plt.ylabel('Residuals')
@@ -222,7 +241,8 @@ plt.ylim((-0.6, 0.6))
 
 # residuals vs predicted
 plt.subplot(1, 2, 2)
-sns.regplot(ypred, y-ypred, fit_reg=False, scatter_kws={'alpha': 0.2})
+sns.regplot(x=ypred, y=y-ypred, fit_reg=False,
+            scatter_kws={'alpha': 0.2})
 plt.ylim((-0.6, 0.6))
 sns.despine()
 plt.xlabel('Predicted value')
@@ -232,7 +252,7 @@ plt.show()
 # === FEATURE IMPORTANCES & PLOT
 
 # Calculate feature importances
-names = Xraw.columns.tolist()
+names = list(feature_names)
 importances = reg.feature_importances_
 std = np.std([tree.feature_importances_ for tree in reg.estimators_],
              axis=0)
@@ -245,36 +265,45 @@ ranked_names = [names[j] for j in indices]
 
 column_info.loc['completed', 'name'] = 'Number of participants needed'
 
-ranked_humannames = []
-for n in ranked_names:
-    hname = column_info.loc[n, 'name']
-    if column_info.loc[n, 'is_cond_']:
-        hname = 'Condition: ' + hname
-    elif column_info.loc[n, 'is_intv_']:
-        hname = 'Intervention: ' + hname
-    elif column_info.loc[n, 'is_intvtype_']:
-        hname = 'Class: ' + hname
-    elif column_info.loc[n, 'is_keyword_']:
-        hname = 'Keyword: ' + hname
-    ranked_humannames.append(hname)
+ranked_humannames = importance.human_labels(ranked_names, column_info)
+reports.save_inputs('rf_importance', importance=ranked_importances,
+                    label=ranked_humannames, std=ranked_std)
 
 
 # Plot the feature importances of the regression (top N)
 N = 15
 sns.set(style='whitegrid')
 f, ax = plt.subplots(figsize=(6,4))
-sns.barplot(ranked_importances[:N], 
-            ranked_humannames[:N],
-            ci=ranked_std[:N])
+sns.barplot(x=ranked_importances[:N], y=ranked_humannames[:N],
+            xerr=ranked_std[:N])
 plt.title("Feature importance")
 plt.tight_layout()
 plt.show()
 
 
+# === PERMUTATION IMPORTANCES ON THE TEST SET & PLOT
+perm_ranked, perm_baseline = importance.permutation_importance(
+    reg, Xtest, ytest, feature_names, column_info=column_info)
+reports.save_inputs('rf_permutation_importance',
+                    importance=perm_ranked['importance'],
+                    label=perm_ranked['label'],
+                    std=perm_ranked['importance_std'])
+
+sns.set(style='whitegrid')
+f, ax = plt.subplots(figsize=(6,4))
+sns.barplot(x=perm_ranked['importance'][:N], y=perm_ranked['label'][:N],
+            xerr=perm_ranked['importance_std'][:N])
+plt.title("Permutation importance (test set R2 drop)")
+plt.tight_layout()
+plt.show()
+
+
 # === LEARNING CURVES 
 train_sizes, train_scores, test_scores = \
     learning_curve(reg, X, y,
                    cv=nfolds, scoring=make_scorer(r2_score))
+reports.save_inputs('rf_learning_curve', train_sizes=train_sizes,
+                    train_scores=train_scores, test_scores=test_scores)
 
 train_scores_mean = np.mean(train_scores, axis=1)
 train_scores_std = np.std(train_scores, axis=1)
@@ -305,13 +334,13 @@ plt.show()
 # RF QUANTILE REGRESSOR
 # ===============================================================
 
-# == fit
-rfqr = RandomForestQuantileRegressor(**best_params)
+# == fit (sklearn forest + per-leaf training targets, see train.py)
+rfqr = train.make_model('qrf', **best_params)
 rfqr.fit(X, y)
-lower = rfqr.predict(X, quantile=2.5)
-upper = rfqr.predict(X, quantile=97.5)
-med = rfqr.predict(X, quantile=50)
+(lower, med, upper) = rfqr.predict(X, quantiles=(2.5, 50, 97.5)).T
 ypred = reg.predict(X)
+reports.save_inputs('qrf_quantiles', ypred=ypred, lower=lower, med=med,
+                    upper=upper)
 
 # plot confidence intervals
 sort_ind = np.argsort(ypred)
@@ -324,34 +353,39 @@ plt.ylabel('dropout rate')
 plt.legend()
 plt.show()
 
+# === CONFORMAL INTERVALS AROUND THE RF (calibrated on its OOB residuals)
+cp = conformal.SplitConformal(reg, coverage=95)
+cp.calibrate_residuals(report['oof_resid'])
+print(conformal.compare_to_qrf(cp, rfqr, Xtest, ytest, coverage=95))
+
 # === FIT RF-REGRESSION WITH BEST PARAMS
-regq = RandomForestQuantileRegressor(**best_params)
-regq.fit(X, y)
+regq = train.make_model('qrf', **best_params)
+run_params = runstore.estimator_params(regq)
+
+# === OUT-OF-BAG VALIDATION (R2), OOB RESIDUALS & TEST SCORE
+report = evaluate.evaluate_oob(regq, X, y, Xtest=Xtest, ytest=ytest)
 
 # print report
 r2_train = regq.score(X, y)
 print('Training data R2 score: {:0.2f}'.format(r2_train))
-
-
-# === KFOLD CROSS VALIDATION (R2)
-CV_scores = cross_val_score(regq, X, y,
-                            cv=nfolds, 
-                            scoring=make_scorer(r2_score))
-print('{:d}-fold CV R2 score: {:0.2f}+/-{:0.2f}'
-      .format(nfolds, CV_scores.mean(), CV_scores.std()))
+evaluate.print_report(report, name='(QRF)')
+store.record_report('qrf', run_params, data_fp, report,
+                    artifact='data/reg_model2_quantile.pkl',
+                    search_kwargs={})
 
 # 5-fold CV R2 score: 0.46+/-0.02
 
 
-# === PLOT RESIDUALS
+# === PLOT (OUT-OF-BAG) RESIDUALS
 sns.set(font_scale=1.5, style='white')
-ypred = regq.predict(X)
+ypred = report['oof_pred']
+reports.save_inputs('qrf_oof', y=y, ypred=ypred)
 
 fig = plt.figure(figsize=(10, 5))
 
 # hist of resids
 plt.subplot(1, 2, 1)
-sns.distplot(y-ypred, bins=50, kde=False, vertical=True)
+sns.histplot(y=y-ypred, bins=50)
 sns.despine(fig=fig, bottom=True, left=True)
 plt.xticks([])
 plt.ylabel('Residuals')
@@ -360,7 +394,8 @@ plt.ylim((-0.6, 0.6))
 
 # residuals vs predicted
 plt.subplot(1, 2, 2)
-sns.regplot(ypred, y-ypred, fit_reg=False, scatter_kws={'alpha': 0.2})
+sns.regplot(x=ypred, y=y-ypred, fit_reg=False,
+            scatter_kws={'alpha': 0.2})
 plt.ylim((-0.6, 0.6))
 sns.despine()
 plt.xlabel('Predicted value')
@@ -370,7 +405,7 @@ plt.show()
 # === FEATURE IMPORTANCES & PLOT
 
 # Calculate feature importances
-names = Xraw.columns.tolist()
+names = list(feature_names)
 importances = regq.feature_importances_
 std = np.std([tree.feature_importances_ for tree in regq.estimators_],
              axis=0)
@@ -383,27 +418,17 @@ ranked_names = [names[j] for j in indices]
 
 column_info.loc['completed', 'name'] = 'Number of participants needed'
 
-ranked_humannames = []
-for n in ranked_names:
-    hname = column_info.loc[n, 'name']
-    if column_info.loc[n, 'is_cond_']:
-        hname = 'Condition: ' + hname
-    elif column_info.loc[n, 'is_intv_']:
-        hname = 'Intervention: ' + hname
-    elif column_info.loc[n, 'is_intvtype_']:
-        hname = 'Class: ' + hname
-    elif column_info.loc[n, 'is_keyword_']:
-        hname = 'Keyword: ' + hname
-    ranked_humannames.append(hname)
+ranked_humannames = importance.human_labels(ranked_names, column_info)
+reports.save_inputs('qrf_importance', importance=ranked_importances,
+                    label=ranked_humannames, std=ranked_std)
 
 
 # Plot the feature importances of the regression (top N)
 N = 15
 sns.set(style='whitegrid')
 f, ax = plt.subplots(figsize=(6,4))
-sns.barplot(ranked_importances[:N], 
-            ranked_humannames[:N],
-            ci=ranked_std[:N])
+sns.barplot(x=ranked_importances[:N], y=ranked_humannames[:N],
+            xerr=ranked_std[:N])
 plt.title("Feature importance")
 plt.tight_layout()
 plt.show()
@@ -413,6 +438,8 @@ plt.show()
 train_sizes, train_scores, test_scores = \
     learning_curve(regq, X, y,
                    cv=nfolds, scoring=make_scorer(r2_score))
+reports.save_inputs('qrf_learning_curve', train_sizes=train_sizes,
+                    train_scores=train_scores, test_scores=test_scores)
 
 train_scores_mean = np.mean(train_scores, axis=1)
 train_scores_std = np.std(train_scores, axis=1)
@@ -447,6 +474,7 @@ plt.show()
 
 y_pred_rf = reg.predict(X)
 y_pred_rfq = regq.predict(X)
+reports.save_inputs('rf_vs_qrf', rf=y_pred_rf, qrf=y_pred_rfq)
 
 plt.figure()
 plt.plot(y_pred_rf, y_pred_rfq, '.')
@@ -458,32 +486,23 @@ plt.show()
 
 
 # ===============================================================
-# DRAW SOME TREES
+# HISTOGRAM GRADIENT BOOSTING vs RF & QRF
 # ===============================================================
 
-import pydotplus
-import six
-from sklearn import tree
-from sklearn.tree import export_graphviz
+# fit time, predict latency (1 row & test set), test R2, interval coverage
+model_comparison = train.benchmark_models(['rf', 'qrf', 'hgb', 'hgb_quantile'],
+                                          X, y, Xtest, ytest)
+print(model_comparison)
 
-dotfile = six.StringIO()
 
-i_tree = 0
-for tree_in_forest in regq.estimators_[:0]:
-    if (i_tree < 1):
+# ===============================================================
+# DRAW SOME TREES
+# ===============================================================
 
-import os
-i_tree = 0
-for tree_in_forest in regq.estimators_[:5]:
-    export_graphviz(tree_in_forest,
-        max_depth=3,
-        feature_names=Xraw.columns,
-        filled=True,
-        rounded=True,
-        out_file='tree.dot')
-    filename = ('reports/decision_tree/QRF_dtree'+ str(i_tree) +'.png')
-    os.system('dot -Tpng tree.dot -o ' + filename)
-    i_tree += 1
+# first QRF trees, truncated at depth 3, as dot source: rendered (in
+# parallel, only when they change) by reports.py as QRF_dtree<i>.png
+reports.save_inputs('qrf_trees', dot=render.dot_sources(
+    regq.estimators_[:reports.N_TREES], feature_names, max_depth=3))
 
 
 # ===============================================================
@@ -496,32 +515,36 @@ with open(filename, 'wb') as output_file:
     pk.dump(reg, output_file)
 
 
-# QUANTILE MODEL 
-filename = 'data/reg_model2_quantile.pkl'
-with open(filename, 'wb') as output_file:
-    pk.dump(regq, output_file)
+# MODEL ARTIFACT (memory-mappable, for serving)
+artifact.save_artifact(reg, 'data/reg_model2', feature_names)
 
 
-# ===============================================================
-# COMPUTE TEST SET SCORE - RF
-# ===============================================================
-
-feature_names = Xraw.columns.tolist()
-
-dftest = pd.read_pickle('data/testing_data.pkl')
-Xtest_raw = dftest[feature_names]
-ytest_raw = dftest[['dropped', 'enrolled']]
-ytest_raw['droprate'] = ytest_raw['dropped'] / ytest_raw['enrolled']
-
-Xtest = Xtest_raw.as_matrix()
-ytest = ytest_raw[['droprate']].as_matrix()
-
+# DISTILLED SURROGATE (shallow tree mimicking the RF, for fast serving)
+student = distill.distill(reg, X, student='tree', n_copies=4)
+distill_report = distill.fidelity_report(reg, student, Xtest, ytest)
+print(distill_report)
+distill.save_student(student, 'data/reg_model2_distilled', feature_names,
+                     teacher_path='data/reg_model2', report=distill_report)
 
-r2_test = regq.score(Xtest, ytest)
 
-
-print('R2 test score:', r2_test) # Test score: 0.452
+# QUANTILE MODEL 
+filename = 'data/reg_model2_quantile.pkl'
+with open(filename, 'wb') as output_file:
+    pk.dump(regq, output_file)
 
 
+# QUANTILE MODEL ARTIFACT (compact leaf data, memory-mappable)
+artifact.save_artifact(regq, 'data/reg_model2_quantile', feature_names)
+print(quantile.compare_storage('data/reg_model2_quantile.pkl',
+                               'data/reg_model2_quantile', Xtest))
 
 
+# ===============================================================
+# SCORE ALL SAVED MODELS ON THE TEST SET (one batch)
+# ===============================================================
+saved_models = {'Lasso (model 1)': 'data/reg_model1',
+                'RF (model 2)': 'data/reg_model2',
+                'RF distilled (model 2)': 'data/reg_model2_distilled',
+                'QRF (model 2)': 'data/reg_model2_quantile'}
+scores = evaluate.score_models(saved_models, feature_names=feature_names)
+print(scores)
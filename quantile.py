@@ -0,0 +1,354 @@
+"""
+quantile - fast multi-quantile prediction for quantile random forests
+=====================================================================
+
+**quantile** takes a fitted skgarden RandomForestQuantileRegressor (or any
+fitted sklearn forest plus its training data, see from_forest()) and
+precomputes, for every leaf of every tree, the (sorted) training targets that
+fall in it and their weights. Any set of quantiles for a batch of rows is then
+computed in one vectorized pass, instead of one python loop over rows per
+quantile as in RandomForestQuantileRegressor.predict(). QuantileForest stores
+the same leaf data, plus the trees as a FlatForest, as a few flat arrays only,
+so a quantile forest can be saved as a compact, memory-mappable artifact
+(kind 'quantileforest', see the artifact module) instead of a pickle holding
+the dense per-tree leaf assignments and weights of every training sample
+"""
+
+import os
+import pickle as pk
+import time
+import tracemalloc
+import numpy as np
+from forest import FlatForest
+
+
+class QuantilePredictor:
+    """ Vectorized multi-quantile predictor built from a fitted quantile forest
+
+    Per-leaf training data is stored in CSR form over all the nodes of all the
+    trees: the training samples in global node g are
+    indices[indptr[g]:indptr[g+1]] (positions into the sorted training
+    targets y_sorted, ascending, so each leaf is sorted by target value) with
+    weights leaf_weights[indptr[g]:indptr[g+1]].
+
+    Args:
+        forest (estimator): fitted skgarden RandomForestQuantileRegressor (or
+            any object with an apply() method that returns the per-tree leaf
+            ids, plus the arrays below)
+        y_sorted (array): training targets sorted ascending, float32
+        indptr (array): CSR row pointer over the global node ids
+        indices (array): positions into y_sorted for each leaf entry, int32
+        leaf_weights (array): weight of each leaf entry, float32
+        offsets (array): global node id of each tree's root node
+
+    Kwargs:
+        batch_size (int): number of rows to process at once (bounds memory to
+            ~batch_size*len(y_sorted) floats). Default is 512
+    """
+
+    def __init__(self, forest, y_sorted, indptr, indices, leaf_weights,
+                 offsets, batch_size=512):
+        self.forest = forest
+        self.y_sorted = y_sorted
+        self.indptr = indptr
+        self.indices = indices
+        self.leaf_weights = leaf_weights
+        self.offsets = offsets
+        self.batch_size = batch_size
+
+    @classmethod
+    def from_qrf(cls, rfqr, **kwargs):
+        """ Build a QuantilePredictor from a fitted skgarden
+        RandomForestQuantileRegressor (uses its y_train_, y_train_leaves_, and
+        y_weights_ attributes)
+        """
+        return cls._from_leaf_weights(rfqr, rfqr.y_train_,
+                                      rfqr.y_train_leaves_, rfqr.y_weights_,
+                                      **kwargs)
+
+    @classmethod
+    def from_forest(cls, forest, X, y, **kwargs):
+        """ Build a QuantilePredictor from a fitted sklearn forest (e.g.
+        RandomForestRegressor) and its training data, as in Meinshausen's
+        quantile regression forest: every training sample is in its leaf of
+        each tree, with weight 1/(leaf size). (skgarden only counts the in-bag
+        samples of each tree, so its quantiles differ slightly)
+
+        Args:
+            forest (estimator): fitted forest with apply() and estimators_
+            X, y (arrays): the forest's training data (X may be sparse)
+        """
+        leaves = forest.apply(X).T
+        weights = np.zeros(leaves.shape, dtype=np.float32)
+        for (t, tree_leaves) in enumerate(leaves):
+            weights[t] = 1./np.bincount(tree_leaves)[tree_leaves]
+        return cls._from_leaf_weights(forest, np.ravel(y), leaves, weights,
+                                      **kwargs)
+
+    @classmethod
+    def _from_leaf_weights(cls, forest, y_train, train_leaves, weights,
+                           **kwargs):
+        """ Build from the training targets, their leaf id in each tree
+        (n_trees, n_train), and their weight in each tree (0: not in it)
+        """
+        sorter = np.argsort(y_train)
+        y_sorted = np.asarray(y_train, dtype=np.float32)[sorter]
+        leaves = train_leaves[:, sorter]
+        weights = weights[:, sorter]
+
+        # global node id of each tree's root
+        node_counts = np.array([est.tree_.node_count
+                                for est in forest.estimators_])
+        offsets = np.concatenate([[0], np.cumsum(node_counts)[:-1]])
+
+        # (tree, position) of every in-bag training sample, then group by
+        # global leaf id. The stable sort keeps positions (i.e. targets)
+        # ascending within each leaf
+        (tree_ind, pos) = np.nonzero(weights > 0)
+        node = offsets[tree_ind] + leaves[tree_ind, pos]
+        order = np.argsort(node, kind='mergesort')
+
+        indptr = np.zeros(node_counts.sum() + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(node, minlength=node_counts.sum()))
+        indices = pos[order].astype(np.int32)
+        leaf_weights = weights[tree_ind, pos][order].astype(np.float32)
+
+        return cls(forest, y_sorted, indptr, indices, leaf_weights,
+                   offsets.astype(np.int64), **kwargs)
+
+    def _weights(self, leaves):
+        """ Given per-tree leaf ids for a batch of rows (n_rows, n_trees),
+        return the (n_rows, n_train) float32 weight of each sorted training
+        target, accumulated tree by tree
+        """
+        (n_rows, n_trees) = leaves.shape
+        nodes = leaves + self.offsets[np.newaxis, :]
+        starts = self.indptr[nodes]
+        lengths = self.indptr[nodes + 1] - starts
+
+        W = np.zeros((n_rows, len(self.y_sorted)), dtype=np.float32)
+        for t in range(n_trees):
+            # flatten the CSR slices for this tree into (row, col, weight)
+            n = lengths[:, t]
+            rows = np.repeat(np.arange(n_rows), n)
+            seg_start = np.cumsum(n) - n
+            pos = (np.arange(n.sum()) - np.repeat(seg_start, n) +
+                   np.repeat(starts[:, t], n))
+            # each training sample is in exactly one leaf per tree, so there
+            # are no duplicate (row, col) pairs within a tree
+            W[rows, self.indices[pos]] += self.leaf_weights[pos]
+
+        return W
+
+    def _quantiles(self, W, quantiles):
+        """ Weighted percentiles (same method as skgarden's
+        weighted_percentile) of y_sorted for each row of weights W, for each
+        quantile (0-100). Returns array of shape (n_rows, len(quantiles))
+        """
+        n_rows = W.shape[0]
+        rows = np.arange(n_rows)
+        nz = W != 0
+        nnz = nz.sum(axis=1)
+        nzrank = np.cumsum(nz, axis=1) - 1
+
+        # zero weights do not change the cumulative sum, so computing over all
+        # columns gives the same partial sums as over only the non-zero ones
+        cum = np.cumsum(W, axis=1)
+        total = cum[:, -1].astype(np.float64)
+        scale = (100.0 / total).astype(np.float32)[:, np.newaxis]
+        partial = scale * (cum - W / np.float32(2.0))
+
+        def nth_nonzero(k):
+            """ column index of the k-th non-zero weight in each row """
+            return np.argmax(nz & (nzrank == k[:, np.newaxis]), axis=1)
+
+        out = np.zeros((n_rows, len(quantiles)))
+        for (j, q) in enumerate(quantiles):
+            if q > 100 or q < 0:
+                raise ValueError('q should be in-between 0 and 100, '
+                                 'got {}'.format(q))
+            start = np.sum(nz & (partial < q), axis=1) - 1
+            lo = nth_nonzero(np.clip(start, 0, nnz - 1))
+            hi = nth_nonzero(np.clip(start + 1, 0, nnz - 1))
+
+            p_lo = partial[rows, lo].astype(np.float64)
+            p_hi = partial[rows, hi].astype(np.float64)
+            a_lo = self.y_sorted[lo].astype(np.float64)
+            a_hi = self.y_sorted[hi].astype(np.float64)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                fraction = (q - p_lo) / (p_hi - p_lo)
+                interp = a_lo + fraction * (a_hi - a_lo)
+
+            # outside the first/last partial sums, return the first/last value
+            first = self.y_sorted[nth_nonzero(np.zeros(n_rows, dtype=int))]
+            last = self.y_sorted[nth_nonzero(nnz - 1)]
+            out[:, j] = np.where(start == nnz - 1, last,
+                                 np.where(start == -1, first, interp))
+
+        return out
+
+    def apply(self, X):
+        """ Return the leaf id of each row in each tree, (n_rows, n_trees) """
+        return self.forest.apply(X)
+
+    def predict(self, X, quantiles=(2.5, 50, 97.5)):
+        """ Predict several quantiles at once
+
+        Args:
+            X (array): features, shape (n_rows, n_features)
+
+        Kwargs:
+            quantiles (list): quantiles to predict, each in [0, 100]. Default
+                is (2.5, 50, 97.5)
+
+        Returns:
+            pred (array): shape (n_rows, len(quantiles)), one column per
+                quantile
+        """
+        leaves = self.apply(X)
+        pred = np.zeros((leaves.shape[0], len(quantiles)))
+        for i in range(0, leaves.shape[0], self.batch_size):
+            W = self._weights(leaves[i:i+self.batch_size])
+            pred[i:i+self.batch_size] = self._quantiles(W, quantiles)
+
+        return pred
+
+
+class QuantileForest(QuantilePredictor):
+    """ QuantilePredictor made only of flat arrays: the trees are a FlatForest
+    (see the forest module) and the leaf data is the same CSR structure, with
+    global node ids shared by both (offsets are the FlatForest roots).
+    Nothing is derived at construction time, so the arrays can be read-only
+    memory maps (artifact kind 'quantileforest')
+
+    Args:
+        feature, threshold, children, value, roots: FlatForest arrays
+        y_sorted, indptr, indices, leaf_weights: QuantilePredictor arrays
+            (indices in the smallest unsigned int type that holds them)
+        max_depth (int): depth of the deepest tree
+
+    Kwargs:
+        batch_size (int): see QuantilePredictor. Default is 512
+    """
+
+    arrays = FlatForest.arrays + ('y_sorted', 'indptr', 'indices',
+                                  'leaf_weights')
+
+    def __init__(self, feature, threshold, children, value, roots, y_sorted,
+                 indptr, indices, leaf_weights, max_depth, batch_size=512):
+        forest = FlatForest(feature, threshold, children, value, roots,
+                            max_depth)
+        super().__init__(forest, y_sorted, indptr, indices, leaf_weights,
+                         roots, batch_size=batch_size)
+        # the FlatForest arrays, by name (see artifact.save_artifact())
+        (self.feature, self.threshold, self.children, self.value,
+         self.roots) = (feature, threshold, children, value, roots)
+
+    @classmethod
+    def from_qrf(cls, rfqr, **kwargs):
+        """ Build a QuantileForest from a fitted skgarden
+        RandomForestQuantileRegressor
+        """
+        return cls._from_predictor(QuantilePredictor.from_qrf(rfqr), rfqr,
+                                   **kwargs)
+
+    @classmethod
+    def from_forest(cls, forest, X, y, **kwargs):
+        """ Build a QuantileForest from a fitted sklearn forest and its
+        training data (see QuantilePredictor.from_forest())
+        """
+        return cls._from_predictor(
+            QuantilePredictor.from_forest(forest, X, y), forest, **kwargs)
+
+    @classmethod
+    def _from_predictor(cls, qp, forest, **kwargs):
+        ff = FlatForest.from_sklearn(forest)
+        indices = qp.indices.astype(np.min_scalar_type(len(qp.y_sorted)))
+        return cls(ff.feature, ff.threshold, ff.children, ff.value, ff.roots,
+                   qp.y_sorted, qp.indptr, indices, qp.leaf_weights,
+                   ff.max_depth, **kwargs)
+
+    @property
+    def attrs(self):
+        """ Non-array constructor arguments """
+        return {'max_depth': self.forest.max_depth,
+                'batch_size': self.batch_size}
+
+    def predict(self, X, quantiles=None):
+        """ Predict quantiles, like QuantilePredictor.predict(), or, with
+        quantiles=None (the default, as skgarden's predict()), the mean
+        prediction of the trees
+        """
+        if quantiles is None:
+            return self.forest.predict(X)
+        return super().predict(X, quantiles=quantiles)
+
+
+def _path_size(path):
+    """ Size in bytes of a file, or of all the files in a directory """
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(path, f))
+               for f in os.listdir(path))
+
+
+def compare_storage(pkl_path, artifact_path, X, quantiles=(2.5, 50, 97.5),
+                    n_repeats=5):
+    """ Compare a pickled quantile forest with its QuantileForest artifact:
+    file size, load time, memory allocated by loading, and the quantiles each
+    predicts for X (which must be identical)
+
+    Args:
+        pkl_path (str): pickled train.QuantileRandomForest or skgarden
+            RandomForestQuantileRegressor
+        artifact_path (str): QuantileForest artifact directory of the same
+            model (see artifact.save_artifact())
+        X (array): rows to predict
+
+    Kwargs:
+        quantiles (list): quantiles to compare. Default is (2.5, 50, 97.5)
+        n_repeats (int): loads to time (best is kept). Default is 5
+
+    Returns:
+        results (DataFrame): one row per format ('pickle', 'artifact') with
+            'size_mb', 'load_ms', 'load_mem_mb' (peak python allocations while
+            loading; memory-mapped arrays are not allocated), and
+            'max_abs_diff' of the quantiles from those of the pickle
+    """
+    import pandas as pd
+    import artifact
+
+    def load_pickle():
+        with open(pkl_path, 'rb') as input_file:
+            model = pk.load(input_file)
+        if hasattr(model, 'y_train_leaves_'):
+            return QuantilePredictor.from_qrf(model)
+        return model
+
+    loaders = {'pickle': (pkl_path, load_pickle),
+               'artifact': (artifact_path,
+                            lambda: artifact.load_artifact(artifact_path))}
+    rows = []
+    expected = None
+    for (name, (path, load)) in loaders.items():
+        load_time = np.inf
+        for _ in range(n_repeats):
+            t0 = time.perf_counter()
+            load()
+            load_time = min(load_time, time.perf_counter() - t0)
+
+        tracemalloc.start()
+        model = load()
+        load_mem = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        pred = model.predict(X, quantiles=quantiles)
+        if expected is None:
+            expected = pred
+        rows.append({'format': name,
+                     'size_mb': _path_size(path)/1e6,
+                     'load_ms': load_time*1e3,
+                     'load_mem_mb': load_mem/1e6,
+                     'max_abs_diff': np.abs(pred - expected).max()})
+
+    return pd.DataFrame(rows).set_index('format')
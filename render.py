@@ -0,0 +1,68 @@
+"""
+render - batch rendering of decision trees with graphviz
+========================================================
+
+**render** exports a batch of fitted decision trees (e.g. the trees of a
+random forest) to graphviz dot source in memory, and renders them in parallel
+by piping each one straight into its own `dot` process, so there is no shared
+temporary tree.dot file for concurrent runs to overwrite
+"""
+
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from sklearn.tree import export_graphviz
+
+
+def _render_dot(dot_source, filename, fmt='png'):
+    """ Render graphviz dot source (string) to filename with `dot -T<fmt>` """
+    subprocess.run(['dot', '-T' + fmt, '-o', filename],
+                   input=dot_source.encode(), check=True)
+    return filename
+
+
+def dot_sources(trees, feature_names, max_depth=3):
+    """ Graphviz dot source (strings, in memory) of a batch of decision trees,
+    truncated at max_depth (None for the full trees)
+    """
+    return [export_graphviz(t, out_file=None, max_depth=max_depth,
+                            feature_names=feature_names,
+                            filled=True, rounded=True)
+            for t in trees]
+
+
+def render_trees(trees, feature_names, outdir='reports/decision_tree',
+                 prefix='QRF_dtree', max_depth=3, fmt='png', n_jobs=None):
+    """ Render a batch of decision trees to image files in parallel
+
+    Args:
+        trees (list): fitted sklearn decision trees, e.g. reg.estimators_[:5]
+        feature_names (list): feature names to label the splits with
+
+    Kwargs:
+        outdir (str): output directory (created if needed). Default is
+            'reports/decision_tree'
+        prefix (str): file name prefix; tree i is saved to
+            '<outdir>/<prefix><i>.<fmt>'. Default is 'QRF_dtree'
+        max_depth (int or None): truncate the drawing at this depth (None for
+            the full tree). Default is 3
+        fmt (str): graphviz output format, e.g. 'png', 'ps', 'svg'. Default is
+            'png'
+        n_jobs (int or None): max number of concurrent `dot` processes (None
+            for the ThreadPoolExecutor default)
+
+    Returns:
+        filenames (list): names of the rendered files, in tree order
+    """
+    os.makedirs(outdir, exist_ok=True)
+
+    # dot source for every tree (in memory, no tree.dot)
+    sources = dot_sources(trees, feature_names, max_depth=max_depth)
+    filenames = [os.path.join(outdir, '{}{:d}.{}'.format(prefix, i, fmt))
+                 for i in range(len(trees))]
+
+    # each render is a separate `dot` process, threads just wait on them
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        futures = [executor.submit(_render_dot, src, fn, fmt)
+                   for (src, fn) in zip(sources, filenames)]
+        return [f.result() for f in futures]
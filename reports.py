@@ -0,0 +1,380 @@
+"""
+reports - headless, incremental rendering of the reports/ figures
+=================================================================
+
+**reports** renders the report figures (residual plots, learning curves,
+feature importances, the quantile plot, RF vs RFQ predictions, the 'droprate
+vs *' EDA plots, and the first QRF trees) without a display: each is drawn on
+a bare matplotlib Figure with an Agg canvas (no pyplot), or, for the trees,
+by graphviz from saved dot source (see render.py). The playground scripts save
+the model outputs each figure needs as .npz files (save_inputs()), and the
+EDA inputs are taken from data/full_data.pkl. Figures are then rendered in
+parallel worker processes, and a manifest of input hashes
+(reports/manifest.json) lets a rebuild skip every figure whose inputs and
+plotting code did not change.
+Usage::
+
+    python reports.py            # render new or changed figures
+    python reports.py --force    # render everything
+"""
+
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+INPUTS_DIR = 'data/cache/reports'
+MANIFEST_FILE = 'reports/manifest.json'
+FULL_DATA_FILE = 'data/full_data.pkl'
+
+# full_data column -> (name, axis label) of its 'droprate vs <name>' EDA
+# figure; the names are those of the existing reports/general figures
+EDA_COLUMNS = {'duration': ('duration', 'Study duration (months)'),
+               'enrolled': ('enrolled', 'Participants enrolled'),
+               'facilities': ('num_facilities', 'Number of facilities'),
+               'usfacility': ('has_us_facility', 'Has a US facility'),
+               'year': ('start_year', 'Start year'),
+               'minage': ('minimum_age_years', 'Minimum age (years)')}
+
+# QRF trees drawn by playground_model2 (reports/decision_tree/QRF_dtree<i>)
+N_TREES = 5
+
+
+# ===============================================================
+# PLOTTERS (each draws one figure from arrays, in a worker process)
+# ===============================================================
+
+def plot_residuals(y, ypred, ylim=(-0.6, 0.6)):
+    """ Histogram of the residuals, and residuals vs predicted value """
+    resid = y - ypred
+    fig = Figure(figsize=(10, 5))
+
+    ax = fig.add_subplot(1, 2, 1)
+    ax.hist(resid, bins=50, range=ylim, orientation='horizontal')
+    ax.set_xticks([])
+    ax.set_ylabel('Residuals')
+    ax.set_ylim(ylim)
+
+    ax = fig.add_subplot(1, 2, 2)
+    ax.scatter(ypred, resid, alpha=0.2)
+    ax.set_ylim(ylim)
+    ax.set_xlabel('Predicted value')
+    return fig
+
+
+def plot_learning_curve(train_sizes, train_scores, test_scores,
+                        ylim=(0, 1)):
+    """ Training and cross-validation R2 (mean +/- std over the folds) vs
+    number of training examples, as sklearn's learning_curve() returns them
+    """
+    fig = Figure()
+    ax = fig.add_subplot(1, 1, 1)
+    ax.grid()
+    for (scores, color, label) in [(train_scores, 'r', 'Training score'),
+                                   (test_scores, 'g',
+                                    'Cross-validation score')]:
+        (mean, std) = (scores.mean(axis=1), scores.std(axis=1))
+        ax.fill_between(train_sizes, mean - std, mean + std, alpha=0.1,
+                        color=color)
+        ax.plot(train_sizes, mean, 'o-', color=color, label=label)
+    ax.set_ylabel('R2 score')
+    ax.set_xlabel('Training examples')
+    ax.set_ylim(ylim)
+    ax.legend(loc='best')
+    return fig
+
+
+def plot_importances(importance, label, std=None, N=15,
+                     title='Feature importance'):
+    """ Horizontal bar chart of the top-N (ranked) importances """
+    fig = Figure(figsize=(6, 4))
+    ax = fig.add_subplot(1, 1, 1)
+    pos = np.arange(min(N, len(importance)))[::-1]
+    ax.barh(pos, importance[:N], xerr=None if std is None else std[:N])
+    ax.set_yticks(pos)
+    ax.set_yticklabels(label[:N])
+    ax.set_title(title)
+    fig.tight_layout()
+    return fig
+
+
+def plot_quantiles(ypred, lower, med, upper):
+    """ Predicted value, median and 2.5/97.5 quantiles, samples ordered by
+    predicted value
+    """
+    fig = Figure()
+    ax = fig.add_subplot(1, 1, 1)
+    sort_ind = np.argsort(ypred)
+    x = np.arange(len(ypred))
+    for (values, label) in [(lower, 'lower'), (ypred, 'predicted'),
+                            (med, 'median'), (upper, 'upper')]:
+        ax.plot(x, values[sort_ind], label=label)
+    ax.set_xlabel('ordered samples')
+    ax.set_ylabel('dropout rate')
+    ax.legend()
+    return fig
+
+
+def plot_histogram(values, xlabel='Dropout rate (fraction)', bins=50):
+    """ Histogram of one variable """
+    fig = Figure()
+    ax = fig.add_subplot(1, 1, 1)
+    ax.hist(values[np.isfinite(values)], bins=bins)
+    ax.set_yticks([])
+    ax.set_xlabel(xlabel)
+    return fig
+
+
+def plot_droprate_vs(x, droprate, xlabel):
+    """ Dropout rate against one feature: box plots for a binary feature,
+    else a scatter plot
+    """
+    fig = Figure()
+    ax = fig.add_subplot(1, 1, 1)
+    ok = np.isfinite(x) & np.isfinite(droprate)
+    (x, droprate) = (x[ok], droprate[ok])
+    levels = np.unique(x)
+    if len(levels) <= 2:
+        ax.boxplot([droprate[x == v] for v in levels])
+        ax.set_xticklabels(['{:g}'.format(v) for v in levels])
+    else:
+        ax.scatter(x, droprate, alpha=0.2)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel('Dropout rate')
+    return fig
+
+
+def plot_predictions(x, y, xlabel, ylabel):
+    """ One model's predictions against another's """
+    fig = Figure()
+    ax = fig.add_subplot(1, 1, 1)
+    ax.plot(x, y, '.')
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    return fig
+
+
+def plot_tree(dot, index=0):
+    """ Tree number index of a batch of graphviz dot sources (see
+    render.dot_sources). Returns the dot source itself: trees are rendered by
+    graphviz, not matplotlib
+    """
+    return str(dot[index])
+
+
+PLOTTERS = {'residuals': plot_residuals,
+            'learning_curve': plot_learning_curve,
+            'importances': plot_importances,
+            'quantiles': plot_quantiles,
+            'histogram': plot_histogram,
+            'droprate_vs': plot_droprate_vs,
+            'predictions': plot_predictions,
+            'tree': plot_tree}
+
+
+# output figure -> (plotter, inputs name, {plotter arg: input array}, kwargs)
+FIGURES = {
+    'reports/linear_models/LM residuals plot.png':
+        ('residuals', 'lm_oof', {'y': 'y', 'ypred': 'ypred'}, {}),
+    'reports/linear_models/LM learning curve.png':
+        ('learning_curve', 'lm_learning_curve', None, {'ylim': (-0.5, 1)}),
+    'reports/decision_tree/decision tree residuals.png':
+        ('residuals', 'dt_oof', {'y': 'y', 'ypred': 'ypred'}, {}),
+    'reports/decision_tree/DT learning curve.png':
+        ('learning_curve', 'dt_learning_curve', None, {}),
+    'reports/decision_tree/RF residuals plot.png':
+        ('residuals', 'rf_oof', {'y': 'y', 'ypred': 'ypred'}, {}),
+    'reports/decision_tree/RF feature importance.png':
+        ('importances', 'rf_importance', None, {}),
+    'reports/decision_tree/RF permutation importance.png':
+        ('importances', 'rf_permutation_importance', None,
+         {'title': 'Permutation importance (test set R2 drop)'}),
+    'reports/decision_tree/RF learning curve.png':
+        ('learning_curve', 'rf_learning_curve', None, {}),
+    'reports/decision_tree/RF quantile, ordered plot.png':
+        ('quantiles', 'qrf_quantiles', None, {}),
+    'reports/decision_tree/RFQ residuals plot.png':
+        ('residuals', 'qrf_oof', {'y': 'y', 'ypred': 'ypred'}, {}),
+    'reports/decision_tree/RFQ feature importance.png':
+        ('importances', 'qrf_importance', None, {}),
+    'reports/decision_tree/RFQ learning curve.png':
+        ('learning_curve', 'qrf_learning_curve', None, {}),
+    'reports/decision_tree/RF vs RFQ prediction.png':
+        ('predictions', 'rf_vs_qrf', {'x': 'rf', 'y': 'qrf'},
+         {'xlabel': 'Random Forest prediction (dropout rate)',
+          'ylabel': 'Quantile random forest prediction (dropout rate)'}),
+    'reports/general/dropoutrate training df histogram.png':
+        ('histogram', 'eda', {'values': 'droprate'}, {}),
+}
+FIGURES.update({
+    'reports/general/droprate vs {}.png'.format(name):
+        ('droprate_vs', 'eda', {'x': col, 'droprate': 'droprate'},
+         {'xlabel': label})
+    for (col, (name, label)) in EDA_COLUMNS.items()})
+FIGURES.update({
+    'reports/decision_tree/QRF_dtree{:d}.png'.format(i):
+        ('tree', 'qrf_trees', {'dot': 'dot'}, {'index': i})
+    for i in range(N_TREES)})
+
+
+# ===============================================================
+# CACHED INPUTS & MANIFEST
+# ===============================================================
+
+def save_inputs(name, cachedir=INPUTS_DIR, **arrays):
+    """ Save the arrays a figure is drawn from (e.g. y and the OOF
+    predictions) as <cachedir>/<name>.npz
+    """
+    os.makedirs(cachedir, exist_ok=True)
+    path = os.path.join(cachedir, name + '.npz')
+    tmpfile = path[:-len('.npz')] + '.tmp.npz'
+    arrays = {k: np.asarray(v) for (k, v) in arrays.items()}
+    # labels (e.g. a pandas object column) as fixed-width strings, so the
+    # file loads without pickle
+    arrays = {k: v.astype(str) if v.dtype == object else v
+              for (k, v) in arrays.items()}
+    np.savez(tmpfile, **arrays)
+    os.replace(tmpfile, path)
+    return path
+
+
+def save_eda_inputs(path=FULL_DATA_FILE, cachedir=INPUTS_DIR):
+    """ Save the dropout rate and the EDA_COLUMNS of the full data set """
+    import pandas as pd
+
+    df = pd.read_pickle(path)
+    arrays = {col: np.asarray(df[col], dtype=float)
+              for col in EDA_COLUMNS if col in df.columns}
+    arrays['droprate'] = np.asarray(df['dropped']/df['enrolled'],
+                                    dtype=float)
+    return save_inputs('eda', cachedir=cachedir, **arrays)
+
+
+def _load_inputs(path, argmap):
+    """ Plotter arguments from an .npz file: {arg: array} (argmap maps
+    plotter args to array names; None passes every array under its own name)
+    """
+    with np.load(path) as npz:
+        if argmap is None:
+            return {k: npz[k] for k in npz.files}
+        return {arg: npz[key] for (arg, key) in argmap.items()}
+
+
+def _figure_hash(plotter, inputs, kwargs):
+    """ Hash of everything a figure depends on: the plotting code, its
+    arguments, and the values of the input arrays it uses
+    """
+    h = hashlib.sha1(inspect.getsource(PLOTTERS[plotter]).encode())
+    h.update(json.dumps(kwargs, sort_keys=True, default=str).encode())
+    for (arg, arr) in sorted(inputs.items()):
+        h.update('{}{}{}'.format(arg, arr.dtype.str, arr.shape).encode())
+        h.update(np.ascontiguousarray(arr).tobytes())
+    return h.hexdigest()
+
+
+def _read_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as input_file:
+        return json.load(input_file)
+
+
+def _write_manifest(manifest, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmpfile = path + '.tmp'
+    with open(tmpfile, 'w') as output_file:
+        json.dump(manifest, output_file, indent=1, sort_keys=True)
+    os.replace(tmpfile, path)
+
+
+# ===============================================================
+# BUILD
+# ===============================================================
+
+def _render(plotter, path, argmap, kwargs, outfile):
+    """ Draw and save one figure (runs in a worker process) """
+    fig = PLOTTERS[plotter](**_load_inputs(path, argmap), **kwargs)
+    os.makedirs(os.path.dirname(outfile) or '.', exist_ok=True)
+    if isinstance(fig, str):
+        # graphviz dot source (plot_tree)
+        from render import _render_dot
+        return _render_dot(fig, outfile, fmt='png')
+    FigureCanvasAgg(fig)
+    fig.savefig(outfile, format='png', dpi=150)
+    return outfile
+
+
+def build_reports(figures=None, cachedir=INPUTS_DIR, manifest=MANIFEST_FILE,
+                  force=False, n_jobs=None):
+    """ Render, in parallel, the figures whose inputs (or plotting code)
+    changed since the last build
+
+    Kwargs:
+        figures (dict or None): subset of FIGURES to consider. Default is
+            all of them
+        cachedir (str): directory of the saved inputs. Default is INPUTS_DIR
+        manifest (str): manifest of input hashes. Default is MANIFEST_FILE
+        force (bool): If True, render every figure that has inputs
+        n_jobs (int or None): worker processes (None = number of CPUs)
+
+    Returns:
+        status (dict): {figure: 'rendered', 'unchanged', or 'no inputs'}
+    """
+    figures = FIGURES if figures is None else figures
+    previous = _read_manifest(manifest)
+    status = {}
+    todo = {}
+    for (outfile, (plotter, name, argmap, kwargs)) in figures.items():
+        path = os.path.join(cachedir, name + '.npz')
+        if not os.path.exists(path):
+            status[outfile] = 'no inputs'
+            continue
+        digest = _figure_hash(plotter, _load_inputs(path, argmap), kwargs)
+        if (not force and previous.get(outfile) == digest and
+                os.path.exists(outfile)):
+            status[outfile] = 'unchanged'
+        else:
+            todo[outfile] = ((plotter, path, argmap, kwargs, outfile), digest)
+
+    if todo:
+        # figures rendered before any failure are still recorded
+        try:
+            with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                futures = {outfile: pool.submit(_render, *args)
+                           for (outfile, (args, _)) in todo.items()}
+                for (outfile, future) in futures.items():
+                    future.result()
+                    previous[outfile] = todo[outfile][1]
+                    status[outfile] = 'rendered'
+        finally:
+            _write_manifest(previous, manifest)
+
+    return status
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--force', action='store_true',
+                        help='render every figure, changed or not')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='worker processes (default: number of CPUs)')
+    args = parser.parse_args(argv)
+
+    if os.path.exists(FULL_DATA_FILE):
+        save_eda_inputs(FULL_DATA_FILE)
+    t0 = time.perf_counter()
+    status = build_reports(force=args.force, n_jobs=args.jobs)
+    counts = [sum(v == s for v in status.values())
+              for s in ('rendered', 'unchanged', 'no inputs')]
+    print('{:d} rendered, {:d} unchanged, {:d} without saved inputs, in '
+          '{:0.1f} s'.format(*counts, time.perf_counter() - t0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,287 @@
+"""
+runstore - a local SQLite store of model evaluation runs
+========================================================
+
+**runstore** records every model evaluation run (model family, parameters,
+fingerprint of the training data, validation method (k-fold CV or out-of-bag)
+and its options, CV fold scores, test R2, fit/predict times, and the path of
+any saved artifact) in a local SQLite file, and can be
+queried so that configurations that were already evaluated on the same data
+are skipped instead of rerun
+"""
+
+import datetime
+import hashlib
+import json
+import sqlite3
+from contextlib import closing
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.model_selection import ParameterGrid
+
+RUNS_FILE = 'data/runs.sqlite'
+
+COLUMNS = ['id', 'model', 'params', 'data_fp', 'nfolds', 'cv_scores',
+           'cv_r2_mean', 'cv_r2_std', 'test_r2', 'fit_time_s',
+           'predict_time_s', 'artifact', 'created', 'method', 'search_kwargs']
+
+# columns added after the first version of the table: (name, SQL type)
+_ADDED_COLUMNS = [('method', "TEXT DEFAULT 'kfold'"),
+                  ('search_kwargs', 'TEXT')]
+
+_CREATE = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    model TEXT NOT NULL,
+    params TEXT NOT NULL,
+    data_fp TEXT NOT NULL,
+    nfolds INTEGER,
+    cv_scores TEXT,
+    cv_r2_mean REAL,
+    cv_r2_std REAL,
+    test_r2 REAL,
+    fit_time_s REAL,
+    predict_time_s REAL,
+    artifact TEXT,
+    created TEXT,
+    method TEXT DEFAULT 'kfold',
+    search_kwargs TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_config ON runs (model, params, data_fp);
+'''
+
+
+def fingerprint(X, y=None):
+    """ Short hash identifying a (dense or sparse) feature matrix and
+    response, so runs on different data are never mistaken for each other
+    """
+    h = hashlib.sha1(str(X.shape).encode())
+    if sparse.issparse(X):
+        X = X.tocsr()
+        parts = [X.data, X.indices, X.indptr]
+    else:
+        parts = [np.asarray(X)]
+    if y is not None:
+        parts.append(np.ravel(y))
+    for p in parts:
+        h.update(np.ascontiguousarray(p, dtype=np.float64).tobytes())
+    return h.hexdigest()[:16]
+
+
+def _params_key(params):
+    """ Canonical JSON string of a params dict (sorted keys) """
+    return json.dumps(params, sort_keys=True, default=str)
+
+
+def estimator_params(reg):
+    """ All the parameters an estimator is built with, i.e. with train's
+    DEFAULT_PARAMS and sklearn's own defaults merged in (nested ones of a
+    pipeline as <step>__<param>, without the step estimators themselves), so
+    that runs are keyed on what was actually fit
+    """
+    return {k: v for (k, v) in reg.get_params(deep=True).items()
+            if k != 'steps' and not hasattr(v, 'get_params')}
+
+
+class RunStore:
+    """ SQLite-backed store of evaluation runs
+
+    Kwargs:
+        path (str): SQLite database file (created if needed). Default is
+            'data/runs.sqlite'
+    """
+
+    def __init__(self, path=RUNS_FILE):
+        self.path = path
+        with closing(sqlite3.connect(self.path)) as con:
+            con.executescript(_CREATE)
+            # stores created before some columns were added
+            columns = [row[1] for row in
+                       con.execute('PRAGMA table_info(runs)')]
+            for (name, sql_type) in _ADDED_COLUMNS:
+                if name not in columns:
+                    with con:
+                        con.execute('ALTER TABLE runs ADD COLUMN {} {}'
+                                    .format(name, sql_type))
+
+    def _execute(self, sql, args=()):
+        """ Run one statement in its own transaction, return fetched rows and
+        the last row id
+        """
+        with closing(sqlite3.connect(self.path)) as con:
+            with con:
+                cur = con.execute(sql, args)
+                return (cur.fetchall(), cur.lastrowid)
+
+    def record(self, model, params, data_fp, nfolds=None, cv_scores=None,
+               test_r2=None, fit_time=None, predict_time=None, artifact=None,
+               method='kfold', search_kwargs=None):
+        """ Record one run
+
+        Args:
+            model (str): model family, e.g. 'rf' (see train.MODELS)
+            params (dict): model parameters
+            data_fp (str): training data fingerprint (see fingerprint())
+
+        Kwargs:
+            nfolds (int or None): number of CV folds (None for 'oob')
+            cv_scores (list or None): R2 score of each CV fold (the single
+                OOB R2 for 'oob')
+            test_r2 (float or None): test set R2
+            fit_time (float or None): seconds to fit (total over the folds)
+            predict_time (float or None): seconds to predict the test set
+            artifact (str or None): path of the saved model
+            method (str): 'kfold' (cross validation) or 'oob' (out-of-bag
+                predictions of a bagged forest). Default is 'kfold'
+            search_kwargs (dict or None): other validation options, e.g.
+                {'shuffle': True} (see search())
+
+        Returns:
+            run_id (int): id of the new run
+        """
+        if cv_scores is not None:
+            cv_scores = np.asarray(cv_scores, dtype=float)
+        row = (model, _params_key(params), data_fp, nfolds,
+               None if cv_scores is None else json.dumps(cv_scores.tolist()),
+               None if cv_scores is None else float(cv_scores.mean()),
+               None if cv_scores is None else float(cv_scores.std()),
+               None if test_r2 is None else float(test_r2),
+               None if fit_time is None else float(fit_time),
+               None if predict_time is None else float(predict_time),
+               artifact,
+               datetime.datetime.utcnow().isoformat(timespec='seconds'),
+               method,
+               None if search_kwargs is None else _params_key(search_kwargs))
+        (_, run_id) = self._execute(
+            'INSERT INTO runs ({}) VALUES ({})'.format(
+                ', '.join(COLUMNS[1:]), ', '.join('?'*len(row))), row)
+        return run_id
+
+    def record_report(self, model, params, data_fp, report, artifact=None,
+                      search_kwargs=None):
+        """ Record a run from an evaluate.evaluate_model() or
+        evaluate.evaluate_oob() report
+        """
+        test_r2 = None
+        if report['test_metrics'] is not None:
+            test_r2 = report['test_metrics']['r2']
+        method = report.get('method', 'kfold')
+        return self.record(model, params, data_fp,
+                           nfolds=(len(report['cv_scores'])
+                                   if method == 'kfold' else None),
+                           cv_scores=report['cv_scores'], test_r2=test_r2,
+                           fit_time=np.sum(report['fit_time']),
+                           predict_time=report['test_predict_time'],
+                           artifact=artifact, method=method,
+                           search_kwargs=search_kwargs)
+
+    def find(self, model=None, params=None, data_fp=None, nfolds=None,
+             method=None, search_kwargs=None):
+        """ Runs matching all the given filters (None = any), oldest first
+
+        Returns:
+            runs (DataFrame): one row per run, with params and cv_scores
+                decoded
+        """
+        filters = {'model': model, 'data_fp': data_fp, 'nfolds': nfolds,
+                   'method': method,
+                   'params': None if params is None else _params_key(params),
+                   'search_kwargs': (None if search_kwargs is None
+                                     else _params_key(search_kwargs))}
+        filters = {k: v for (k, v) in filters.items() if v is not None}
+        sql = 'SELECT {} FROM runs'.format(', '.join(COLUMNS))
+        if filters:
+            sql += ' WHERE ' + ' AND '.join('{} = ?'.format(k)
+                                            for k in filters)
+        (rows, _) = self._execute(sql + ' ORDER BY id',
+                                  tuple(filters.values()))
+
+        runs = pd.DataFrame(rows, columns=COLUMNS)
+        runs['params'] = [json.loads(p) for p in runs['params']]
+        runs['cv_scores'] = [None if s is None else json.loads(s)
+                             for s in runs['cv_scores']]
+        runs['search_kwargs'] = [None if s is None else json.loads(s)
+                                 for s in runs['search_kwargs']]
+        return runs.set_index('id')
+
+    def is_done(self, model, params, data_fp, nfolds=None, method=None,
+                search_kwargs=None):
+        """ True if this configuration was already evaluated on this data """
+        return len(self.find(model, params, data_fp, nfolds, method,
+                             search_kwargs)) > 0
+
+    def search(self, model, X, y, param_grid, nfolds=5, method='kfold',
+               **kwargs):
+        """ Validate every configuration of a parameter grid, skipping those
+        already in the store for the same data, and record the new ones.
+        Runs are keyed on the full estimator parameters (estimator_params(),
+        so a change of train.DEFAULT_PARAMS is a new configuration) and the
+        validation options (nfolds, method, and the other kwargs)
+
+        With method='oob', each configuration of a bagged forest (see
+        train.OOB_MODELS) is fit once and scored on its out-of-bag
+        predictions (evaluate.evaluate_oob()) instead of being fit nfolds
+        times, which cuts the cost of the search by about nfolds.
+
+        Args:
+            model (str): model family (see train.MODELS)
+            X, y (arrays): training data
+            param_grid (dict or list): as for sklearn's GridSearchCV
+
+        Kwargs:
+            nfolds (int): number of CV folds. Default is 5 (ignored for 'oob')
+            method (str): 'kfold' or 'oob'. Default is 'kfold'
+            other kwargs: passed to evaluate.evaluate_model() ('kfold' only)
+
+        Returns:
+            results (dict): dictionary with keys (like GridSearchCV's
+                cv_results_, in grid order):
+                'params' (list), 'mean_test_score', 'std_test_score' (arrays),
+                'run_ids' (list), 'n_skipped' (int), and 'best_params' (dict)
+        """
+        import evaluate
+        import train
+
+        if method not in ('kfold', 'oob'):
+            raise ValueError("method must be 'kfold' or 'oob'")
+        if method == 'oob':
+            if model not in train.OOB_MODELS:
+                raise ValueError('{} has no out-of-bag estimate, choose from {}'
+                                 .format(model, train.OOB_MODELS))
+            nfolds = None
+
+        data_fp = fingerprint(X, y)
+        search_kwargs = {} if method == 'oob' else kwargs
+        results = {'params': [], 'mean_test_score': [], 'std_test_score': [],
+                   'run_ids': [], 'n_skipped': 0}
+        for params in ParameterGrid(param_grid):
+            reg = train.make_model(model, **params)
+            run_params = estimator_params(reg)
+            runs = self.find(model, run_params, data_fp, nfolds, method,
+                             search_kwargs)
+            if len(runs) > 0:
+                results['n_skipped'] += 1
+            else:
+                if method == 'oob':
+                    report = evaluate.evaluate_oob(reg, X, y)
+                else:
+                    report = evaluate.evaluate_model(reg, X, y, nfolds=nfolds,
+                                                     refit=False, **kwargs)
+                self.record_report(model, run_params, data_fp, report,
+                                   search_kwargs=search_kwargs)
+                runs = self.find(model, run_params, data_fp, nfolds, method,
+                                 search_kwargs)
+
+            run = runs.iloc[-1]
+            results['params'].append(params)
+            results['mean_test_score'].append(run['cv_r2_mean'])
+            results['std_test_score'].append(run['cv_r2_std'])
+            results['run_ids'].append(int(runs.index[-1]))
+
+        results['mean_test_score'] = np.array(results['mean_test_score'])
+        results['std_test_score'] = np.array(results['std_test_score'])
+        best = int(np.argmax(results['mean_test_score']))
+        results['best_params'] = results['params'][best]
+
+        return results
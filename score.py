@@ -0,0 +1,234 @@
+"""
+score - batch dropout-rate predictions for the whole AACT registry
+==================================================================
+
+**score** gathers the features of every recruiting or planned interventional
+study in an AACT snapshot (with the same transformations as the training data,
+see data._gather_features), lines them up with a saved model's feature schema,
+and streams them in chunks through a pool of worker processes. Each worker
+loads the (memory-mapped) model once. Predictions and intervals are written
+chunk by chunk to a parquet file with columns nct_id, pred, lower, upper
+(writing parquet needs pyarrow, imported only when scoring). Usage::
+
+    python score.py data/reg_model2 reports/registry_scores.parquet \\
+        --interval data/reg_model2_quantile
+"""
+
+import argparse
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import artifact
+import data
+import selection
+
+# studies that are recruiting or planned
+SCORE_STATUSES = ('Recruiting', 'Not yet recruiting',
+                  'Enrolling by invitation')
+
+# output parquet columns (see _output_schema())
+OUTPUT_COLUMNS = ['nct_id', 'pred', 'lower', 'upper']
+
+# prefixes of the top-N term dummies, whose vocabulary is recomputed on each
+# gather: a training term the registry lacks is simply absent (False)
+TERM_PREFIXES = ('cond_', 'intv_', 'keyword_')
+
+# per-worker-process models, set by _init_worker()
+_WORKER = {}
+
+
+def gather_registry(statuses=SCORE_STATUSES, N=50):
+    """ Features of the registry studies with the given statuses, using the
+    same transformations (and top-N term vocabulary, N=50 as in
+    data.getmodeldata) as the training data. The number of participants
+    'completed' is the planned enrollment (see data._gather_features)
+
+    Returns:
+        df (DataFrame): features, indexed by nct_id
+    """
+    (df, _) = data._gather_features(N=N, fill_intelligent=True,
+                                    statuses=statuses, for_scoring=True)
+    return df
+
+
+def model_features(model_path):
+    """ Feature columns a saved model expects: the artifact's own, else the
+    saved reduced schema (see the selection module)
+    """
+    if os.path.isdir(model_path):
+        return artifact.read_meta(model_path)['feature_names']
+    feature_names = selection.load_schema()
+    if feature_names is None:
+        raise ValueError('{} does not record its feature names and there is '
+                         'no saved feature schema'.format(model_path))
+    return feature_names
+
+
+def align_features(df, feature_names):
+    """ Line up registry features with a model's feature columns: same
+    columns, in the same order. Terms outside the model's vocabulary are
+    dropped, and model terms (TERM_PREFIXES dummies) the registry lacks are
+    False. Any other missing model column is a ValueError
+    """
+    missing = [c for c in feature_names if c not in df.columns]
+    not_terms = [c for c in missing if not c.startswith(TERM_PREFIXES)]
+    if not_terms:
+        raise ValueError('registry features are missing model column(s): '
+                         '{}'.format(', '.join(not_terms)))
+    Xraw = df.reindex(columns=feature_names)
+    Xraw[missing] = False
+    return Xraw
+
+
+def _output_schema():
+    """ pyarrow schema of the output parquet file """
+    import pyarrow as pa
+
+    return pa.schema([('nct_id', pa.string())] +
+                     [(c, pa.float64()) for c in OUTPUT_COLUMNS[1:]])
+
+
+def check_interval_features(model_path, interval_path):
+    """ Raise a ValueError unless the interval model expects the same feature
+    columns, in the same order, as the point model (both are fed the rows
+    aligned to the point model's)
+    """
+    (point, interval) = (model_features(model_path),
+                         model_features(interval_path))
+    if list(point) != list(interval):
+        raise ValueError('{} and {} have different feature columns'
+                         .format(model_path, interval_path))
+
+
+def _interval_predictor(model):
+    """ Return function X -> (n_rows, 3) 2.5/50/97.5 quantiles of a quantile
+    model (skgarden QRF or anything with predict(X, quantiles))
+    """
+    if hasattr(model, 'y_train_leaves_'):
+        import quantile
+        model = quantile.QuantilePredictor.from_qrf(model)
+    return lambda X: model.predict(X, quantiles=(2.5, 50, 97.5))
+
+
+def _init_worker(model_path, interval_path):
+    """ Load the models once per worker process """
+    _WORKER['reg'] = artifact.load_model(model_path)
+    meta = getattr(_WORKER['reg'], 'meta', {}).get('metadata', {})
+    _WORKER['cube'] = meta.get('response_transform') == 'cuberoot'
+    _WORKER['interval'] = None
+    if interval_path is not None:
+        _WORKER['interval'] = _interval_predictor(
+            artifact.load_model(interval_path))
+
+
+def _score_chunk(X):
+    """ Predictions and 95% interval bounds (NaN without an interval model)
+    for one chunk of rows, in droprate units
+    """
+    pred = _WORKER['reg'].predict(X)
+    if _WORKER['cube']:
+        pred = pred**3
+    if _WORKER['interval'] is None:
+        (lower, upper) = (np.full(len(pred), np.nan),) * 2
+    else:
+        bounds = _WORKER['interval'](X)
+        (lower, upper) = (bounds[:, 0], bounds[:, 2])
+    return (pred, lower, upper)
+
+
+def score_registry(model_path, outfile, interval_path=None, df=None,
+                   chunksize=5000, n_jobs=None, statuses=SCORE_STATUSES):
+    """ Score registry studies in chunks, in parallel, into a parquet file
+
+    Args:
+        model_path (str): saved point model (artifact directory or pickle)
+        outfile (str): output parquet file
+
+    Kwargs:
+        interval_path (str or None): saved quantile model (e.g. the QRF
+            artifact or pickle) for the 2.5-97.5 interval, with the same
+            feature columns as the point model. Default is None (no
+            interval)
+        df (DataFrame or None): features to score, indexed by nct_id. If None,
+            gather them from the database (gather_registry())
+        chunksize (int): rows per chunk. Default is 5000
+        n_jobs (int or None): worker processes (None = number of CPUs). At
+            most 2*n_jobs chunks are in flight at a time
+        statuses (list): overall_status values to score. Default is
+            SCORE_STATUSES (recruiting or planned)
+
+    Returns:
+        stats (dict): 'n_rows' scored, 'n_skipped' (rows with missing
+            features), 'seconds', and 'rows_per_sec' (excl. gathering)
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if interval_path is not None:
+        check_interval_features(model_path, interval_path)
+    if df is None:
+        df = gather_registry(statuses=statuses)
+
+    Xraw = align_features(df, model_features(model_path))
+    complete = Xraw.notnull().all(axis=1).values
+    Xraw = Xraw[complete]
+    nct_id = Xraw.index.astype(str)
+
+    t0 = time.perf_counter()
+    X = data.tosparse(Xraw)
+    starts = range(0, X.shape[0], chunksize)
+    max_pending = 2*(n_jobs or os.cpu_count() or 1)
+    schema = _output_schema()
+
+    def write(i, future):
+        (pred, lower, upper) = future.result()
+        ids = nct_id[i:i+chunksize]
+        writer.write_table(pa.Table.from_arrays(
+            [pa.array(ids), pa.array(pred), pa.array(lower),
+             pa.array(upper)], schema=schema))
+
+    os.makedirs(os.path.dirname(outfile) or '.', exist_ok=True)
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker,
+                             initargs=(model_path, interval_path)) as pool, \
+            pq.ParquetWriter(outfile, schema) as writer:
+        # a bounded window of chunks in flight, written in chunk order as
+        # they finish, so memory does not grow with the registry size
+        pending = deque()
+        for i in starts:
+            if len(pending) == max_pending:
+                write(*pending.popleft())
+            pending.append((i, pool.submit(_score_chunk, X[i:i+chunksize])))
+        while pending:
+            write(*pending.popleft())
+    seconds = time.perf_counter() - t0
+
+    return {'n_rows': X.shape[0],
+            'n_skipped': int((~complete).sum()),
+            'seconds': seconds,
+            'rows_per_sec': X.shape[0]/seconds if seconds > 0 else np.nan}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('model', help='saved point model')
+    parser.add_argument('outfile', help='output parquet file')
+    parser.add_argument('--interval', default=None,
+                        help='saved quantile model for the 95%% interval')
+    parser.add_argument('--chunksize', type=int, default=5000)
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='worker processes (default: number of CPUs)')
+    args = parser.parse_args(argv)
+
+    stats = score_registry(args.model, args.outfile,
+                           interval_path=args.interval,
+                           chunksize=args.chunksize, n_jobs=args.jobs)
+    print('Scored {n_rows:d} studies ({n_skipped:d} skipped, missing '
+          'features) in {seconds:0.1f} s: {rows_per_sec:0.0f} rows/s'
+          .format(**stats))
+
+
+if __name__ == '__main__':
+    main()
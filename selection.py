@@ -0,0 +1,196 @@
+"""
+selection - feature pruning before training
+===========================================
+
+**selection** picks a reduced set of feature columns: those with a non-zero
+Lasso coefficient or a non-negligible random forest importance, after merging
+groups of strongly correlated columns (hierarchical clustering of the feature
+correlations, as in the data_exploration clustermap) down to one
+representative each. The result is saved as a column schema
+(data/feature_schema.json) that the playground scripts, the saved models
+(artifact feature_names) and the app all use
+"""
+
+import datetime
+import json
+import os
+import numpy as np
+import pandas as pd
+from scipy.cluster import hierarchy
+from scipy.spatial.distance import squareform
+
+SCHEMA_FILE = 'data/feature_schema.json'
+
+# numeric/boolean columns the dashboard always has a control for (app/app.py);
+# pass them as keep= so that every control changes the prediction. (Its term
+# dropdowns and checklists only offer the dummies in the schema)
+APP_INPUTS = ['completed', 'malefraction', 'minage', 'duration', 'arms',
+              'facilities', 'usfacility']
+
+
+def lasso_support(X, y, alpha=1e-5):
+    """ Lasso coefficients of (X, y) at alpha, fit by the lassopath module on
+    features scaled to unit l2 norm (the alpha of train's standardized Lasso
+    is lassopath.standardized_alpha(alpha, n_samples)), in standardized units
+    so they are comparable across features
+
+    Returns:
+        coef (array): (n_features,) standardized coefficients, zero for the
+            features the Lasso drops
+    """
+    import lassopath
+
+    stats = lassopath._raw_stats(X, np.ravel(y).astype(np.float64))
+    (_, coefs, _, _) = lassopath.lasso_path(None, y, [alpha], stats=stats)
+    X_scale = lassopath._normalized_gram(stats)[3]
+    return coefs[0]*X_scale
+
+
+def correlation(X):
+    """ Feature correlation matrix of a dense or sparse X, from X'X (a
+    constant column has zero correlation with everything but itself)
+    """
+    n = X.shape[0]
+    XtX = X.T @ X
+    XtX = XtX.toarray() if hasattr(XtX, 'toarray') else np.asarray(XtX)
+    mean = np.asarray(X.mean(axis=0), dtype=np.float64).ravel()
+    cov = XtX/n - np.outer(mean, mean)
+    std = np.sqrt(np.clip(np.diag(cov), 0, None))
+    std[std == 0] = np.inf
+    corr = cov/np.outer(std, std)
+    np.fill_diagonal(corr, 1.)
+    return corr
+
+
+def correlation_clusters(X, corr_threshold=0.9):
+    """ Cluster features so that every pair inside a cluster is, on average,
+    correlated by at least corr_threshold in absolute value (average-linkage
+    hierarchical clustering on 1 - |correlation|, cut at 1 - corr_threshold)
+
+    Returns:
+        labels (array): (n_features,) cluster id of each feature
+    """
+    dist = np.clip(1 - np.abs(correlation(X)), 0, None)
+    np.fill_diagonal(dist, 0)
+    Z = hierarchy.linkage(squareform(dist, checks=False), method='average')
+    return hierarchy.fcluster(Z, t=1 - corr_threshold, criterion='distance')
+
+
+def select_features(X, y, feature_names, importances=None, lasso_y=None,
+                    lasso_alpha=1e-5, importance_threshold=0.001,
+                    corr_threshold=0.9, rule='all', keep=()):
+    """ Select a reduced feature schema
+
+    A feature is a candidate if it has a non-zero Lasso coefficient and (or,
+    with rule='any') a forest importance of at least importance_threshold.
+    Candidates are then clustered by correlation, and only the most important
+    feature of each cluster (by forest importance, else by |standardized Lasso
+    coefficient|) is retained.
+
+    Args:
+        X (array or sparse matrix): training features
+        y (array): training response
+        feature_names (list): column names of X
+
+    Kwargs:
+        importances (array or None): forest feature_importances_. If None,
+            only the Lasso support is used
+        lasso_y (array or None): response for the Lasso (e.g. y**(1/3) as in
+            playground_model1). Default is y
+        lasso_alpha (float): Lasso alpha. Default is 1e-5
+        importance_threshold (float): min forest importance (importances sum
+            to 1). Default is 0.001
+        corr_threshold (float): |correlation| above which features are
+            merged. Default is 0.9
+        rule (str): 'all' to drop features that either the Lasso or the
+            forest finds useless, 'any' to drop only those both do. Default
+            is 'all'
+        keep (list): features that are always kept (e.g. the app's inputs)
+
+    Returns:
+        selected (list): selected feature names, in the original order
+        info (DataFrame): per-feature 'lasso_coef', 'importance', 'cluster',
+            and 'selected'
+    """
+    feature_names = list(feature_names)
+    coef = lasso_support(X, y if lasso_y is None else lasso_y,
+                         alpha=lasso_alpha)
+    info = pd.DataFrame({'lasso_coef': coef}, index=feature_names)
+    info['importance'] = np.nan if importances is None else importances
+
+    candidate = info['lasso_coef'] != 0
+    score = info['lasso_coef'].abs()
+    if importances is not None:
+        important = info['importance'] >= importance_threshold
+        if rule == 'all':
+            candidate &= important
+        elif rule == 'any':
+            candidate |= important
+        else:
+            raise ValueError("rule must be 'all' or 'any'")
+        score = info['importance']
+    candidate |= info.index.isin(keep)
+
+    # one representative per cluster of correlated candidates (linkage needs
+    # at least two; zero or one candidate is its own cluster)
+    info['cluster'] = 0
+    cols = np.nonzero(candidate.values)[0]
+    if len(cols) >= 2:
+        info.iloc[cols, info.columns.get_loc('cluster')] = \
+            correlation_clusters(X[:, cols], corr_threshold=corr_threshold)
+    best = score[candidate].groupby(info['cluster'][candidate]).idxmax()
+    info['selected'] = info.index.isin(best.values) | info.index.isin(keep)
+
+    selected = [f for f in feature_names if info.loc[f, 'selected']]
+    return (selected, info)
+
+
+def save_schema(feature_names, path=SCHEMA_FILE, metadata=None):
+    """ Save a reduced feature schema (JSON list of column names, in model
+    input order, plus metadata)
+    """
+    schema = {'feature_names': list(feature_names),
+              'metadata': metadata or {},
+              'created': datetime.datetime.utcnow().isoformat()}
+    tmpfile = path + '.tmp'
+    with open(tmpfile, 'w') as output_file:
+        json.dump(schema, output_file, indent=1)
+    os.replace(tmpfile, path)
+    return schema
+
+
+def load_schema(path=SCHEMA_FILE):
+    """ Feature names of the saved schema, or None if there is none """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as input_file:
+        return json.load(input_file)['feature_names']
+
+
+def compare_schemas(names, X, y, Xtest, ytest, feature_names, selected,
+                    params=None):
+    """ Latency and accuracy of model families before and after pruning
+
+    Args:
+        names (list): model families (see train.MODELS)
+        X, y, Xtest, ytest: training and test data with all the features
+        feature_names (list): column names of X
+        selected (list): reduced schema (subset of feature_names)
+
+    Kwargs:
+        params (dict or None): {name: params} overriding DEFAULT_PARAMS
+
+    Returns:
+        results (DataFrame): train.benchmark_models() columns, indexed by
+            (model, schema) with schema 'all' or 'selected'
+    """
+    import train
+
+    cols = [feature_names.index(f) for f in selected]
+
+    before = train.benchmark_models(names, X, y, Xtest, ytest, params=params)
+    after = train.benchmark_models(names, X[:, cols], y, Xtest[:, cols],
+                                   ytest, params=params)
+
+    return pd.concat({'all': before, 'selected': after},
+                     names=['schema']).swaplevel().sort_index()
@@ -0,0 +1,232 @@
+"""
+serving - lazy file loading and prediction caching for the dashboard
+====================================================================
+
+**serving** describes every file the dashboard (app/app.py) can use in one
+startup manifest (name -> loader and file) and loads each one only the first
+time it is asked for, logging how long it took. Serving itself only needs
+the model, the column metadata, and one default row with the feature column
+order (default_row.json, a few KB written by save_default_row()), so the
+training data pickles (Xraw, yraw, X, y) are never unpickled by a worker
+unless something actually uses them. PredictionCache puts a bounded,
+thread-safe LRU cache in front of the model, so input rows users come back
+to (e.g. moving a slider back and forth) are served without running it
+"""
+
+import json
+import logging
+import os
+import pickle as pk
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROW_FILE = 'default_row.json'
+
+
+def _load_pickle(path):
+    with open(path, 'rb') as input_file:
+        return pk.load(input_file)
+
+
+def _load_json(path):
+    with open(path, 'r') as input_file:
+        return json.load(input_file)
+
+
+def _load_model(path):
+    """ Model artifact directory if it exists, else <path>.pkl (see
+    artifact.load_model())
+    """
+    import artifact
+
+    if not os.path.isdir(path) and not os.path.exists(path):
+        path = path + '.pkl'
+    return artifact.load_model(path)
+
+
+LOADERS = {'pickle': _load_pickle,
+           'json': _load_json,
+           'model': _load_model}
+
+
+def app_manifest(model='reg_model2'):
+    """ Startup manifest of the dashboard: {name: (loader, path)}, with paths
+    relative to the app directory
+
+    Kwargs:
+        model (str): model artifact directory (or pickle without the .pkl).
+            Default is 'reg_model2'
+    """
+    return {'model': ('model', model),
+            'column_info': ('pickle', 'column_info.pkl'),
+            'default_row': ('json', DEFAULT_ROW_FILE),
+            # training data: not needed to serve predictions
+            'Xraw': ('pickle', 'Xraw_model1.pkl'),
+            'yraw': ('pickle', 'yraw_model1.pkl'),
+            'X': ('pickle', 'X_model1.pkl'),
+            'y': ('pickle', 'y_model1.pkl')}
+
+
+class LazyAssets:
+    """ Files from a manifest, each loaded on first access (assets[name]) and
+    then kept
+
+    Args:
+        manifest (dict): {name: (loader, path)}, loader a key of LOADERS
+
+    Kwargs:
+        basedir (str): directory the paths are relative to. Default is '.'
+
+    Attributes:
+        load_times (dict): {name: seconds} of every asset loaded so far
+    """
+
+    def __init__(self, manifest, basedir='.'):
+        self.manifest = dict(manifest)
+        self.basedir = basedir
+        self.load_times = {}
+        self._loaded = {}
+
+    def __contains__(self, name):
+        return name in self.manifest
+
+    def __getitem__(self, name):
+        if name not in self._loaded:
+            (loader, path) = self.manifest[name]
+            t0 = time.perf_counter()
+            self._loaded[name] = LOADERS[loader](
+                os.path.join(self.basedir, path))
+            self.load_times[name] = time.perf_counter() - t0
+            logger.info('loaded %s (%s) in %0.1f ms', name, path,
+                        self.load_times[name]*1e3)
+        return self._loaded[name]
+
+    def exists(self, name):
+        """ True if the file of asset name exists (without loading it) """
+        (loader, path) = self.manifest[name]
+        path = os.path.join(self.basedir, path)
+        if loader == 'model':
+            return os.path.exists(path) or os.path.exists(path + '.pkl')
+        return os.path.exists(path)
+
+    def is_loaded(self, name):
+        return name in self._loaded
+
+    def preload(self, names):
+        """ Load the given assets now (e.g. before forking workers) """
+        for name in names:
+            self[name]
+        return self
+
+
+def _to_json_value(value):
+    """ numpy scalars to python scalars """
+    return value.item() if hasattr(value, 'item') else value
+
+
+def save_default_row(Xraw, yraw, path=DEFAULT_ROW_FILE):
+    """ Save the feature column order and the first row of Xraw/yraw (the
+    dashboard's starting point) as a small JSON file
+
+    Args:
+        Xraw (DataFrame): raw features (data.getmodeldata())
+        yraw (DataFrame): raw response
+    """
+    row = {**Xraw.iloc[0].to_dict(), **yraw.iloc[0].to_dict()}
+    default_row = {'columns': Xraw.columns.tolist(),
+                   'row': {k: _to_json_value(v) for (k, v) in row.items()}}
+    tmpfile = path + '.tmp'
+    with open(tmpfile, 'w') as output_file:
+        json.dump(default_row, output_file)
+    os.replace(tmpfile, path)
+    return default_row
+
+
+def default_row(assets):
+    """ The dashboard's default row ({'columns': [...], 'row': {...}}): from
+    default_row.json, else derived once from the Xraw/yraw pickles (and saved
+    for the next start)
+    """
+    if assets.exists('default_row'):
+        return assets['default_row']
+    logger.info('%s not found, deriving it from Xraw/yraw',
+                assets.manifest['default_row'][1])
+    return save_default_row(
+        assets['Xraw'], assets['yraw'],
+        os.path.join(assets.basedir, assets.manifest['default_row'][1]))
+
+
+class PredictionCache:
+    """ Bounded LRU cache of a deterministic model's predictions, keyed by the
+    exact input row, safe to share between threads
+
+    Args:
+        predict (function): X -> predictions, e.g. reg.predict
+
+    Kwargs:
+        maxsize (int): max number of cached rows (least recently used are
+            evicted first). Default is 4096
+
+    Attributes:
+        hits, misses (int): lookup counts (see stats())
+    """
+
+    def __init__(self, predict, maxsize=4096):
+        self._predict = predict
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(X):
+        """ Canonical hashable encoding of an input: shape plus the float64,
+        C-ordered bytes (+ 0.0 maps -0.0 to 0.0, so equal rows get equal keys)
+        """
+        X = np.ascontiguousarray(X, dtype=np.float64) + 0.0
+        return (X.shape, X.tobytes())
+
+    def predict(self, X):
+        """ Predictions for X (typically one row), from the cache if X was
+        seen before. Returns a copy, so callers cannot alter cached values
+        """
+        key = self.key(X)
+        with self._lock:
+            pred = self._cache.get(key)
+            if pred is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return pred.copy()
+            self.misses += 1
+
+        # the model runs outside the lock, so misses do not block hits (two
+        # threads missing on the same row both compute it, harmlessly)
+        pred = np.array(self._predict(X))
+        with self._lock:
+            self._cache[key] = pred
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return pred.copy()
+
+    def stats(self):
+        """ {'hits', 'misses', 'hit_rate', 'size', 'maxsize'} """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits/lookups if lookups else 0.,
+                    'size': len(self._cache),
+                    'maxsize': self.maxsize}
+
+    def clear(self):
+        """ Empty the cache and reset the statistics """
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
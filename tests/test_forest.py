@@ -0,0 +1,52 @@
+""" FlatForest predictions and leaves against sklearn's """
+
+import numpy as np
+import pytest
+from scipy import sparse
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.tree import DecisionTreeRegressor
+import forest
+
+
+@pytest.fixture(scope='module')
+def data():
+    rng = np.random.RandomState(0)
+    X = rng.rand(500, 8)
+    X[:, 4:] = X[:, 4:] > 0.7
+    y = X[:, 0] + X[:, 1]*X[:, 4] + 0.1*rng.randn(500)
+    return (X, y, rng.permutation(X)[:200])
+
+
+MODELS = {
+    'tree': lambda: DecisionTreeRegressor(max_depth=8, random_state=0),
+    'forest': lambda: RandomForestRegressor(n_estimators=15, max_depth=10,
+                                            random_state=0),
+    # deeper than forest.COMPACT_DEPTH: exercises the compacted walk
+    'deep_forest': lambda: RandomForestRegressor(n_estimators=5,
+                                                 random_state=0),
+}
+
+
+@pytest.mark.parametrize('name', sorted(MODELS))
+@pytest.mark.parametrize('fmt', ['dense', 'csr'])
+def test_matches_sklearn(data, name, fmt):
+    (X, y, Xtest) = data
+    reg = MODELS[name]().fit(X, y)
+    flat = forest.FlatForest.from_sklearn(reg)
+    if name == 'deep_forest':
+        assert flat.max_depth > forest.COMPACT_DEPTH
+
+    Xin = sparse.csr_matrix(Xtest) if fmt == 'csr' else Xtest
+    np.testing.assert_allclose(flat.predict(Xin), reg.predict(Xtest),
+                               rtol=0, atol=1e-12)
+    expected = reg.apply(Xtest)
+    np.testing.assert_array_equal(flat.apply(Xin),
+                                  expected.reshape(len(Xtest), -1))
+
+
+def test_single_row(data):
+    (X, y, Xtest) = data
+    reg = MODELS['forest']().fit(X, y)
+    flat = forest.FlatForest.from_sklearn(reg)
+    np.testing.assert_allclose(flat.predict(Xtest[0]),
+                               reg.predict(Xtest[:1]), rtol=0, atol=1e-12)
@@ -0,0 +1,135 @@
+""" Parity of the vectorized quantile forest predictors with a row-by-row
+Meinshausen quantile regression forest reference """
+
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from scipy import sparse
+from sklearn.ensemble import RandomForestRegressor
+import quantile
+import train
+
+QUANTILES = (0, 2.5, 25, 50, 75, 97.5, 100)
+
+
+def weighted_percentile(a, q, weights):
+    """ skgarden's weighted_percentile: linear interpolation between the
+    midpoints of the cumulative weights of the sorted non-zero-weight values
+    """
+    sorter = np.argsort(a)
+    (a, weights) = (a[sorter], weights[sorter])
+    (a, weights) = (a[weights != 0], weights[weights != 0])
+    partial = 100.*(np.cumsum(weights) - weights/2)/weights.sum()
+    start = np.searchsorted(partial, q) - 1
+    if start == len(partial) - 1:
+        return a[-1]
+    if start == -1:
+        return a[0]
+    fraction = (q - partial[start])/(partial[start + 1] - partial[start])
+    return a[start] + fraction*(a[start + 1] - a[start])
+
+
+def reference_quantiles(forest, y_train, train_leaves, train_weights, X,
+                        quantiles=QUANTILES):
+    """ Quantiles of each row of X, one row and one quantile at a time: the
+    weight of training sample i is the sum over the trees of its tree weight
+    if it shares the row's leaf
+    """
+    leaves = forest.apply(X)
+    out = np.zeros((X.shape[0], len(quantiles)))
+    for (r, row_leaves) in enumerate(leaves):
+        w = ((train_leaves == row_leaves[:, np.newaxis])*train_weights
+             ).sum(axis=0)
+        out[r] = [weighted_percentile(y_train, q, w) for q in quantiles]
+    return out
+
+
+@pytest.fixture(scope='module')
+def data():
+    rng = np.random.RandomState(0)
+    X = rng.rand(300, 5)
+    X[:, 4] = X[:, 4] > 0.5
+    y = X[:, 0] + 0.5*X[:, 1]*X[:, 4] + 0.1*rng.randn(300)
+    Xtest = rng.rand(40, 5)
+    Xtest[:, 4] = Xtest[:, 4] > 0.5
+    return (X, y, Xtest)
+
+
+@pytest.fixture(scope='module')
+def forest(data):
+    (X, y, _) = data
+    return RandomForestRegressor(n_estimators=10, max_depth=6,
+                                 min_samples_leaf=3,
+                                 random_state=0).fit(X, y)
+
+
+@pytest.fixture(scope='module')
+def expected(data, forest):
+    """ Meinshausen weights: every training sample, 1/(leaf size) """
+    (X, y, Xtest) = data
+    train_leaves = forest.apply(X).T
+    weights = np.array([1./np.bincount(t)[t] for t in train_leaves])
+    return reference_quantiles(forest, y, train_leaves, weights, Xtest)
+
+
+def test_predictor_from_forest(data, forest, expected):
+    (X, y, Xtest) = data
+    qp = quantile.QuantilePredictor.from_forest(forest, X, y)
+    pred = qp.predict(Xtest, quantiles=QUANTILES)
+    np.testing.assert_allclose(pred, expected, atol=1e-5)
+
+
+def test_predictor_batches(data, forest, expected):
+    (X, y, Xtest) = data
+    qp = quantile.QuantilePredictor.from_forest(forest, X, y, batch_size=7)
+    np.testing.assert_allclose(qp.predict(Xtest, quantiles=QUANTILES),
+                               expected, atol=1e-5)
+
+
+def test_quantile_forest(data, forest, expected):
+    (X, y, Xtest) = data
+    qf = quantile.QuantileForest.from_forest(forest, X, y)
+    np.testing.assert_allclose(qf.predict(Xtest, quantiles=QUANTILES),
+                               expected, atol=1e-5)
+    np.testing.assert_allclose(qf.predict(Xtest), forest.predict(Xtest),
+                               atol=1e-6)
+
+
+def test_quantile_forest_sparse(data, forest, expected):
+    (X, y, Xtest) = data
+    qf = quantile.QuantileForest.from_forest(forest, sparse.csr_matrix(X), y)
+    np.testing.assert_allclose(
+        qf.predict(sparse.csr_matrix(Xtest), quantiles=QUANTILES), expected,
+        atol=1e-5)
+
+
+def test_from_qrf_in_bag_weights(data, forest):
+    """ skgarden-style attributes: per-tree weights that are zero for the
+    out-of-bag samples """
+    (X, y, Xtest) = data
+    rng = np.random.RandomState(1)
+    train_leaves = forest.apply(X).T
+    weights = rng.poisson(1., train_leaves.shape).astype(float)
+    for (t, leaves) in enumerate(train_leaves):
+        sizes = np.bincount(leaves, weights=weights[t])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weights[t] = np.where(weights[t] > 0,
+                                  weights[t]/sizes[leaves], 0)
+    rfqr = SimpleNamespace(estimators_=forest.estimators_, apply=forest.apply,
+                           y_train_=y, y_train_leaves_=train_leaves,
+                           y_weights_=weights)
+
+    expected = reference_quantiles(forest, y, train_leaves, weights, Xtest)
+    for cls in [quantile.QuantilePredictor, quantile.QuantileForest]:
+        pred = cls.from_qrf(rfqr).predict(Xtest, quantiles=QUANTILES)
+        np.testing.assert_allclose(pred, expected, atol=1e-5)
+
+
+def test_train_quantile_random_forest(data, expected):
+    """ the served QRF family: same trees (same seed), same quantiles """
+    (X, y, Xtest) = data
+    qrf = train.QuantileRandomForest(n_estimators=10, max_depth=6,
+                                     min_samples_leaf=3,
+                                     random_state=0).fit(X, y)
+    np.testing.assert_allclose(qrf.predict(Xtest, quantiles=QUANTILES),
+                               expected, atol=1e-5)
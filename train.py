@@ -0,0 +1,268 @@
+"""
+train - a module to build, fit, and compare dropout-rate models
+===============================================================
+
+**train** is the training driver for the dropout-rate models. It keeps one
+registry of model families (Lasso, decision tree, random forest, quantile
+random forest, and histogram gradient boosting) with the default
+hyperparameters used in the playground scripts, and helpers to fit them and
+compare fit time, predict latency, and test R2
+"""
+
+import time
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn import linear_model
+from sklearn.base import BaseEstimator, RegressorMixin
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import r2_score
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.tree import DecisionTreeRegressor
+try:
+    from sklearn.ensemble import HistGradientBoostingRegressor
+except ImportError:
+    # sklearn < 1.0: still experimental
+    from sklearn.experimental import enable_hist_gradient_boosting  # noqa
+    from sklearn.ensemble import HistGradientBoostingRegressor
+
+
+# Default hyperparameters (the best params found in the playground scripts;
+# max_features=75 of the 170 columns is given as a fraction so it also fits
+# reduced feature schemas, see the selection module). The Lasso runs on
+# standardized features (see _lasso()): the playground's alpha=1e-5 with
+# Lasso(normalize=True) is alpha=1e-5*sqrt(n_samples) on standardized columns,
+# i.e. about 6e-4 for the ~3400 training rows. The randomized families are
+# seeded, so refits (and their timings & sizes) are reproducible
+DEFAULT_PARAMS = {
+    'lasso': {'alpha': 6e-4},
+    'dtree': {'random_state': 0},
+    'rf': {'n_estimators': 20, 'max_depth': 10, 'max_features': 0.45,
+           'min_samples_leaf': 5, 'random_state': 0},
+    'qrf': {'n_estimators': 20, 'max_depth': 10, 'max_features': 0.45,
+            'min_samples_leaf': 5, 'random_state': 0},
+    'hgb': {'max_iter': 500, 'learning_rate': 0.1, 'max_leaf_nodes': 31,
+            'min_samples_leaf': 20, 'early_stopping': True,
+            'validation_fraction': 0.1, 'n_iter_no_change': 10,
+            'random_state': 0},
+    'hgb_quantile': {'quantiles': (2.5, 50, 97.5), 'max_iter': 500,
+                     'learning_rate': 0.1, 'max_leaf_nodes': 31,
+                     'min_samples_leaf': 20, 'early_stopping': True,
+                     'validation_fraction': 0.1, 'n_iter_no_change': 10,
+                     'random_state': 0},
+}
+
+
+class QuantileBoosting(BaseEstimator, RegressorMixin):
+    """ Histogram gradient boosting with quantile loss, one model per quantile
+
+    Features are pre-binned once per model (at most max_bins bins, and the
+    mostly boolean/small-integer columns here need far fewer), and each model
+    trains multithreaded (OpenMP) with early stopping. Needs sklearn >= 1.1
+    for loss='quantile'.
+
+    Kwargs:
+        quantiles (list): quantiles to fit, each in [0, 100]. Default is
+            (2.5, 50, 97.5)
+        other kwargs: passed to each HistGradientBoostingRegressor
+    """
+
+    def __init__(self, quantiles=(2.5, 50, 97.5), max_iter=500,
+                 learning_rate=0.1, max_leaf_nodes=31, max_depth=None,
+                 min_samples_leaf=20, l2_regularization=0., max_bins=255,
+                 early_stopping=True, validation_fraction=0.1,
+                 n_iter_no_change=10, random_state=None):
+        self.quantiles = quantiles
+        self.max_iter = max_iter
+        self.learning_rate = learning_rate
+        self.max_leaf_nodes = max_leaf_nodes
+        self.max_depth = max_depth
+        self.min_samples_leaf = min_samples_leaf
+        self.l2_regularization = l2_regularization
+        self.max_bins = max_bins
+        self.early_stopping = early_stopping
+        self.validation_fraction = validation_fraction
+        self.n_iter_no_change = n_iter_no_change
+        self.random_state = random_state
+
+    def fit(self, X, y):
+        params = self.get_params()
+        del params['quantiles']
+        self.estimators_ = []
+        for q in self.quantiles:
+            est = HistGradientBoostingRegressor(loss='quantile',
+                                                quantile=q/100., **params)
+            self.estimators_.append(est.fit(X, y))
+        return self
+
+    def predict(self, X, quantiles=None):
+        """ Predict quantiles for X
+
+        Kwargs:
+            quantiles (list or None): fitted quantiles to predict. If None
+                (default), return the median (or middle fitted quantile) as
+                a 1-d array, like a point model. Otherwise return an array of
+                shape (n_rows, len(quantiles))
+        """
+        if quantiles is None:
+            q = 50 if 50 in self.quantiles else \
+                sorted(self.quantiles)[len(self.quantiles)//2]
+            return self.estimators_[list(self.quantiles).index(q)].predict(X)
+
+        return np.column_stack(
+            [self.estimators_[list(self.quantiles).index(q)].predict(X)
+             for q in quantiles])
+
+
+def _lasso(**params):
+    """ Lasso on standardized features (Lasso(normalize=True) was removed in
+    sklearn 1.2). The scaler only divides by the column std (with_mean=False),
+    so sparse X stays sparse; the Lasso's intercept takes care of centering
+    """
+    return make_pipeline(StandardScaler(with_mean=False),
+                         linear_model.Lasso(**params))
+
+
+class QuantileRandomForest(RandomForestRegressor):
+    """ Random forest that also predicts quantiles (quantile regression
+    forest): the fitted trees plus every training target in its leaf of each
+    tree, stored as a quantile.QuantileForest. Plain sklearn, so it runs on
+    the same sklearn versions as the other families (skgarden's
+    RandomForestQuantileRegressor needs an old one). Same parameters as
+    RandomForestRegressor
+    """
+
+    def fit(self, X, y, sample_weight=None):
+        import quantile
+
+        super().fit(X, y, sample_weight=sample_weight)
+        self.quantile_forest_ = quantile.QuantileForest.from_forest(self, X, y)
+        return self
+
+    def predict(self, X, quantiles=None):
+        """ Predict the mean (quantiles=None, the default), or an array of
+        shape (n_rows, len(quantiles)) of quantiles, each in [0, 100]
+        """
+        if quantiles is None:
+            return super().predict(X)
+        return self.quantile_forest_.predict(X, quantiles=quantiles)
+
+
+# model family name -> constructor
+MODELS = {'lasso': _lasso,
+          'dtree': DecisionTreeRegressor,
+          'rf': RandomForestRegressor,
+          'qrf': QuantileRandomForest,
+          'hgb': HistGradientBoostingRegressor,
+          'hgb_quantile': QuantileBoosting}
+
+# families that can predict quantiles with predict(X, quantiles)
+QUANTILE_MODELS = ['qrf', 'hgb_quantile']
+
+# families that fit and predict on scipy sparse (CSR) X directly; the others
+# get a dense copy
+SPARSE_MODELS = ['lasso', 'dtree', 'rf', 'qrf']
+
+# bagged forests, which can be validated on their out-of-bag predictions
+# (evaluate.evaluate_oob) with one fit instead of k
+OOB_MODELS = ['rf', 'qrf']
+
+
+def make_model(name, **params):
+    """ Return an unfitted model of family name, with DEFAULT_PARAMS updated
+    by params
+    """
+    if name not in MODELS:
+        raise ValueError('Unknown model {}, choose from {}'
+                         .format(name, sorted(MODELS)))
+    return MODELS[name](**{**DEFAULT_PARAMS[name], **params})
+
+
+def _densify(name, X):
+    """ Dense copy of a sparse X for the families not in SPARSE_MODELS """
+    if sparse.issparse(X) and name not in SPARSE_MODELS:
+        return X.toarray()
+    return X
+
+
+def fit_model(name, X, y, **params):
+    """ Make & fit a model of family name. X may be a scipy sparse matrix
+    (e.g. from data.tosparse()); it is only densified for families not in
+    SPARSE_MODELS
+
+    Returns:
+        reg (estimator): fitted model
+        fit_time (float): seconds to fit
+    """
+    reg = make_model(name, **params)
+    X = _densify(name, X)
+    t0 = time.perf_counter()
+    reg.fit(X, y)
+    return (reg, time.perf_counter() - t0)
+
+
+def _best_time(func, n_repeats):
+    """ best-of-n_repeats run time of func() in seconds """
+    best = np.inf
+    for _ in range(n_repeats):
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def _interval_predict(reg):
+    """ Return function X -> (n_rows, 3) array of 2.5/50/97.5 quantiles """
+    return lambda X: reg.predict(X, quantiles=(2.5, 50, 97.5))
+
+
+def benchmark_models(names, X, y, Xtest, ytest, params=None, n_repeats=10):
+    """ Fit several model families and compare fit time, predict latency and
+    test R2
+
+    Args:
+        names (list): model family names (keys of MODELS), e.g.
+            ['rf', 'qrf', 'hgb', 'hgb_quantile']
+        X, y (arrays): training data (X may be sparse, see fit_model())
+        Xtest, ytest (arrays): test data
+
+    Kwargs:
+        params (dict or None): {name: params} overriding DEFAULT_PARAMS
+        n_repeats (int): timing repeats for predictions (best is kept)
+
+    Returns:
+        results (DataFrame): one row per model with fit time (s), single-row
+            and full-test-set predict latency (ms), test R2, and for quantile
+            models the full-test-set 2.5/50/97.5 interval latency (ms) and
+            interval coverage of the test set
+    """
+    params = params or {}
+    ytest = np.ravel(ytest)
+
+    rows = []
+    for name in names:
+        (reg, fit_time) = fit_model(name, X, y, **params.get(name, {}))
+        Xt = _densify(name, Xtest)
+        row = {'model': name,
+               'fit_time_s': fit_time,
+               'predict_1row_ms': _best_time(lambda: reg.predict(Xt[:1]),
+                                             n_repeats)*1e3,
+               'predict_batch_ms': _best_time(lambda: reg.predict(Xt),
+                                              n_repeats)*1e3,
+               'test_r2': r2_score(ytest, reg.predict(Xt)),
+               'interval_batch_ms': np.nan,
+               'interval_coverage': np.nan}
+
+        if name in QUANTILE_MODELS:
+            interval = _interval_predict(reg)
+            row['interval_batch_ms'] = _best_time(lambda: interval(Xt),
+                                                  n_repeats)*1e3
+            bounds = interval(Xt)
+            row['interval_coverage'] = np.mean((ytest >= bounds[:, 0]) &
+                                               (ytest <= bounds[:, 2]))
+        rows.append(row)
+        print('{}: fit {:0.2f} s, test R2 {:0.3f}'.format(name, fit_time,
+                                                        row['test_r2']))
+
+    return pd.DataFrame(rows).set_index('model')